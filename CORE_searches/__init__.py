@@ -1 +1,4 @@
-from .helper_functions import *
\ No newline at end of file
+from .helper_functions import *
+from .homonym_matcher import *
+from .fuzzy_matcher import *
+from .instrumentation import *
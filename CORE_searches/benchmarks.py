@@ -0,0 +1,398 @@
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import List, Tuple
+
+sys.path.append('..')
+
+import search_for_ambiguity
+from CORE_searches import load_filter_dict, longest_ambiguous_homonym, longest_potential_disambiguator, HomonymMatcher, build_filter_dict, \
+    load_matcher, matcher_path, get_matcher_metadata, clean_paper_text, \
+    clean_string, tokenise_paper_text, FuzzyDisambiguatorIndex, MIN_FUZZY_WORD_LENGTH
+from search_for_ambiguity import find_ambiguous_uses
+from synthetic_corpus import FILLER_WORDS, make_synthetic_text, make_sectioned_text, write_synthetic_corpus, make_synthetic_filter_dict
+
+# Throughputs recorded by run_benchmark_suite, all higher is better
+SUITE_METRICS = ['clean_paper_text_mb_per_sec', 'find_ambiguous_uses_papers_per_sec', 'find_ambiguous_uses_mb_per_sec',
+                 'provider_loop_papers_per_sec', 'provider_loop_mb_per_sec']
+# Throughputs this much below the baseline are reported as regressions
+REGRESSION_TOLERANCE = 0.2
+
+
+def _same_results(a, b) -> bool:
+    return set(a[0]) == set(b[0]) and set(a[1]) == set(b[1]) and {k: set(v) for k, v in a[2].items()} == {k: set(v) for k, v in
+                                                                                                           b[2].items()}
+
+
+def get_lists_of_words(words: List[str], largest_phrase: int) -> List[str]:
+    out_list = words.copy()
+    to_check = range(2, largest_phrase + 1)
+    for i in to_check:
+        out_list += [" ".join([words[j + c] for c in range(i)]) for j in range(len(words) - i + 1)]
+    return out_list
+
+
+def find_ambiguous_uses_with_ngrams(text: str, filter_dict: dict, homonyms: set) -> Tuple[List[str], List[str], dict]:
+    '''
+    Original n-gram set intersection approach, which find_ambiguous_uses replaced and should agree with. Kept as the baseline of
+    benchmark_matcher and the reference of tests/test_homonym_matcher.py.
+    '''
+    clean_body_text_list = clean_paper_text(text).split()
+    potential_homonym_uses = get_lists_of_words(clean_body_text_list, longest_ambiguous_homonym)
+    intersection = set(potential_homonym_uses) & homonyms
+    if len(intersection) > 0:
+        homonym_uses = list(intersection)
+        ambiguous_uses = []
+        disambiguators = {}
+        clean_text_anywhere_list = clean_string(text).split()
+        potential_disambiguators = set(get_lists_of_words(clean_text_anywhere_list, longest_potential_disambiguator))
+        for homonym in homonym_uses:
+            disambiguators[homonym] = list(filter_dict[homonym] & potential_disambiguators)
+            if len(disambiguators[homonym]) == 0:
+                ambiguous_uses.append(homonym)
+                del disambiguators[homonym]
+        return homonym_uses, ambiguous_uses, disambiguators
+    else:
+        return [], [], {}
+
+
+def benchmark_matcher(text_lengths=(1000, 10000, 100000), homonym_density: float = 0.001, repeats: int = 3):
+    """
+    Time building and loading the matcher, and compare find_ambiguous_uses with the original n-gram intersection on texts of each
+    length, checking they give the same results.
+    """
+    loaded_filter_dict = load_filter_dict()
+    homonyms = set(loaded_filter_dict.keys())
+
+    start = time.perf_counter()
+    matcher = HomonymMatcher(loaded_filter_dict, longest_ambiguous_homonym, longest_potential_disambiguator)
+    print(f'Built matcher in {round(time.perf_counter() - start, 2)}s')
+    start = time.perf_counter()
+    load_matcher(matcher_path, get_matcher_metadata())
+    print(f'Loaded saved matcher in {round((time.perf_counter() - start) * 1000, 2)}ms')
+    search_for_ambiguity.homonym_matcher = matcher
+
+    for length in text_lengths:
+        text = make_synthetic_text(loaded_filter_dict, length, homonym_density)
+
+        start = time.perf_counter()
+        for _ in range(repeats):
+            ngram_result = find_ambiguous_uses_with_ngrams(text, loaded_filter_dict, homonyms)
+        ngram_time = (time.perf_counter() - start) / repeats
+
+        start = time.perf_counter()
+        for _ in range(repeats):
+            matcher_result = find_ambiguous_uses(text)
+        matcher_time = (time.perf_counter() - start) / repeats
+
+        if not _same_results(ngram_result, matcher_result):
+            raise ValueError(f'Matcher results differ from n-gram results for text of {length} words')
+        print(f'{length} words: n-grams {round(ngram_time, 4)}s, matcher {round(matcher_time, 4)}s '
+              f'({round(ngram_time / matcher_time, 1)}x)')
+
+
+def benchmark_mapped_matcher(text_lengths=(1000, 10000, 100000), homonym_density: float = 0.001, repeats: int = 3,
+                             number_of_homonyms: int = 2000):
+    """
+    Compare scanning tokens with a HomonymMatcher and the MappedHomonymMatcher that workers load from its saved file, on synthetic
+    homonyms so the saved matcher of the project isn't needed.
+    """
+    synthetic_filter_dict = make_synthetic_filter_dict(number_of_homonyms)
+    matcher = HomonymMatcher(synthetic_filter_dict, longest_ambiguous_homonym, longest_potential_disambiguator)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        synthetic_matcher_path = os.path.join(temp_dir, 'homonym_matcher.bin')
+        matcher.save(synthetic_matcher_path)
+        start = time.perf_counter()
+        mapped_matcher = load_matcher(synthetic_matcher_path)
+        print(f'Loaded saved matcher in {round((time.perf_counter() - start) * 1000, 2)}ms')
+
+        for length in text_lengths:
+            tokens = clean_string(make_synthetic_text(synthetic_filter_dict, length, homonym_density)).split()
+            times = {}
+            results = {}
+            for name, m in [('built', matcher), ('mapped', mapped_matcher)]:
+                start = time.perf_counter()
+                for _ in range(repeats):
+                    results[name] = (m.find_homonyms(tokens), m.find_disambiguators(tokens))
+                times[name] = (time.perf_counter() - start) / repeats
+            if results['built'] != results['mapped']:
+                raise ValueError(f'Mapped matcher results differ for text of {length} words')
+            print(f'{length} words: built {round(length / times["built"] / 1000, 1)}k words/s, '
+                  f'mapped {round(length / times["mapped"] / 1000, 1)}k words/s '
+                  f'({round(times["mapped"] / times["built"], 2)}x the time)')
+
+
+def benchmark_text_cleaning(text_lengths=(1000, 10000, 100000), repeats: int = 3):
+    '''
+    Compare throughput of tokenise_paper_text with cleaning the body and whole text separately. The body found is checked against
+    splitting the text at each heading in tests/test_text_cleaning.py.
+    '''
+    loaded_filter_dict = load_filter_dict()
+    for length in text_lengths:
+        text = make_sectioned_text(loaded_filter_dict, length)
+        size_mb = len(text.encode('utf-8')) / 2 ** 20
+
+        start = time.perf_counter()
+        for _ in range(repeats):
+            separate_body, separate_anywhere = clean_paper_text(text).split(), clean_string(text).split()
+        separate_time = (time.perf_counter() - start) / repeats
+
+        start = time.perf_counter()
+        for _ in range(repeats):
+            body, anywhere = tokenise_paper_text(text)
+        tokenise_time = (time.perf_counter() - start) / repeats
+
+        if body != separate_body or anywhere != separate_anywhere:
+            raise ValueError(f'Tokenised text differs from cleaned text for text of {length} words')
+        print(f'{length} words: cleaning separately {round(size_mb / separate_time, 1)} MB/s, tokenising {round(size_mb / tokenise_time, 1)} MB/s')
+
+
+def _iter_provider_texts(provider_tar_path: str):
+    with tarfile.open(provider_tar_path, 'r') as sub_archive:
+        for paper_member in sub_archive:
+            if paper_member.name.endswith('.json'):
+                text = json.loads(sub_archive.extractfile(paper_member).readline())['fullText']
+                if text is not None:
+                    yield text
+
+
+def benchmark_prefilter(provider_tar_path: str = None, number_of_texts: int = 1000):
+    '''
+    Measure how many texts the genus prefilter rejects and the speedup it gives, checking that it never changes results.
+    :param provider_tar_path: a provider archive from the CORE download to sample texts from, otherwise synthetic texts are used
+    :param number_of_texts: number of synthetic texts
+    :return:
+    '''
+    loaded_filter_dict = load_filter_dict()
+    search_for_ambiguity.homonym_matcher = HomonymMatcher(loaded_filter_dict, longest_ambiguous_homonym, longest_potential_disambiguator)
+    if provider_tar_path is not None:
+        texts = list(_iter_provider_texts(provider_tar_path))
+    else:
+        # Mostly texts without homonyms, as in CORE
+        texts = [make_synthetic_text(loaded_filter_dict, 5000, 0.0005 if i % 20 == 0 else 0, seed=i) for i in range(number_of_texts)]
+
+    start = time.perf_counter()
+    unfiltered_results = [find_ambiguous_uses(text, prefilter=False) for text in texts]
+    unfiltered_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    filtered_results = [find_ambiguous_uses(text, prefilter=True) for text in texts]
+    filtered_time = time.perf_counter() - start
+
+    for unfiltered, filtered in zip(unfiltered_results, filtered_results):
+        if not _same_results(unfiltered, filtered):
+            raise ValueError('Prefilter changed the results for a text')
+    rejected = sum(not search_for_ambiguity.homonym_matcher.may_contain_homonyms(text) for text in texts)
+    print(f'Prefilter rejected {rejected} of {len(texts)} texts ({round(100 * rejected / len(texts), 1)}%). '
+          f'Without prefilter {round(unfiltered_time, 2)}s, with prefilter {round(filtered_time, 2)}s')
+
+
+def benchmark_filter_dict():
+    '''
+    Time building the filter dictionary from the ambiguous homonyms. Its terms are checked against the original per-name loop in
+    tests/test_filter_dict.py.
+    '''
+    start = time.perf_counter()
+    filter_dict = build_filter_dict()
+    print(f'Filter dictionary of {len(filter_dict)} homonyms built in {round(time.perf_counter() - start, 2)}s')
+
+
+def _add_edit(word: str, rng: random.Random) -> str:
+    # One substitution, deletion, insertion or transposition, as from a misspelling or OCR error
+    i = rng.randrange(len(word) - 1)
+    letter = rng.choice('abcdefghijklmnopqrstuvwxyz')
+    edit = rng.choice(['substitute', 'delete', 'insert', 'transpose'])
+    if edit == 'substitute':
+        return word[:i] + letter + word[i + 1:]
+    if edit == 'delete':
+        return word[:i] + word[i + 1:]
+    if edit == 'insert':
+        return word[:i] + letter + word[i:]
+    return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+
+def _make_noisy_disambiguator_text(fuzzy_index: FuzzyDisambiguatorIndex, number_of_words: int, number_of_homonyms: int,
+                                   rng: random.Random) -> str:
+    # Homonyms each followed later by one of their disambiguators with an edit in an author word
+    words = [rng.choice(FILLER_WORDS) for _ in range(number_of_words)]
+    homonyms = [h for h in sorted(fuzzy_index.filter_dict) if len(fuzzy_index.filter_dict[h]) > 0]
+    for _ in range(number_of_homonyms):
+        homonym = rng.choice(homonyms)
+        disambiguator_words = rng.choice(fuzzy_index.filter_dict[homonym]).split(' ')
+        long_word_positions = [i for i, w in enumerate(disambiguator_words) if len(w) >= MIN_FUZZY_WORD_LENGTH and
+                              w not in homonym.split(' ')]
+        if len(long_word_positions) > 0:
+            i = rng.choice(long_word_positions)
+            disambiguator_words[i] = _add_edit(disambiguator_words[i], rng)
+        words.insert(rng.randrange(len(words)), homonym)
+        words.append(' '.join(disambiguator_words))
+    return ' '.join(words)
+
+
+def benchmark_fuzzy_disambiguators(number_of_texts: int = 200, number_of_words: int = 5000, max_edit_distance: int = 1):
+    '''
+    Compare how many homonyms are disambiguated with exact and fuzzy matching of author words in texts with misspelt authors, and
+    the time per text of each. Checks that fuzzy matching only ever adds disambiguators.
+    '''
+    loaded_filter_dict = load_filter_dict()
+    search_for_ambiguity.homonym_matcher = HomonymMatcher(loaded_filter_dict, longest_ambiguous_homonym, longest_potential_disambiguator)
+    start = time.perf_counter()
+    fuzzy_index = FuzzyDisambiguatorIndex(loaded_filter_dict, longest_potential_disambiguator, max_edit_distance)
+    print(f'Built fuzzy index in {round(time.perf_counter() - start, 2)}s')
+
+    rng = random.Random(0)
+    texts = [_make_noisy_disambiguator_text(fuzzy_index, number_of_words, 3, rng) for _ in range(number_of_texts)]
+
+    search_for_ambiguity.fuzzy_index = None
+    start = time.perf_counter()
+    exact_results = [find_ambiguous_uses(text) for text in texts]
+    exact_time = (time.perf_counter() - start) / number_of_texts
+
+    search_for_ambiguity.fuzzy_index = fuzzy_index
+    start = time.perf_counter()
+    fuzzy_results = [find_ambiguous_uses(text) for text in texts]
+    fuzzy_time = (time.perf_counter() - start) / number_of_texts
+    search_for_ambiguity.fuzzy_index = None
+
+    for exact, fuzzy in zip(exact_results, fuzzy_results):
+        if set(exact[0]) != set(fuzzy[0]) or any(set(v) - set(fuzzy[2].get(k, [])) for k, v in exact[2].items()):
+            raise ValueError('Fuzzy matching lost a homonym or disambiguator found by exact matching')
+    number_of_uses = sum(len(result[0]) for result in exact_results)
+    exact_disambiguated = sum(len(result[2]) for result in exact_results)
+    fuzzy_disambiguated = sum(len(result[2]) for result in fuzzy_results)
+    print(f'Disambiguated {exact_disambiguated} of {number_of_uses} homonym uses exactly, {fuzzy_disambiguated} with fuzzy authors. '
+          f'Per text: exact {round(exact_time * 1000, 2)}ms, fuzzy {round(fuzzy_time * 1000, 2)}ms ({round(fuzzy_time / exact_time, 2)}x)')
+
+
+def _get_git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _benchmark_provider_loop(filter_dict: dict, corpus_dir: str, processes: int, **corpus_config) -> dict:
+    # Search a synthetic archive with get_relevant_papers_from_download, using a matcher of filter_dict and saving everything to
+    # corpus_dir rather than the project
+    corpus_path = os.path.join(corpus_dir, 'synthetic_dataset.tar')
+    corpus = write_synthetic_corpus(corpus_path, filter_dict, **corpus_config)
+    synthetic_matcher_path = os.path.join(corpus_dir, 'homonym_matcher.bin')
+    synthetic_metadata = {'synthetic_homonyms': len(filter_dict), 'longest_ambiguous_homonym': longest_ambiguous_homonym,
+                          'longest_potential_disambiguator': longest_potential_disambiguator}
+    HomonymMatcher(filter_dict, longest_ambiguous_homonym, longest_potential_disambiguator).save(synthetic_matcher_path,
+                                                                                               synthetic_metadata)
+    start = time.perf_counter()
+    search_for_ambiguity.get_relevant_papers_from_download(processes=processes, core_tar_file=corpus_path,
+                                                           paper_info_dataset_path=os.path.join(corpus_dir, 'paper_info_dataset'),
+                                                           instrumentation_path=os.path.join(corpus_dir, 'instrumentation'),
+                                                           legacy_paper_info_path=os.path.join(corpus_dir, 'paper_info'),
+                                                           given_matcher_path=synthetic_matcher_path,
+                                                           expected_metadata=synthetic_metadata)
+    loop_time = time.perf_counter() - start
+    number_of_papers = corpus['number_of_providers'] * corpus['papers_per_provider']
+    return {'corpus': corpus, 'provider_loop_seconds': loop_time, 'provider_loop_papers_per_sec': number_of_papers / loop_time,
+            'provider_loop_mb_per_sec': corpus['text_bytes'] / 2 ** 20 / loop_time}
+
+
+def run_benchmark_suite(output_json: str = None, number_of_texts: int = 200, words_per_paper: int = 5000,
+                        homonym_density: float = 0.001, number_of_providers: int = 4, papers_per_provider: int = 100,
+                        compression: str = 'xz', processes: int = None, number_of_homonyms: int = 2000) -> dict:
+    '''
+    Measure the throughput of clean_paper_text and find_ambiguous_uses on synthetic papers, and of the whole provider loop on a
+    synthetic CORE archive, so results from different commits can be compared with compare_benchmark_results. Homonyms are also
+    synthetic, so results don't depend on the saved homonyms or matcher.
+
+    :param output_json: file to record the results in
+    :param number_of_texts: synthetic papers to clean and search
+    :param words_per_paper: words in the body of each synthetic paper
+    :param homonym_density: proportion of words which are a homonym or one of its disambiguators
+    :param number_of_providers: provider archives in the synthetic CORE archive
+    :param papers_per_provider:
+    :param compression: compression of the synthetic archives, 'xz' as in CORE
+    :param processes: worker processes for the provider loop, defaults to the number of cpus
+    :param number_of_homonyms: homonyms in the synthetic filter dictionary
+    :return: the results
+    '''
+    filter_dict = make_synthetic_filter_dict(number_of_homonyms)
+    search_for_ambiguity.homonym_matcher = HomonymMatcher(filter_dict, longest_ambiguous_homonym, longest_potential_disambiguator)
+    search_for_ambiguity.fuzzy_index = None
+    texts = [make_sectioned_text(filter_dict, words_per_paper, homonym_density, seed=i) for i in range(number_of_texts)]
+    size_mb = sum(len(text.encode('utf-8')) for text in texts) / 2 ** 20
+
+    start = time.perf_counter()
+    for text in texts:
+        clean_paper_text(text)
+    cleaning_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for text in texts:
+        find_ambiguous_uses(text)
+    search_time = time.perf_counter() - start
+
+    results = {'clean_paper_text_mb_per_sec': size_mb / cleaning_time, 'find_ambiguous_uses_papers_per_sec': number_of_texts / search_time,
+               'find_ambiguous_uses_mb_per_sec': size_mb / search_time}
+    with tempfile.TemporaryDirectory() as corpus_dir:
+        results.update(_benchmark_provider_loop(filter_dict, corpus_dir, processes, number_of_providers=number_of_providers,
+                                                papers_per_provider=papers_per_provider, words_per_paper=words_per_paper,
+                                                homonym_density=homonym_density, compression=compression))
+
+    record = {'timestamp': datetime.now(timezone.utc).isoformat(), 'git_commit': _get_git_commit(),
+              'python_version': platform.python_version(), 'cpu_count': os.cpu_count(), 'processes': processes,
+              'number_of_texts': number_of_texts, 'number_of_homonyms': number_of_homonyms, 'results': results}
+    for metric in SUITE_METRICS:
+        print(f'{metric}: {round(results[metric], 2)}')
+    if output_json is not None:
+        with open(output_json, 'w') as f:
+            json.dump(record, f, indent=2)
+    return record
+
+
+def compare_benchmark_results(record: dict, baseline: dict, tolerance: float = REGRESSION_TOLERANCE) -> list:
+    '''
+    Find throughputs which have fallen by more than tolerance from those of a baseline run of run_benchmark_suite.
+
+    :return: descriptions of each regression
+    '''
+    regressions = []
+    for metric in SUITE_METRICS:
+        if metric in baseline['results']:
+            old, new = baseline['results'][metric], record['results'][metric]
+            if new < old * (1 - tolerance):
+                regressions.append(f'{metric} fell from {round(old, 2)} to {round(new, 2)} ({round(100 * (new / old - 1), 1)}%)')
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the CORE search')
+    parser.add_argument('--provider-tar', default=None, help='provider archive from the CORE download to sample texts from in '
+                                                             'benchmark_prefilter')
+    parser.add_argument('--suite-output', default=None, help='only run the benchmark suite, recording results in this json')
+    parser.add_argument('--baseline', default=None, help='json from an earlier suite run to check for regressions against')
+    parser.add_argument('--processes', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.suite_output is not None:
+        suite_record = run_benchmark_suite(args.suite_output, processes=args.processes)
+        if args.baseline is not None:
+            with open(args.baseline) as baseline_file:
+                suite_regressions = compare_benchmark_results(suite_record, json.load(baseline_file))
+            for regression in suite_regressions:
+                print(f'Regression: {regression}')
+            if len(suite_regressions) > 0:
+                sys.exit(1)
+    else:
+        benchmark_filter_dict()
+        benchmark_matcher()
+        benchmark_mapped_matcher()
+        benchmark_text_cleaning()
+        benchmark_prefilter(args.provider_tar)
+        benchmark_fuzzy_disambiguators()
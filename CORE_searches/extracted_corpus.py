@@ -0,0 +1,175 @@
+import argparse
+import json
+import os
+import tarfile
+import time
+import zlib
+from typing import Dict, Iterator, List, Tuple
+
+import sys
+
+sys.path.append('..')
+
+from search_for_ambiguity import CORE_TAR_FILE, core_MPM_project_path, MAX_PAPERS_IN_FLIGHT, get_worker_pool, search_provider, \
+    provider_in_shard, provider_already_checked
+
+# A one-time extraction of the CORE archive into shards of individually compressed papers, so that repeated searches don't need to
+# decompress the xz archive and nested provider archives again.
+core_extracted_corpus_path = os.path.join(core_MPM_project_path, 'core_2022-03-11_extracted')
+corpus_manifest_json = os.path.join(core_extracted_corpus_path, 'manifest.json')
+
+# Only the fields used when searching and when collecting paper info are kept
+PAPER_FIELDS_TO_KEEP = ['coreId', 'language', 'journals', 'subjects', 'topics', 'year', 'issn', 'doi', 'oai', 'title', 'authors',
+                        'downloadUrl', 'fullText']
+SHARD_SIZE_BYTES = 2 ** 30
+# zlib at the lowest level is fast to decompress and available without extra dependencies
+COMPRESSION_LEVEL = 1
+
+
+def _shard_paths(shard_name: str) -> Tuple[str, str]:
+    return os.path.join(core_extracted_corpus_path, shard_name + '.bin'), os.path.join(core_extracted_corpus_path, shard_name + '.index.tsv')
+
+
+class _ShardWriter:
+    def __init__(self, shard_number: int):
+        self.name = f'shard_{shard_number:05d}'
+        self.data_path, self.index_path = _shard_paths(self.name)
+        self.providers = []
+        self._data_file = open(self.data_path, 'wb')
+        self._index_lines = []
+        self.size = 0
+
+    def add_provider(self, provider_name: str):
+        self.providers.append(provider_name)
+
+    def add_paper(self, provider_name: str, paper: dict):
+        record = zlib.compress(json.dumps({k: paper.get(k) for k in PAPER_FIELDS_TO_KEEP}).encode('utf-8'), COMPRESSION_LEVEL)
+        self._data_file.write(record)
+        self._index_lines.append(f'{provider_name}\t{paper["coreId"]}\t{self.size}\t{len(record)}\n')
+        self.size += len(record)
+
+    def close(self):
+        self._data_file.close()
+        with open(self.index_path, 'w') as f:
+            f.writelines(self._index_lines)
+
+
+def extract_core_corpus(shard_size_bytes: int = SHARD_SIZE_BYTES):
+    '''
+    Convert the CORE tar archive into shards of compressed papers with an offset index.
+
+    Each provider is kept wholly within one shard, and a manifest lists the shards and the providers in each (including providers
+    without any papers). The manifest is written last, so an interrupted extraction is simply rerun.
+    :return: None
+    '''
+    os.makedirs(core_extracted_corpus_path, exist_ok=True)
+    shards = []
+    shard_writer = _ShardWriter(0)
+    start_time = time.time()
+    with tarfile.open(CORE_TAR_FILE, 'r') as main_archive:
+        for provider in main_archive:
+            provider_file_obj = main_archive.extractfile(provider)
+            if provider_file_obj is None:
+                continue
+            tar_archive_name = os.path.basename(provider.name)
+            if shard_writer.size >= shard_size_bytes:
+                shard_writer.close()
+                shards.append({'name': shard_writer.name, 'providers': shard_writer.providers})
+                shard_writer = _ShardWriter(len(shards))
+            shard_writer.add_provider(tar_archive_name)
+
+            with tarfile.open(fileobj=provider_file_obj, mode='r') as sub_archive:
+                for paper_member in sub_archive:
+                    if paper_member.name.endswith('.json'):
+                        lines = sub_archive.extractfile(paper_member).readlines()
+                        if len(lines) > 1:
+                            raise ValueError('Unexpected number of lines in archive')
+                        paper = json.loads(lines[0])
+                        # Papers without text are never searched
+                        if paper['fullText'] is not None:
+                            shard_writer.add_paper(tar_archive_name, paper)
+                    elif '.tar' in paper_member.name:
+                        print('Need more recursion')
+                        raise ValueError
+            print(f'Extracted provider: {tar_archive_name}. {round((time.time() - start_time) / 60, 2)} mins so far.')
+
+    shard_writer.close()
+    shards.append({'name': shard_writer.name, 'providers': shard_writer.providers})
+    with open(corpus_manifest_json, 'w') as f:
+        json.dump({'source': CORE_TAR_FILE, 'fields': PAPER_FIELDS_TO_KEEP, 'shards': shards}, f)
+
+
+def load_corpus_manifest() -> dict:
+    if not os.path.isfile(corpus_manifest_json):
+        raise FileNotFoundError(f'No extracted corpus found at {core_extracted_corpus_path}. Run extract_core_corpus first.')
+    with open(corpus_manifest_json) as f:
+        return json.load(f)
+
+
+def read_shard_index(shard_name: str) -> Dict[str, List[Tuple[str, int, int]]]:
+    # Map of provider to the (coreId, offset, length) of each of its papers
+    provider_papers = {}
+    with open(_shard_paths(shard_name)[1]) as f:
+        for line in f:
+            provider_name, core_id, offset, length = line.rstrip('\n').split('\t')
+            provider_papers.setdefault(provider_name, []).append((core_id, int(offset), int(length)))
+    return provider_papers
+
+
+def read_paper(shard_name: str, offset: int, length: int) -> dict:
+    with open(_shard_paths(shard_name)[0], 'rb') as f:
+        f.seek(offset)
+        return json.loads(zlib.decompress(f.read(length)))
+
+
+def iter_shard_paper_lines(shard_name: str, papers: List[Tuple[str, int, int]]) -> Iterator[List[bytes]]:
+    # Yield papers in the same form as lines read from the archive, so they can go through the same processing. Papers are left
+    # compressed, to be decompressed by the workers with compressed=True rather than all in this process
+    with open(_shard_paths(shard_name)[0], 'rb') as f:
+        for core_id, offset, length in papers:
+            f.seek(offset)
+            yield [f.read(length)]
+
+
+def get_relevant_papers_from_extracted_corpus(max_in_flight: int = MAX_PAPERS_IN_FLIGHT, processes: int = None, shard_index: int = 0,
+                                              shard_count: int = 1, instrument: bool = False, profile_every: int = 0):
+    '''
+    Equivalent to get_relevant_papers_from_download, but reading from the extracted corpus. Jobs are split over corpus shards rather
+    than providers, and the same saved provider results mark completion. Providers are counted across the manifest for profile_every.
+    :return: None
+    '''
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(f'Shard index {shard_index} is not in range for {shard_count} shards')
+    manifest = load_corpus_manifest()
+    provider_index = 0
+    with get_worker_pool(processes) as pool:
+        for corpus_shard_index, shard in enumerate(manifest['shards']):
+            if not provider_in_shard(corpus_shard_index, shard_index, shard_count):
+                provider_index += len(shard['providers'])
+                continue
+            provider_papers = read_shard_index(shard['name'])
+            for tar_archive_name in shard['providers']:
+                provider_index += 1
+                if not provider_already_checked(tar_archive_name):
+                    paper_lines = iter_shard_paper_lines(shard['name'], provider_papers.get(tar_archive_name, []))
+                    search_provider(pool, paper_lines, tar_archive_name, max_in_flight, instrument,
+                                    profile_every > 0 and (provider_index - 1) % profile_every == 0, compressed=True)
+                else:
+                    print(f'Already checked: {tar_archive_name}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--extract', action='store_true')
+    parser.add_argument('--shard-index', type=int, default=0)
+    parser.add_argument('--shard-count', type=int, default=1)
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--instrument', action='store_true', help='save stage timings of each provider')
+    parser.add_argument('--profile-every', type=int, default=0, help='profile every nth provider with cProfile')
+    args = parser.parse_args()
+
+    if args.extract:
+        extract_core_corpus()
+    else:
+        get_relevant_papers_from_extracted_corpus(processes=args.processes, shard_index=args.shard_index, shard_count=args.shard_count,
+                                                  instrument=args.instrument, profile_every=args.profile_every)
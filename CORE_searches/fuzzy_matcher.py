@@ -0,0 +1,128 @@
+from itertools import combinations
+from typing import Dict, Iterable, List, Set, Tuple
+
+# Author words shorter than this must match exactly, as single edits of short words like 'l' or 'ex' give other real words
+MIN_FUZZY_WORD_LENGTH = 4
+
+
+class FuzzyDisambiguatorIndex:
+    """
+    SymSpell style deletion index over the author words of disambiguators, for finding disambiguators whose authors are misspelt
+    or have OCR errors in a text.
+
+    Every author word is indexed under each string made by deleting up to max_edit_distance of its characters. Two words are within
+    max_edit_distance edits of each other only if they share one of these, so the words close to a text word are found from the
+    text word's own deletions, whatever the size of the vocabulary. The words of a disambiguator before its authors (the
+    binomial or abbreviated binomial) must still match exactly.
+    """
+
+    def __init__(self, filter_dict: Dict[str, Iterable[str]], longest_disambiguator: int, max_edit_distance: int = 1,
+                 min_fuzzy_word_length: int = MIN_FUZZY_WORD_LENGTH):
+        self.max_edit_distance = max_edit_distance
+        self.min_fuzzy_word_length = min_fuzzy_word_length
+        # As in HomonymMatcher, disambiguators longer than those searched for or with empty words are never matched
+        self.filter_dict = {homonym: sorted(d for d in filter_dict[homonym] if
+                                            len(d.split(' ')) <= longest_disambiguator and '' not in d.split(' '))
+                            for homonym in filter_dict}
+        # Words before the authors and the author words of each disambiguator
+        self._split_disambiguators = {}
+        self._deletes = {}
+        for homonym, disambiguators in self.filter_dict.items():
+            for disambiguator in disambiguators:
+                if disambiguator not in self._split_disambiguators:
+                    binomial_words, author_words = _split_disambiguator(homonym, disambiguator)
+                    self._split_disambiguators[disambiguator] = (binomial_words, author_words)
+                    for word in author_words:
+                        if len(word) >= min_fuzzy_word_length:
+                            for deleted in _deletes(word, max_edit_distance):
+                                self._deletes.setdefault(deleted, set()).add(word)
+
+    def similar_words(self, word: str) -> Set[str]:
+        '''
+        Author words within max_edit_distance edits (insertions, deletions, substitutions or adjacent transpositions) of word.
+        '''
+        if len(word) < self.min_fuzzy_word_length - self.max_edit_distance:
+            return set()
+        candidates = set()
+        for deleted in _deletes(word, self.max_edit_distance):
+            candidates.update(self._deletes.get(deleted, ()))
+        return {c for c in candidates if _within_edit_distance(word, c, self.max_edit_distance)}
+
+    def find_disambiguators(self, homonym: str, tokens: List[str], token_positions: Dict[str, List[int]] = None) -> List[str]:
+        '''
+        Disambiguators of homonym that occur in tokens, allowing author words to be within max_edit_distance edits.
+
+        :param homonym:
+        :param tokens: cleaned words of the text
+        :param token_positions: positions of each token, from get_token_positions, to reuse for several homonyms of one text
+        :return:
+        '''
+        if token_positions is None:
+            token_positions = get_token_positions(tokens)
+        similar_words = {}
+
+        def _author_word_matches(author_word: str, token: str) -> bool:
+            if token == author_word:
+                return True
+            if token not in similar_words:
+                similar_words[token] = self.similar_words(token)
+            return author_word in similar_words[token]
+
+        found = []
+        for disambiguator in self.filter_dict.get(homonym, []):
+            binomial_words, author_words = self._split_disambiguators[disambiguator]
+            length = len(binomial_words) + len(author_words)
+            for position in token_positions.get(binomial_words[0], []):
+                if position + length > len(tokens) or tuple(tokens[position:position + len(binomial_words)]) != binomial_words:
+                    continue
+                author_start = position + len(binomial_words)
+                if all(_author_word_matches(w, tokens[author_start + i]) for i, w in enumerate(author_words)):
+                    found.append(disambiguator)
+                    break
+        return found
+
+
+def get_token_positions(tokens: List[str]) -> Dict[str, List[int]]:
+    token_positions = {}
+    for position, token in enumerate(tokens):
+        token_positions.setdefault(token, []).append(position)
+    return token_positions
+
+
+def _split_disambiguator(homonym: str, disambiguator: str) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    # Disambiguators are the full or abbreviated binomial followed by authors, so the authors begin after the specific epithet
+    words = disambiguator.split(' ')
+    homonym_words = homonym.split(' ')
+    epithet = homonym_words[-1]
+    if epithet in words:
+        binomial_length = len(words) - words[::-1].index(epithet)
+    else:
+        binomial_length = min(len(homonym_words), len(words))
+    return tuple(words[:binomial_length]), tuple(words[binomial_length:])
+
+
+def _deletes(word: str, max_edit_distance: int) -> Set[str]:
+    out = {word}
+    for number_deleted in range(1, min(max_edit_distance, len(word)) + 1):
+        for positions in combinations(range(len(word)), number_deleted):
+            out.add(''.join(c for i, c in enumerate(word) if i not in positions))
+    return out
+
+
+def _within_edit_distance(a: str, b: str, max_edit_distance: int) -> bool:
+    # Optimal string alignment distance, stopping once every alignment needs more than max_edit_distance edits
+    if abs(len(a) - len(b)) > max_edit_distance:
+        return False
+    previous_previous = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous_previous[j - 2] + 1)
+        if min(current) > max_edit_distance:
+            return False
+        previous_previous, previous = previous, current
+    return previous[len(b)] <= max_edit_distance
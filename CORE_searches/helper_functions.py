@@ -2,21 +2,29 @@ import os
 import pickle
 import re
 import string
-from typing import List
+from typing import List, Tuple
 
 import pandas as pd
-from tqdm import tqdm
 from wcvpy.wcvp_download import infraspecific_chars, hybrid_characters, wcvp_columns
 
-from taxonomy_inputs import taxonomy_inputs_output_path, project_path
+from taxonomy_inputs import project_path, WCVP_VERSION, load_homonyms, get_homonyms_parquet, get_file_sha256
+from .homonym_matcher import HomonymMatcher
+from .fuzzy_matcher import FuzzyDisambiguatorIndex, MIN_FUZZY_WORD_LENGTH
 
 scratch_path = os.environ.get('SCRATCH')
 
-homonym_df = pd.read_csv(os.path.join(taxonomy_inputs_output_path, 'ambiguous_homonyms', 'homonyms.csv'))
-
-names_to_search = sorted(homonym_df[wcvp_columns['name']].unique().tolist())
+# What the filter dictionary and matcher are built from, by load_homonyms
+ambiguous_homonyms_parquet = get_homonyms_parquet('ambiguous')
+# Columns of the ambiguous homonyms giving names with authors which can disambiguate a homonym
+disambiguating_name_columns = ['taxon_name_with_authors', 'taxon_name_with_paranthet_authors', 'taxon_name_with_primary_author',
+                               'sp_binomial_with_abbreviated_genus_with_authors',
+                               'sp_binomial_with_abbreviated_genus_with_paranthet_authors',
+                               'sp_binomial_with_abbreviated_genus_with_primary_author']
 core_project_path = os.path.join(project_path, 'CORE_searches')
 filter_dict_pkl = os.path.join(core_project_path, 'temp_outputs', 'saved_dictionary.pkl')
+matcher_path = os.path.join(core_project_path, 'temp_outputs', 'homonym_matcher.bin')
+
+FUZZY_INDEX_FORMAT_VERSION = 1
 
 longest_ambiguous_homonym = 3
 longest_potential_disambiguator = 10
@@ -28,28 +36,45 @@ _reference_regex = re.compile(r"^\s*\d*\s*References\s*\n", flags=re.IGNORECASE
 _supp_regex = re.compile(r"^\s*\d*\s*Supplementary material\s*\n", flags=re.IGNORECASE | re.MULTILINE)
 _conf_regex = re.compile(r"^\s*\d*\s*Conflict of interest\s*\n", flags=re.IGNORECASE | re.MULTILINE)
 _ackno_regex = re.compile(r"^\s*\d*\s*Acknowledgments\s*\n", flags=re.IGNORECASE | re.MULTILINE)
+# Sections are removed in this order, each from the text left after removing the previous one
+_section_headings = [(_reference_regex, 'References', 'references'),
+                     (_supp_regex, 'Supplementary material', 'supplementary material'),
+                     (_conf_regex, 'Conflict of interest', 'conflict of interest'),
+                     (_ackno_regex, 'Acknowledgments', 'acknowledgments')]
+# Zero width, so that every line where any of the above headings could begin is found in one scan
+_any_section_heading_regex = re.compile(
+    r"^(?=\s*\d*\s*(?:References|Supplementary material|Conflict of interest|Acknowledgments)\s*\n)",
+    flags=re.IGNORECASE | re.MULTILINE)
 _punctuation_to_strip = string.punctuation
 for h in hybrid_characters:
     _punctuation_to_strip = _punctuation_to_strip.replace(h, '')
 
 
-def retrieve_text_before_phrase(given_text: str, my_regex, simple_string: str, simple_string_lower: str) -> str:
-    if simple_string in given_text or simple_string_lower in given_text:
-
-        text_split = my_regex.split(given_text, maxsplit=1)  # This is the bottleneck
-
-        pre_split = text_split[0]
-        if len(text_split) > 1:
-            post_split = text_split[
-                1]  # If maxsplit is nonzero, at most maxsplit splits occur, and the remainder of the string is returned as the final element of the list
-            # if text after split point is longer than before, then revert.
-            if len(post_split) > len(pre_split):
-                pre_split = given_text
-
-        return pre_split
-    else:
-
-        return given_text
+def get_body_text_end(text: str) -> int:
+    '''
+    Find where the body of the text ends, i.e. the text before each section heading in turn, unless the text after the heading is
+    longer. Each heading is matched against the body found so far, without splitting and copying the text for each heading.
+    :param text:
+    :return: index such that text[:index] is the body text
+    '''
+    body_end = len(text)
+    heading_positions = None
+    for my_regex, simple_string, simple_string_lower in _section_headings:
+        if text.find(simple_string, 0, body_end) == -1 and text.find(simple_string_lower, 0, body_end) == -1:
+            continue
+        if heading_positions is None:
+            heading_positions = [m.start() for m in _any_section_heading_regex.finditer(text)]
+        for position in heading_positions:
+            if position >= body_end:
+                break
+            # endpos makes this equivalent to matching against text[:body_end]
+            match = my_regex.match(text, position, body_end)
+            if match is not None:
+                # if text after split point is longer than before, then revert.
+                if body_end - match.end() <= position:
+                    body_end = position
+                break
+    return body_end
 
 
 def clean_paper_text(text: str) -> str:
@@ -58,12 +83,23 @@ def clean_paper_text(text: str) -> str:
 
     # Split by looking for an instance of 'Supplementary material' (ignoring case)
     # begins a line on its own (followed by any amount of whitespace and then a new line)
-    pre_reference = retrieve_text_before_phrase(text, _reference_regex, 'References', 'references')
-    pre_supplementary = retrieve_text_before_phrase(pre_reference, _supp_regex, 'Supplementary material', 'supplementary material')
-    pre_conflict = retrieve_text_before_phrase(pre_supplementary, _conf_regex, 'Conflict of interest', 'conflict of interest')
-    pre_acknowledgement = retrieve_text_before_phrase(pre_conflict, _ackno_regex, 'Acknowledgments', 'acknowledgments')
+    return clean_string(text[:get_body_text_end(text)])
 
-    return clean_string(pre_acknowledgement)
+
+def tokenise_paper_text(text: str) -> Tuple[List[str], List[str]]:
+    '''
+    Clean the text once, giving the words of both the body text and the whole text.
+
+    Equivalent to clean_paper_text(text).split() and clean_string(text).split(). The body always ends at the start of a line,
+    so no word spans the end of the body and the words of the body are the first words of the whole text.
+    :param text:
+    :return: body words, all words
+    '''
+    body_end = get_body_text_end(text)
+    body_words = [w.strip(_punctuation_to_strip) for w in text[:body_end].lower().split()]
+    body_words = [w for w in body_words if w]
+    other_words = [w.strip(_punctuation_to_strip) for w in text[body_end:].lower().split()]
+    return body_words, body_words + [w for w in other_words if w]
 
 
 def clean_string(given_string) -> str:
@@ -80,46 +116,156 @@ def clean_string(given_string) -> str:
         return given_string
 
 
-def build_output_dict(corpusid: str, doi: str, year: str, title: str, authors: List[str],
-                      url: str, language: str, journals: str, issn: str, homonym_uses: List[str], ambiguous_uses: List[str],
+def _optional_str(value):
+    return None if value is None else str(value)
+
+
+def _optional_int(value):
+    # Years are given as numbers, or as strings of floats when read back from csv
+    try:
+        return int(float(value))
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+def _journal_record(journal) -> dict:
+    # CORE gives each journal as a dict of its title and identifiers, e.g. 'issn:1234-5678'
+    if isinstance(journal, dict):
+        return {'title': _optional_str(journal.get('title')), 'identifiers': [str(i) for i in journal.get('identifiers') or []]}
+    return {'title': _optional_str(journal), 'identifiers': []}
+
+
+def build_output_dict(corpusid: str, doi: str, year: int, title: str, authors: List[str],
+                      url: str, language: str, journals: List[dict], issn: str, homonym_uses: List[str], ambiguous_uses: List[str],
                       disambiguators: dict):
-    out_dict = {'corpusid': [corpusid], 'DOI': [doi], 'year': year, 'language': language, 'journals': journals, 'issn': issn,
-                'title': [title], 'authors': [str(authors)], 'oaurl': [url], 'homonym_uses': [str(homonym_uses)],
-                'ambiguous_uses': [str(ambiguous_uses)], 'disambiguators': [str(disambiguators)]}
+    # A plain record, cheap to send back from workers. Lists and dicts are kept as such to be stored as native columns
+    out_dict = {'corpusid': _optional_str(corpusid), 'DOI': _optional_str(doi), 'year': _optional_int(year), 'language': language,
+                'journals': [_journal_record(j) for j in journals] if journals is not None else None, 'issn': _optional_str(issn),
+                'title': title, 'authors': [str(a) for a in authors] if authors is not None else None, 'oaurl': url,
+                'homonym_uses': list(homonym_uses), 'ambiguous_uses': list(ambiguous_uses),
+                'disambiguators': [{'homonym': homonym, 'terms': list(terms)} for homonym, terms in disambiguators.items()]}
 
     return out_dict
 
 
-def _get_filter_dict():
+_homonym_df = None
+
+
+def get_homonym_df() -> pd.DataFrame:
+    # Loaded on first use, so these helpers can be imported without the saved homonyms
+    global _homonym_df
+    if _homonym_df is None:
+        _homonym_df = load_homonyms('ambiguous', columns=[wcvp_columns['name']] + disambiguating_name_columns)
+    return _homonym_df
+
+
+def build_filter_dict(df: pd.DataFrame = None) -> dict:
     '''
-    Returns a dictionary of disambiugating phrases for each homonym
+    Returns a dictionary of disambiugating phrases for each homonym.
+
+    All name variants are collected in one long frame and each unique variant is cleaned once, rather than filtering the
+    homonyms for each name in turn.
+    :param df: homonyms to use, defaults to the ambiguous homonyms
     :return:
     '''
+    if df is None:
+        df = get_homonym_df()
+    name_col = wcvp_columns['name']
+    names = pd.Series(df[name_col].unique())
+
+    # Add strings that indicate binomial not used on its own.
+    variant_frames = [pd.DataFrame({name_col: names, 'variant': names + ' ' + ch}) for ch in infraspecific_chars + hybrid_characters]
+    variant_frames.append(df.melt(id_vars=[name_col], value_vars=disambiguating_name_columns, value_name='variant')[[name_col, 'variant']])
+    variants = pd.concat(variant_frames, ignore_index=True).drop_duplicates()
+
+    unique_variants = variants['variant'].unique()
+    cleaned_variants = dict(zip(unique_variants, [clean_string(v) for v in unique_variants]))
+    variants['cleaned'] = variants['variant'].map(cleaned_variants)
+    variants = variants.drop_duplicates(subset=[name_col, 'cleaned'])
+
     name_terms_dict = {}
-    for i in tqdm(range(len(names_to_search))):
-        taxon_name = names_to_search[i]
-        out_list = []
+    # Sorted so that of several names cleaning to the same string, the one kept doesn't depend on the order of the homonyms
+    for taxon_name, cleaned in variants.groupby(name_col, sort=True)['cleaned']:
+        name_terms_dict[clean_string(taxon_name)] = cleaned.tolist()
+    return name_terms_dict
+
+
+def get_matcher_metadata() -> dict:
+    # What a saved matcher depends on, so that searches don't run with a matcher built from different homonyms
+    return {'wcvp_version': WCVP_VERSION, 'homonyms_parquet_sha256': get_file_sha256(ambiguous_homonyms_parquet),
+            'longest_ambiguous_homonym': longest_ambiguous_homonym, 'longest_potential_disambiguator': longest_potential_disambiguator}
+
+
+def load_filter_dict() -> dict:
+    with open(filter_dict_pkl, 'rb') as f:
+        loaded_filter_dict = pickle.load(f)
+    for homonym in loaded_filter_dict:
+        loaded_filter_dict[homonym] = set(loaded_filter_dict[homonym])
+    return loaded_filter_dict
+
 
-        # Add strings that indicate binomial not used on its own.
-        for ch in infraspecific_chars + hybrid_characters:
-            out_list.append(taxon_name + ' ' + ch)
+def get_fuzzy_index_path(given_matcher_path: str, max_edit_distance: int) -> str:
+    # Saved next to the matcher it goes with
+    return f'{os.path.splitext(given_matcher_path)[0]}_fuzzy_{max_edit_distance}.pkl'
 
-        relevant_taxa = homonym_df[homonym_df[wcvp_columns['name']] == taxon_name]
-        out_list += relevant_taxa['taxon_names_with_authors'].unique().tolist()
-        out_list += relevant_taxa['taxon_names_with_paranthet_authors'].unique().tolist()
-        out_list += relevant_taxa['taxon_names_with_primary_author'].unique().tolist()
 
-        out_list += relevant_taxa['sp_binomial_with_abbreviated_genus_with_authors'].unique().tolist()
-        out_list += relevant_taxa['sp_binomial_with_abbreviated_genus_with_paranthet_authors'].unique().tolist()
-        out_list += relevant_taxa['sp_binomial_with_abbreviated_genus_with_primary_author'].unique().tolist()
+def _get_fuzzy_index_metadata(matcher_metadata: dict, max_edit_distance: int) -> dict:
+    return {'format_version': FUZZY_INDEX_FORMAT_VERSION, 'matcher': matcher_metadata, 'max_edit_distance': max_edit_distance,
+            'min_fuzzy_word_length': MIN_FUZZY_WORD_LENGTH, 'longest_potential_disambiguator': longest_potential_disambiguator}
 
-        unique_out_list = list(set(out_list))
-        cleaned = [clean_string(v) for v in unique_out_list]
 
-        name_terms_dict[clean_string(taxon_name)] = cleaned
+def _load_fuzzy_index_metadata(path: str):
+    # The metadata is pickled before the index, so can be checked without loading the index
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def save_fuzzy_index(given_matcher_path: str, matcher_metadata: dict, max_edit_distance: int) -> str:
+    '''
+    Build the fuzzy index from the filter dictionary once and save it next to the matcher, so that search workers only need to
+    unpickle it rather than each building the deletions of every author word. Nothing is built when a matching index is saved.
+    :param given_matcher_path: saved matcher the index is used with
+    :param matcher_metadata: metadata of the saved matcher, so the index is rebuilt with the matcher
+    :param max_edit_distance:
+    :return: path of the saved index
+    '''
+    path = get_fuzzy_index_path(given_matcher_path, max_edit_distance)
+    metadata = _get_fuzzy_index_metadata(matcher_metadata, max_edit_distance)
+    if _load_fuzzy_index_metadata(path) != metadata:
+        fuzzy_index = FuzzyDisambiguatorIndex(load_filter_dict(), longest_potential_disambiguator, max_edit_distance)
+        # Write then rename, so workers never load a partly written index
+        temp_path = f'{path}.{os.getpid()}'
+        with open(temp_path, 'wb') as f:
+            pickle.dump(metadata, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(fuzzy_index, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+    return path
+
+
+def load_fuzzy_index(given_matcher_path: str, matcher_metadata: dict, max_edit_distance: int) -> FuzzyDisambiguatorIndex:
+    '''
+    Load the index saved by save_fuzzy_index, raising a ValueError if it is missing or was built for a different matcher.
+    '''
+    path = get_fuzzy_index_path(given_matcher_path, max_edit_distance)
+    with open(path, 'rb') as f:
+        if pickle.load(f) != _get_fuzzy_index_metadata(matcher_metadata, max_edit_distance):
+            raise ValueError(f'Saved fuzzy index at {path} is out of date')
+        return pickle.load(f)
+
+
+def _get_filter_dict():
+    name_terms_dict = build_filter_dict()
     with open(filter_dict_pkl, 'wb') as f:
         pickle.dump(name_terms_dict, f)
 
+    matcher = HomonymMatcher(name_terms_dict, longest_ambiguous_homonym, longest_potential_disambiguator)
+    # Write then rename, so searches that are already running never map a partly written file
+    temp_path = f'{matcher_path}.{os.getpid()}'
+    matcher.save(temp_path, get_matcher_metadata())
+    os.replace(temp_path, matcher_path)
+
 
 if __name__ == '__main__':
     _get_filter_dict()
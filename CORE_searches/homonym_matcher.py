@@ -0,0 +1,396 @@
+import json
+import mmap
+import re
+import zlib
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Set
+
+# Increase when the layout of saved matchers changes, so old files are rebuilt rather than misread
+MATCHER_FORMAT_VERSION = 3
+_MATCHER_MAGIC = b'HOMMATCH'
+
+_HOMONYM_FLAG = 1
+_DISAMBIGUATOR_FLAG = 2
+
+
+class HomonymMatcher:
+    """
+    Aho-Corasick automaton over word tokens, compiled once from the filter dictionary.
+
+    Homonyms (keys) and their disambiguators (values) are added as patterns of cleaned words, so that all occurrences in a list of
+    tokens can be found in a single linear pass rather than by building every n-gram of the text.
+    Patterns are only matched if they are no longer than the n-grams that were previously searched for, so that results are the
+    same as the set intersection approach.
+    """
+
+    def __init__(self, filter_dict: Dict[str, Iterable[str]], longest_homonym: int, longest_disambiguator: int):
+        self.filter_dict = {homonym: set(filter_dict[homonym]) for homonym in filter_dict}
+        self.homonyms = set(self.filter_dict.keys())
+
+        self._vocab = {}
+        self._goto = [{}]
+        self._fail = [0]
+        self._outputs = [[]]  # ids of patterns ending at this node
+        self._output_link = [0]
+        self._patterns = []
+        self._pattern_ids = {}
+        self._pattern_flags = []
+
+        for homonym in sorted(self.homonyms):
+            self._add_pattern(homonym, _HOMONYM_FLAG, longest_homonym)
+        disambiguators = set()
+        for homonym in self.homonyms:
+            disambiguators.update(self.filter_dict[homonym])
+        for disambiguator in sorted(disambiguators):
+            self._add_pattern(disambiguator, _DISAMBIGUATOR_FLAG, longest_disambiguator)
+
+        self._build_links()
+        self.genera = _get_genera(self._patterns, self._pattern_flags)
+        self._genus_pattern = _genus_regex_pattern(self.genera)
+        self._genus_regex = _compile_genus_regex(self._genus_pattern)
+
+    def _add_pattern(self, pattern: str, flag: int, max_words: int):
+        words = pattern.split(' ')
+        # Phrases of text are joined by single spaces without empty words, so patterns with empty words can never match
+        if len(words) > max_words or '' in words:
+            return
+        pattern_id = self._pattern_ids.get(pattern)
+        if pattern_id is not None:
+            self._pattern_flags[pattern_id] |= flag
+            return
+        pattern_id = len(self._patterns)
+        self._patterns.append(pattern)
+        self._pattern_ids[pattern] = pattern_id
+        self._pattern_flags.append(flag)
+
+        node = 0
+        for word in words:
+            word_id = self._vocab.setdefault(word, len(self._vocab))
+            next_node = self._goto[node].get(word_id)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][word_id] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._outputs.append([])
+                self._output_link.append(0)
+            node = next_node
+        self._outputs[node].append(pattern_id)
+
+    def _build_links(self):
+        # Breadth first, so that failure links of shallower nodes are known before they are needed
+        queue = list(self._goto[0].values())
+        position = 0
+        while position < len(queue):
+            node = queue[position]
+            position += 1
+            for word_id, child in self._goto[node].items():
+                fallback = self._fail[node]
+                while fallback and word_id not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                fail = self._goto[fallback].get(word_id, 0)
+                if fail == child:
+                    fail = 0
+                self._fail[child] = fail
+                self._output_link[child] = fail if self._outputs[fail] else self._output_link[fail]
+                queue.append(child)
+
+    def _scan(self, tokens: List[str], wanted_flag: int) -> Set[str]:
+        found = set()
+        vocab = self._vocab
+        goto = self._goto
+        fail = self._fail
+        outputs = self._outputs
+        output_link = self._output_link
+        patterns = self._patterns
+        pattern_flags = self._pattern_flags
+
+        node = 0
+        for token in tokens:
+            word_id = vocab.get(token)
+            if word_id is None:
+                node = 0
+                continue
+            while node and word_id not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(word_id, 0)
+
+            match_node = node if outputs[node] else output_link[node]
+            while match_node:
+                for pattern_id in outputs[match_node]:
+                    if pattern_flags[pattern_id] & wanted_flag:
+                        found.add(patterns[pattern_id])
+                match_node = output_link[match_node]
+        return found
+
+    def may_contain_homonyms(self, text: str) -> bool:
+        return _text_may_contain_genus(text, self._genus_regex)
+
+    def find_homonyms(self, tokens: List[str]) -> Set[str]:
+        return self._scan(tokens, _HOMONYM_FLAG)
+
+    def find_disambiguators(self, tokens: List[str]) -> Set[str]:
+        return self._scan(tokens, _DISAMBIGUATOR_FLAG)
+
+    def disambiguators_for(self, homonym: str, found_disambiguators: Set[str]) -> List[str]:
+        return list(self.filter_dict[homonym] & found_disambiguators)
+
+    def _to_sections(self) -> Dict[str, bytes]:
+        # Flat arrays of the automaton, with variable length parts stored as offsets into a values array
+        sections = {}
+        vocab_words = sorted(self._vocab, key=self._vocab.get)
+        sections.update(_string_table_sections('vocab', vocab_words))
+        sections.update(_string_table_sections('pattern', self._patterns))
+        # The prefilter regex is saved rather than the genera, so loading doesn't need to rebuild it
+        sections['genus_regex_blob'] = (self._genus_pattern or '').encode('utf-8')
+
+        child_offsets, child_words, child_nodes = array('I', [0]), array('I'), array('I')
+        output_offsets, output_patterns = array('I', [0]), array('I')
+        for node in range(len(self._goto)):
+            for word_id in sorted(self._goto[node]):
+                child_words.append(word_id)
+                child_nodes.append(self._goto[node][word_id])
+            child_offsets.append(len(child_words))
+            output_patterns.extend(self._outputs[node])
+            output_offsets.append(len(output_patterns))
+
+        disambiguator_offsets, disambiguator_patterns = array('I', [0]), array('I')
+        for pattern_id, pattern in enumerate(self._patterns):
+            if self._pattern_flags[pattern_id] & _HOMONYM_FLAG:
+                disambiguator_patterns.extend(sorted(
+                    self._pattern_ids[d] for d in self.filter_dict[pattern] if d in self._pattern_ids and
+                    self._pattern_flags[self._pattern_ids[d]] & _DISAMBIGUATOR_FLAG))
+            disambiguator_offsets.append(len(disambiguator_patterns))
+
+        sections.update({'child_offsets': child_offsets, 'child_words': child_words, 'child_nodes': child_nodes,
+                         'fail': array('I', self._fail), 'output_link': array('I', self._output_link),
+                         'output_offsets': output_offsets, 'output_patterns': output_patterns,
+                         'pattern_flags': array('I', self._pattern_flags),
+                         'disambiguator_offsets': disambiguator_offsets, 'disambiguator_patterns': disambiguator_patterns})
+        return {name: section.tobytes() if isinstance(section, array) else section for name, section in sections.items()}
+
+    def save(self, path: str, metadata: dict = None):
+        '''
+        Save the automaton as flat arrays which can be memory mapped by MappedHomonymMatcher.
+        :param path:
+        :param metadata: json serialisable information about how the matcher was built, used to check it is up to date
+        :return:
+        '''
+        sections = self._to_sections()
+        layout = {}
+        position = 0
+        for name, data in sections.items():
+            layout[name] = [position, len(data)]
+            position += _padded_length(len(data))
+        header = json.dumps({'format_version': MATCHER_FORMAT_VERSION, 'metadata': metadata or {}, 'sections': layout}).encode('utf-8')
+        header += b' ' * (_padded_length(len(header)) - len(header))
+
+        with open(path, 'wb') as f:
+            f.write(_MATCHER_MAGIC)
+            f.write(len(header).to_bytes(8, 'little'))
+            f.write(header)
+            for data in sections.values():
+                f.write(data)
+                f.write(b'\0' * (_padded_length(len(data)) - len(data)))
+
+
+class MappedHomonymMatcher:
+    """
+    Read only HomonymMatcher backed by a memory mapped file written by HomonymMatcher.save.
+
+    Nothing is unpickled or rebuilt on loading, and the file's pages are shared between all processes that map it.
+    """
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(self._mmap)
+        if bytes(buffer[:8]) != _MATCHER_MAGIC:
+            raise ValueError(f'{path} is not a saved homonym matcher')
+        header_length = int.from_bytes(buffer[8:16], 'little')
+        header = json.loads(bytes(buffer[16:16 + header_length]))
+        self.format_version = header['format_version']
+        self.metadata = header['metadata']
+        if self.format_version != MATCHER_FORMAT_VERSION:
+            raise ValueError(f'{path} has matcher format version {self.format_version}, expected {MATCHER_FORMAT_VERSION}')
+
+        data_start = 16 + header_length
+        sections = {}
+        for name, (offset, length) in header['sections'].items():
+            section = buffer[data_start + offset:data_start + offset + length]
+            sections[name] = section if name.endswith('_blob') else section.cast('I')
+
+        self._vocab_table, self._vocab_offsets, self._vocab_blob = sections['vocab_table'], sections['vocab_offsets'], sections['vocab_blob']
+        self._pattern_table, self._pattern_offsets, self._pattern_blob = (sections['pattern_table'], sections['pattern_offsets'],
+                                                                          sections['pattern_blob'])
+        self._child_offsets, self._child_words, self._child_nodes = sections['child_offsets'], sections['child_words'], sections['child_nodes']
+        self._fail, self._output_link = sections['fail'], sections['output_link']
+        self._output_offsets, self._output_patterns = sections['output_offsets'], sections['output_patterns']
+        self._pattern_flags = sections['pattern_flags']
+        self._disambiguator_offsets, self._disambiguator_patterns = sections['disambiguator_offsets'], sections['disambiguator_patterns']
+
+        self._genus_regex = _compile_genus_regex(str(sections['genus_regex_blob'], 'utf-8') or None)
+
+    def _pattern(self, pattern_id: int) -> str:
+        return str(self._pattern_blob[self._pattern_offsets[pattern_id]:self._pattern_offsets[pattern_id + 1]], 'utf-8')
+
+    def _transition(self, node: int, word_id: int):
+        low, high = self._child_offsets[node], self._child_offsets[node + 1]
+        i = bisect_left(self._child_words, word_id, low, high)
+        if i < high and self._child_words[i] == word_id:
+            return self._child_nodes[i]
+        return None
+
+    def _scan(self, tokens: List[str], wanted_flag: int) -> Set[str]:
+        found = set()
+        word_ids = {}
+        output_offsets = self._output_offsets
+        output_patterns = self._output_patterns
+        output_link = self._output_link
+        pattern_flags = self._pattern_flags
+        fail = self._fail
+
+        node = 0
+        for token in tokens:
+            if token in word_ids:
+                word_id = word_ids[token]
+            else:
+                word_id = _lookup_string(token, self._vocab_table, self._vocab_offsets, self._vocab_blob)
+                word_ids[token] = word_id
+            if word_id is None:
+                node = 0
+                continue
+            next_node = self._transition(node, word_id)
+            while next_node is None and node:
+                node = fail[node]
+                next_node = self._transition(node, word_id)
+            node = next_node or 0
+
+            match_node = node if output_offsets[node] != output_offsets[node + 1] else output_link[node]
+            while match_node:
+                for i in range(output_offsets[match_node], output_offsets[match_node + 1]):
+                    pattern_id = output_patterns[i]
+                    if pattern_flags[pattern_id] & wanted_flag:
+                        found.add(self._pattern(pattern_id))
+                match_node = output_link[match_node]
+        return found
+
+    def may_contain_homonyms(self, text: str) -> bool:
+        return _text_may_contain_genus(text, self._genus_regex)
+
+    def find_homonyms(self, tokens: List[str]) -> Set[str]:
+        return self._scan(tokens, _HOMONYM_FLAG)
+
+    def find_disambiguators(self, tokens: List[str]) -> Set[str]:
+        return self._scan(tokens, _DISAMBIGUATOR_FLAG)
+
+    def disambiguators_for(self, homonym: str, found_disambiguators: Set[str]) -> List[str]:
+        pattern_id = _lookup_string(homonym, self._pattern_table, self._pattern_offsets, self._pattern_blob)
+        if pattern_id is None:
+            return []
+        out = []
+        for i in range(self._disambiguator_offsets[pattern_id], self._disambiguator_offsets[pattern_id + 1]):
+            disambiguator = self._pattern(self._disambiguator_patterns[i])
+            if disambiguator in found_disambiguators:
+                out.append(disambiguator)
+        return out
+
+
+def load_matcher(path: str, expected_metadata: dict = None) -> MappedHomonymMatcher:
+    '''
+    Map a saved matcher, raising a ValueError if its metadata doesn't match what is expected, e.g. it was built from an older
+    homonym list.
+    '''
+    matcher = MappedHomonymMatcher(path)
+    if expected_metadata is not None:
+        stale = {k: (matcher.metadata.get(k), v) for k, v in expected_metadata.items() if matcher.metadata.get(k) != v}
+        if len(stale) > 0:
+            raise ValueError(f'Saved matcher at {path} is out of date (saved, expected): {stale}')
+    return matcher
+
+
+def _get_genera(patterns: List[str], pattern_flags: List[int]) -> List[str]:
+    # First words of homonyms that can be matched, a text can only contain a homonym if it contains one of these
+    return sorted({pattern.split(' ')[0] for pattern, flag in zip(patterns, pattern_flags) if flag & _HOMONYM_FLAG})
+
+
+def _trie_regex_pattern(trie: dict) -> str:
+    # Alternatives grouped by shared prefixes, so the regex engine only follows branches matching the next character
+    ends_here = '' in trie
+    branches = [re.escape(c) + _trie_regex_pattern(trie[c]) for c in sorted(trie) if c != '']
+    if len(branches) == 0:
+        return ''
+    if len(branches) == 1 and not ends_here:
+        return branches[0]
+    return '(?:' + '|'.join(branches) + ')' + ('?' if ends_here else '')
+
+
+def _genus_regex_pattern(genera: List[str]):
+    trie = {}
+    for genus in genera:
+        node = trie
+        for c in genus:
+            node = node.setdefault(c, {})
+        node[''] = {}
+    if len(trie) == 0:
+        return None
+    # Cleaned words begin and end next to whitespace or ascii punctuation, which includes '_', so these boundaries exclude
+    # genera inside other words without missing any cleaned word
+    return r'(?<![^\W_])' + _trie_regex_pattern(trie) + r'(?![^\W_])'
+
+
+def _compile_genus_regex(pattern: str):
+    if pattern is None:
+        return None
+    return re.compile(pattern)
+
+
+def _text_may_contain_genus(text: str, genus_regex) -> bool:
+    '''
+    Cheap check to run before cleaning a text. Cleaned words are lower cased words of the text with punctuation stripped from the
+    ends, so a cleaned word is always a substring of the lower cased text. Therefore if this is False the text can't contain a
+    homonym, though it may be True for texts that don't.
+    '''
+    if genus_regex is None:
+        return False
+    return genus_regex.search(text.lower()) is not None
+
+
+def _padded_length(length: int) -> int:
+    return (length + 7) // 8 * 8
+
+
+def _string_table_sections(name: str, strings: List[str]) -> Dict[str, object]:
+    # Strings are concatenated in a blob with offsets, and an open addressing hash table maps from the string to its index
+    offsets = array('I', [0])
+    encoded = []
+    for s in strings:
+        encoded.append(s.encode('utf-8'))
+        offsets.append(offsets[-1] + len(encoded[-1]))
+
+    table_size = 1
+    while table_size < 2 * len(strings):
+        table_size *= 2
+    table = array('I', [0]) * table_size
+    mask = table_size - 1
+    for i, e in enumerate(encoded):
+        slot = zlib.crc32(e) & mask
+        while table[slot]:
+            slot = (slot + 1) & mask
+        table[slot] = i + 1
+    return {name + '_table': table, name + '_offsets': offsets, name + '_blob': b''.join(encoded)}
+
+
+def _lookup_string(s: str, table, offsets, blob):
+    encoded = s.encode('utf-8')
+    mask = len(table) - 1
+    slot = zlib.crc32(encoded) & mask
+    while True:
+        value = table[slot]
+        if value == 0:
+            return None
+        i = value - 1
+        if blob[offsets[i]:offsets[i + 1]] == encoded:
+            return i
+        slot = (slot + 1) & mask
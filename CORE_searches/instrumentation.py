@@ -0,0 +1,172 @@
+import json
+import math
+import os
+import time
+from typing import Dict, List
+
+# Papers taking longer than this in total are listed individually
+SLOW_PAPER_SECONDS = float(os.environ.get('CORE_SLOW_PAPER_SECONDS', 1))
+# Histogram bins are log spaced, with TIME_BINS_PER_DECADE bins per factor of 10 from MIN_BINNED_SECONDS
+MIN_BINNED_SECONDS = 1e-6
+TIME_BINS_PER_DECADE = 4
+NUMBER_OF_TIME_BINS = 8 * TIME_BINS_PER_DECADE + 1
+# Text lengths are binned by powers of 2
+NUMBER_OF_LENGTH_BINS = 32
+MATCH_COUNT_NAMES = ['homonym_uses', 'ambiguous_uses', 'disambiguated_uses']
+NUMBER_OF_SLOW_PAPERS_TO_SUMMARISE = 5
+
+
+class StageTimer:
+    """
+    Records the time taken by each stage of searching a paper, each mark ending the stage named by it.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self._last = time.perf_counter()
+
+    def mark(self, stage: str):
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0) + now - self._last
+        self._last = now
+
+
+class _NullStageTimer:
+    # Used when instrumentation is off, so timing stages costs one empty method call each
+
+    def mark(self, stage: str):
+        pass
+
+
+NULL_STAGE_TIMER = _NullStageTimer()
+
+
+def _time_bin(seconds: float) -> int:
+    if seconds <= MIN_BINNED_SECONDS:
+        return 0
+    return min(int(math.log10(seconds / MIN_BINNED_SECONDS) * TIME_BINS_PER_DECADE) + 1, NUMBER_OF_TIME_BINS - 1)
+
+
+def time_bin_upper_edges() -> List[float]:
+    return [MIN_BINNED_SECONDS * 10 ** (i / TIME_BINS_PER_DECADE) for i in range(NUMBER_OF_TIME_BINS - 1)] + [math.inf]
+
+
+def _length_bin(length: int) -> int:
+    return min(max(length, 1).bit_length() - 1, NUMBER_OF_LENGTH_BINS - 1)
+
+
+class SearchStatistics:
+    """
+    Histograms of stage times and text lengths over papers, totals of matches and a list of slow papers.
+
+    Workers return the timings of each paper with its result, and these are added here, so statistics from any number of workers
+    and providers can be merged.
+    """
+
+    def __init__(self, slow_paper_seconds: float = SLOW_PAPER_SECONDS):
+        self.slow_paper_seconds = slow_paper_seconds
+        self.papers = 0
+        self.stage_seconds = {}
+        self.stage_histograms = {}
+        self.text_length_histogram = [0] * NUMBER_OF_LENGTH_BINS
+        self.text_characters = 0
+        self.match_counts = {name: 0 for name in MATCH_COUNT_NAMES}
+        self.slow_papers = []
+
+    def add(self, paper_statistics: dict):
+        self.papers += 1
+        total_seconds = 0
+        for stage, seconds in paper_statistics['stages'].items():
+            total_seconds += seconds
+            self._add_stage_time(stage, seconds)
+        self._add_stage_time('total', total_seconds)
+        self.text_length_histogram[_length_bin(paper_statistics['text_length'])] += 1
+        self.text_characters += paper_statistics['text_length']
+        for name in MATCH_COUNT_NAMES:
+            self.match_counts[name] += paper_statistics[name]
+        if total_seconds > self.slow_paper_seconds:
+            self.slow_papers.append(dict(paper_statistics, total=total_seconds))
+
+    def _add_stage_time(self, stage: str, seconds: float):
+        self.stage_seconds[stage] = self.stage_seconds.get(stage, 0) + seconds
+        if stage not in self.stage_histograms:
+            self.stage_histograms[stage] = [0] * NUMBER_OF_TIME_BINS
+        self.stage_histograms[stage][_time_bin(seconds)] += 1
+
+    def merge(self, other: 'SearchStatistics'):
+        self.papers += other.papers
+        for stage, seconds in other.stage_seconds.items():
+            self.stage_seconds[stage] = self.stage_seconds.get(stage, 0) + seconds
+            histogram = self.stage_histograms.setdefault(stage, [0] * NUMBER_OF_TIME_BINS)
+            for i, count in enumerate(other.stage_histograms[stage]):
+                histogram[i] += count
+        for i, count in enumerate(other.text_length_histogram):
+            self.text_length_histogram[i] += count
+        self.text_characters += other.text_characters
+        for name in MATCH_COUNT_NAMES:
+            self.match_counts[name] += other.match_counts[name]
+        self.slow_papers += [paper for paper in other.slow_papers if paper['total'] > self.slow_paper_seconds]
+
+    def to_dict(self) -> dict:
+        return {'slow_paper_seconds': self.slow_paper_seconds, 'papers': self.papers, 'stage_seconds': self.stage_seconds,
+                'stage_histograms': self.stage_histograms, 'time_bin_upper_edges': time_bin_upper_edges()[:-1],
+                'text_length_histogram': self.text_length_histogram, 'text_characters': self.text_characters,
+                'match_counts': self.match_counts, 'slow_papers': self.slow_papers}
+
+    @classmethod
+    def from_dict(cls, saved: dict) -> 'SearchStatistics':
+        statistics = cls(saved['slow_paper_seconds'])
+        statistics.papers = saved['papers']
+        statistics.stage_seconds = saved['stage_seconds']
+        statistics.stage_histograms = saved['stage_histograms']
+        statistics.text_length_histogram = saved['text_length_histogram']
+        statistics.text_characters = saved['text_characters']
+        statistics.match_counts = saved['match_counts']
+        statistics.slow_papers = saved['slow_papers']
+        return statistics
+
+    def save(self, path: str):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f)
+
+    def stage_quantile(self, stage: str, quantile: float) -> float:
+        # Upper edge of the histogram bin containing the quantile
+        histogram = self.stage_histograms[stage]
+        target = quantile * sum(histogram)
+        cumulative = 0
+        for count, upper_edge in zip(histogram, time_bin_upper_edges()):
+            cumulative += count
+            if cumulative >= target:
+                return upper_edge
+        return math.inf
+
+    def summary(self) -> str:
+        if self.papers == 0:
+            return 'No papers searched.'
+        total_seconds = self.stage_seconds['total']
+        lines = [f'{self.papers} papers, {round(self.text_characters / 2 ** 20, 1)}M characters, {round(total_seconds, 2)}s searching. '
+                 f'Matches: {self.match_counts}. {len(self.slow_papers)} papers over {self.slow_paper_seconds}s.']
+        for stage in sorted(self.stage_seconds, key=self.stage_seconds.get, reverse=True):
+            if stage != 'total':
+                lines.append(f'  {stage}: {round(self.stage_seconds[stage], 2)}s '
+                             f'({round(100 * self.stage_seconds[stage] / max(total_seconds, 1e-12), 1)}%), '
+                             f'p50 <= {self.stage_quantile(stage, 0.5):.2g}s, p99 <= {self.stage_quantile(stage, 0.99):.2g}s')
+        for paper in sorted(self.slow_papers, key=lambda p: p['total'], reverse=True)[:NUMBER_OF_SLOW_PAPERS_TO_SUMMARISE]:
+            slowest_stage = max(paper['stages'], key=paper['stages'].get)
+            lines.append(f'  Slow paper {paper["core_id"]}: {round(paper["total"], 2)}s, {paper["text_length"]} characters, '
+                         f'mostly {slowest_stage}')
+        return '\n'.join(lines)
+
+
+def merge_saved_statistics(paths: List[str], slow_paper_seconds: float = SLOW_PAPER_SECONDS) -> SearchStatistics:
+    merged = SearchStatistics(slow_paper_seconds)
+    for path in paths:
+        with open(path) as f:
+            merged.merge(SearchStatistics.from_dict(json.load(f)))
+    return merged
+
+
+def get_paper_statistics(core_id, text_length: int, timer: StageTimer, homonym_uses: List[str], ambiguous_uses: List[str],
+                         disambiguators: Dict[str, list]) -> dict:
+    return {'core_id': core_id, 'text_length': text_length, 'stages': timer.stages, 'homonym_uses': len(homonym_uses),
+            'ambiguous_uses': len(ambiguous_uses), 'disambiguated_uses': len(disambiguators)}
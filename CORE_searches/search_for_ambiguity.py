@@ -1,20 +1,26 @@
+import argparse
+import ast
+import cProfile
+import glob
 import json
 import multiprocessing
 import os
-import pickle
+import resource
 import tarfile
 import time
+import zlib
+from collections import deque
 from typing import Tuple, List
 
-import numpy as np
 import pandas as pd
 
 import sys
 
 sys.path.append('..')
 
-from CORE_searches import build_output_dict, core_project_path, filter_dict_pkl, clean_string, clean_paper_text, longest_ambiguous_homonym, \
-    longest_potential_disambiguator
+from CORE_searches import build_output_dict, core_project_path, tokenise_paper_text, matcher_path, \
+    get_matcher_metadata, load_matcher, save_fuzzy_index, load_fuzzy_index, get_token_positions, StageTimer, NULL_STAGE_TIMER, \
+    SearchStatistics, get_paper_statistics, merge_saved_statistics
 
 scratch_path = os.environ.get('SCRATCH')
 
@@ -22,49 +28,63 @@ core_MPM_project_path = os.path.join(scratch_path, 'MedicinalPlantMining', 'lite
 CORE_TAR_FILE = os.path.join(core_MPM_project_path, 'core_2022-03-11_dataset.tar.xz')
 
 core_paper_info_path = os.path.join(core_project_path, 'downloads', 'paper_info')
-for p in [core_paper_info_path]:
-    if not os.path.exists(p):
-        os.mkdir(p)
-
-
-def get_lists_of_words(words: List[str], largest_phrase: int) -> List[str]:
-    out_list = words.copy()
-    to_check = range(2, largest_phrase + 1)
-    for i in to_check:
-        out_list +=  [" ".join([words[j + c] for c in range(i)]) for j in range(len(words) - i + 1)]
-    return out_list
-
-
-def find_ambiguous_uses(text: str) -> Tuple[List[str], List[str], dict]:
-    # start_time = time.time()
+# Parquet dataset partitioned by provider, the file for each provider marks it as done
+core_paper_info_dataset_path = os.path.join(core_project_path, 'downloads', 'paper_info_dataset')
+# Stage timing statistics and profiles of each provider, when instrumented
+core_instrumentation_path = os.path.join(core_project_path, 'instrumentation')
+for p in [core_paper_info_path, core_paper_info_dataset_path, core_instrumentation_path]:
+    os.makedirs(p, exist_ok=True)
+
+# Number of papers read from an archive but not yet collected from the pool. This bounds peak memory use.
+MAX_PAPERS_IN_FLIGHT = int(os.environ.get('CORE_MAX_PAPERS_IN_FLIGHT', 1024))
+REPORT_EVERY_N_PAPERS = 10000
+# Number of worker processes, defaults to the number of CPUs
+POOL_SIZE = int(os.environ['CORE_POOL_SIZE']) if 'CORE_POOL_SIZE' in os.environ else os.cpu_count()
+# Edits allowed in author words of disambiguators not found exactly, 0 to only match exactly. The FuzzyDisambiguatorIndex is then
+# built once and saved next to the matcher, for each worker to load
+FUZZY_MAX_EDIT_DISTANCE = int(os.environ.get('CORE_FUZZY_MAX_EDIT_DISTANCE', 0))
+
+# Set in each worker by init_worker
+homonym_matcher = None
+fuzzy_index = None
+
+
+def find_ambiguous_uses(text: str, prefilter: bool = True, timer=NULL_STAGE_TIMER) -> Tuple[List[str], List[str], dict]:
+    """
+    :param text: full text of a paper
+    :param prefilter: skip texts without any relevant genera before cleaning them
+    :param timer: a StageTimer to record the time of each stage, by default these aren't timed
+    :return: homonyms used, homonyms used without disambiguators and the disambiguators found for the others
+    """
+    # Most papers mention no relevant genera, so skip cleaning these
+    if prefilter and not homonym_matcher.may_contain_homonyms(text):
+        timer.mark('prefilter')
+        return [], [], {}
+    timer.mark('prefilter')
 
     # Look for ambiguous uses in body text
-    clean_body_text = clean_paper_text(text)
-    # clean_time = time.time()
-    # time1 = round((clean_time - start_time), 2)
+    clean_body_words, clean_words_anywhere = tokenise_paper_text(text)
+    timer.mark('tokenise')
+    intersection = homonym_matcher.find_homonyms(clean_body_words)
+    timer.mark('find_homonyms')
 
-    clean_body_text_list = clean_body_text.split()
-    potential_homonym_uses = get_lists_of_words(clean_body_text_list, longest_ambiguous_homonym)
-
-    # Find potentially ambiguous words
-    intersection = set(potential_homonym_uses) & homonyms
-    # intersect_time = time.time()
-    # time2 = round((intersect_time - clean_time), 2)
     if len(intersection) > 0:
         homonym_uses = list(intersection)
         ambiguous_uses = []
         disambiguators = {}
 
         # Look for disambiguations anywhere in text
-        clean_text_anywhere = clean_string(text)
-        clean_text_anywhere_list = clean_text_anywhere.split()
-        potential_disambiguators = set(get_lists_of_words(clean_text_anywhere_list, longest_potential_disambiguator))
-        # disambg_time = time.time()
-        # time3 = round((disambg_time - intersect_time), 2)
+        potential_disambiguators = homonym_matcher.find_disambiguators(clean_words_anywhere)
+        timer.mark('find_disambiguators')
 
+        token_positions = None
         for homonym in homonym_uses:
 
-            disambiguators[homonym] = list(loaded_filter_dict[homonym] & potential_disambiguators)
+            disambiguators[homonym] = homonym_matcher.disambiguators_for(homonym, potential_disambiguators)
+            if len(disambiguators[homonym]) == 0 and fuzzy_index is not None:
+                if token_positions is None:
+                    token_positions = get_token_positions(clean_words_anywhere)
+                disambiguators[homonym] = fuzzy_index.find_disambiguators(homonym, clean_words_anywhere, token_positions)
             if len(disambiguators[homonym]) == 0:
                 ambiguous_uses.append(homonym)
                 del disambiguators[homonym]
@@ -73,24 +93,10 @@ def find_ambiguous_uses(text: str) -> Tuple[List[str], List[str], dict]:
             assert len(list(disambiguators.keys())) > 0
         if len(ambiguous_uses) == len(homonym_uses):
             assert len(list(disambiguators.keys())) == 0
+        timer.mark('disambiguate')
 
-        # end_time = time.time()
-        # total_time = end_time - start_time
-        # if total_time > 1:
-        #     print(f'Took {time1} to clean text of length: {len(text)}.')
-        #     print(f'Took {time2} to check intersection with lengths : {len(potential_homonym_uses)}:{len(homonyms)}.')
-        #     print(f'Took {time3} to clean strings and get potential disambiguators with text length : {len(text)}.')
-        #     print(
-        #         f'Took {round((end_time - disambg_time), 2)}  to search through homonyms with {len(potential_disambiguators)} potential disambiguators.')
-        #     print(f'Total time: {total_time}')
         return homonym_uses, ambiguous_uses, disambiguators
     else:
-        # end_time = time.time()
-        # total_time = end_time - start_time
-        # if total_time > 1:
-        #     print(f'Took {time1} to clean text of length: {len(text)}.')
-        #     print(f'Took {time2} to check intersection with lengths : {len(potential_homonym_uses)}:{len(homonyms)}.')
-        #     print(f'Total time: {total_time}')
         return [], [], {}
 
 
@@ -111,7 +117,7 @@ def get_info_from_core_paper(paper: dict):
         language = None
 
     if len(paper['journals']) >= 1:
-        journals = str(paper['journals'])
+        journals = paper['journals']
     else:
         journals = None
     if len(paper['subjects']) >= 1:
@@ -133,83 +139,364 @@ def get_info_from_core_paper(paper: dict):
     return corpusid, language, journals, subjects, topics, year, issn, doi, title, authors, url, oai
 
 
-def process_tar_paper_member_lines(lines):
+def process_tar_paper_member_lines(lines, instrument: bool = False, compressed: bool = False):
+    """
+    :param lines: lines of a paper's json file
+    :param instrument: also return the statistics of searching the paper, from get_paper_statistics
+    :param compressed: lines are zlib compressed, as read from the extracted corpus, so are decompressed here in the worker
+    :return: the output record if the paper uses any homonyms, otherwise None
+    """
+    timer = StageTimer() if instrument else NULL_STAGE_TIMER
+    if compressed:
+        lines = [zlib.decompress(line) for line in lines]
+        timer.mark('decompress')
     paper = json.loads(lines[0])
     if len(lines) > 1:
         raise ValueError('Unexpected number of lines in archive')
+    timer.mark('parse')
 
+    record = None
+    homonym_uses, ambiguous_uses, disambiguators = [], [], {}
     text = paper['fullText']
     if text is not None:
-        homonym_uses, ambiguous_uses, disambiguators = find_ambiguous_uses(text)
+        homonym_uses, ambiguous_uses, disambiguators = find_ambiguous_uses(text, timer=timer)
         if len(homonym_uses) > 0:
             corpusid, language, journals, subjects, topics, year, issn, doi, title, authors, url, oai = get_info_from_core_paper(
                 paper)
 
-            info_df = pd.DataFrame(
-                build_output_dict(corpusid, doi, year, title, authors,
-                                  url, language, journals, issn, homonym_uses, ambiguous_uses, disambiguators))
-            return info_df
-
-
-def get_relevant_papers_from_download():
+            record = build_output_dict(corpusid, doi, year, title, authors,
+                                       url, language, journals, issn, homonym_uses, ambiguous_uses, disambiguators)
+            timer.mark('output')
+    if instrument:
+        return record, get_paper_statistics(paper.get('coreId'), len(text or ''), timer, homonym_uses, ambiguous_uses, disambiguators)
+    return record
+
+
+def iter_provider_paper_lines(sub_archive: tarfile.TarFile):
+    # Lazily read papers out of a provider archive, so only papers in flight are held in memory
+    for paper_member in sub_archive:
+        if paper_member.name.endswith('.json'):
+            # Cannot serialize these objects, so get lines out before adding to process
+            f = sub_archive.extractfile(paper_member)
+            yield f.readlines()
+        elif '.tar' in paper_member.name:
+            print('Need more recursion')
+            raise ValueError
+
+
+def get_rss_mb() -> float:
+    # Peak resident set size of this process, ru_maxrss is given in kilobytes on linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def process_papers_in_window(pool, paper_lines, max_in_flight: int = MAX_PAPERS_IN_FLIGHT, report_every: int = REPORT_EVERY_N_PAPERS,
+                             instrument: bool = False, compressed: bool = False):
+    """
+    Submit papers to the pool with at most max_in_flight outstanding tasks, yielding results as they are collected.
+
+    Pool.imap_unordered consumes its input iterable eagerly, so a window of tasks is kept here instead to give backpressure
+    on reading from the archive.
+    :param pool:
+    :param paper_lines: iterable of lines for each paper
+    :param max_in_flight: maximum number of papers submitted but not yet collected
+    :param report_every: print throughput and memory use after this many papers
+    :param instrument: passed to process_tar_paper_member_lines
+    :param compressed: passed to process_tar_paper_member_lines
+    :return:
+    """
+    in_flight = deque()
+    start_time = time.time()
+    number_done = 0
+
+    def _collect_oldest():
+        nonlocal number_done
+        result = in_flight.popleft().get()
+        number_done += 1
+        if report_every and number_done % report_every == 0:
+            papers_per_sec = round(number_done / max(time.time() - start_time, 1e-9), 1)
+            print(f'{number_done} papers processed. {papers_per_sec} papers/sec. Peak RSS: {get_rss_mb()} MB.')
+        return result
+
+    for lines in paper_lines:
+        in_flight.append(pool.apply_async(process_tar_paper_member_lines, args=(lines, instrument, compressed)))
+        if len(in_flight) >= max_in_flight:
+            yield _collect_oldest()
+    while in_flight:
+        yield _collect_oldest()
+
+
+def get_paper_info_schema():
+    import pyarrow as pa
+    return pa.schema([('corpusid', pa.string()), ('DOI', pa.string()), ('year', pa.int64()), ('language', pa.string()),
+                      ('journals', pa.list_(pa.struct([('title', pa.string()), ('identifiers', pa.list_(pa.string()))]))),
+                      ('issn', pa.string()), ('title', pa.string()), ('authors', pa.list_(pa.string())),
+                      ('oaurl', pa.string()), ('homonym_uses', pa.list_(pa.string())), ('ambiguous_uses', pa.list_(pa.string())),
+                      ('disambiguators', pa.list_(pa.struct([('homonym', pa.string()), ('terms', pa.list_(pa.string()))])))])
+
+
+def get_provider_parquet(tar_archive_name: str, paper_info_dataset_path: str = core_paper_info_dataset_path) -> str:
+    return os.path.join(paper_info_dataset_path, f'tar_archive_name={tar_archive_name}', 'part-0.parquet')
+
+
+def provider_already_checked(tar_archive_name: str, paper_info_dataset_path: str = core_paper_info_dataset_path,
+                             legacy_paper_info_path: str = core_paper_info_path) -> bool:
+    # Providers saved as csv by earlier runs are converted to their partition, rather than searched again
+    return os.path.isfile(get_provider_parquet(tar_archive_name, paper_info_dataset_path)) or convert_legacy_provider_csv(
+        tar_archive_name, paper_info_dataset_path, legacy_paper_info_path)
+
+
+def _literal_or_none(value):
+    # Lists and dicts were saved in the csvs as their repr
+    return ast.literal_eval(value) if isinstance(value, str) else None
+
+
+def convert_legacy_provider_csv(tar_archive_name: str, paper_info_dataset_path: str = core_paper_info_dataset_path,
+                                legacy_paper_info_path: str = core_paper_info_path) -> bool:
+    '''
+    Save the results of a provider saved as csv by earlier runs as its partition of the parquet dataset, so they are read by
+    load_paper_info.
+    :param tar_archive_name: name of the provider
+    :param paper_info_dataset_path: dataset to save the partition in
+    :param legacy_paper_info_path: folder of the csvs
+    :return: whether there was a csv to convert
+    '''
+    provider_csv = os.path.join(legacy_paper_info_path, tar_archive_name + '.csv')
+    if not os.path.isfile(provider_csv):
+        return False
+    start_time = time.time()
+    try:
+        legacy_df = pd.read_csv(provider_csv, dtype=object)
+    except pd.errors.EmptyDataError:
+        legacy_df = pd.DataFrame()
+    legacy_df = legacy_df.astype(object).where(legacy_df.notna(), None)
+    provider_outputs = [build_output_dict(row['corpusid'], row['DOI'], row['year'], row['title'], _literal_or_none(row['authors']),
+                                          row['oaurl'], row['language'], _literal_or_none(row['journals']), row['issn'],
+                                          _literal_or_none(row['homonym_uses']), _literal_or_none(row['ambiguous_uses']),
+                                          _literal_or_none(row['disambiguators'])) for row in legacy_df.to_dict('records')]
+    save_provider_results(provider_outputs, tar_archive_name, start_time, paper_info_dataset_path)
+    return True
+
+
+def convert_legacy_provider_csvs(paper_info_dataset_path: str = core_paper_info_dataset_path,
+                                 legacy_paper_info_path: str = core_paper_info_path):
+    # Convert every provider saved as csv at once, e.g. before loading results without searching the remaining providers
+    for provider_csv in sorted(glob.glob(os.path.join(legacy_paper_info_path, '*.csv'))):
+        tar_archive_name = os.path.basename(provider_csv)[:-len('.csv')]
+        provider_already_checked(tar_archive_name, paper_info_dataset_path, legacy_paper_info_path)
+
+
+def save_provider_results(provider_outputs: List[dict], tar_archive_name: str, start_time: float,
+                          paper_info_dataset_path: str = core_paper_info_dataset_path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    provider_table = pa.Table.from_pylist(provider_outputs, schema=get_paper_info_schema())
+    provider_parquet = get_provider_parquet(tar_archive_name, paper_info_dataset_path)
+    os.makedirs(os.path.dirname(provider_parquet), exist_ok=True)
+    # Write then rename, so a partly written file is never taken as a finished provider
+    temp_path = provider_parquet + '.tmp'
+    pq.write_table(provider_table, temp_path)
+    os.replace(temp_path, provider_parquet)
+    end_time = time.time()
+    print(
+        f'{len(provider_outputs)} papers collected from provider: {tar_archive_name}. Took {round((end_time - start_time) / 60, 2)} mins. Peak RSS: {get_rss_mb()} MB.')
+
+
+def _profile_papers(paper_lines, instrument: bool, profile_path: str, compressed: bool = False, given_matcher_path: str = matcher_path,
+                    expected_metadata: dict = None) -> list:
+    # Papers are searched in this process rather than the pool, as cProfile only sees the process it runs in. The matcher is loaded
+    # as in a worker, and unloaded afterwards so the parent doesn't keep it
+    global homonym_matcher, fuzzy_index
+    expected_metadata = check_saved_matcher(given_matcher_path, expected_metadata)
+    if FUZZY_MAX_EDIT_DISTANCE > 0:
+        save_fuzzy_index(given_matcher_path, expected_metadata, FUZZY_MAX_EDIT_DISTANCE)
+    previous_matchers = homonym_matcher, fuzzy_index
+    init_worker(given_matcher_path, expected_metadata, FUZZY_MAX_EDIT_DISTANCE)
+    try:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        results = [process_tar_paper_member_lines(lines, instrument, compressed) for lines in paper_lines]
+        profiler.disable()
+        profiler.dump_stats(profile_path)
+    finally:
+        homonym_matcher, fuzzy_index = previous_matchers
+    return results
+
+
+def search_provider(pool, paper_lines, tar_archive_name: str, max_in_flight: int = MAX_PAPERS_IN_FLIGHT, instrument: bool = False,
+                    profile: bool = False, paper_info_dataset_path: str = core_paper_info_dataset_path,
+                    instrumentation_path: str = core_instrumentation_path, compressed: bool = False,
+                    given_matcher_path: str = matcher_path, expected_metadata: dict = None):
+    """
+    Search the papers of a provider and save the results. When instrumented, the provider's SearchStatistics are also saved as
+    json in instrumentation_path.
+
+    :param pool: worker pool from get_worker_pool
+    :param paper_lines: iterable of lines for each paper
+    :param tar_archive_name: name of the provider
+    :param max_in_flight: see process_papers_in_window
+    :param instrument: record stage timings of each paper
+    :param profile: search the provider in this process with cProfile, saving the profile next to the statistics
+    :param paper_info_dataset_path: dataset to save the results in
+    :param instrumentation_path: folder to save statistics and profiles in
+    :param compressed: the lines of each paper are zlib compressed, see process_tar_paper_member_lines
+    :param given_matcher_path: saved matcher the pool was made with, loaded in this process when profiling
+    :param expected_metadata: see check_saved_matcher
+    :return: None
+    """
+    start_time = time.time()
+    if instrument or profile:
+        os.makedirs(instrumentation_path, exist_ok=True)
+    if profile:
+        results = _profile_papers(paper_lines, instrument, os.path.join(instrumentation_path, tar_archive_name + '.prof'), compressed,
+                                  given_matcher_path, expected_metadata)
+    else:
+        results = process_papers_in_window(pool, paper_lines, max_in_flight, instrument=instrument, compressed=compressed)
+
+    provider_outputs = []
+    statistics = SearchStatistics() if instrument else None
+    for paper_record in results:
+        if instrument:
+            paper_record, paper_statistics = paper_record
+            statistics.add(paper_statistics)
+        if paper_record is not None:
+            provider_outputs.append(paper_record)
+
+    save_provider_results(provider_outputs, tar_archive_name, start_time, paper_info_dataset_path)
+    if instrument:
+        statistics.save(os.path.join(instrumentation_path, tar_archive_name + '.json'))
+        print(statistics.summary())
+
+
+def summarise_instrumentation(instrumentation_path: str = core_instrumentation_path) -> SearchStatistics:
+    '''
+    Merge the statistics saved for each provider, to see where time goes over the whole search.
+    :return:
+    '''
+    statistics = merge_saved_statistics(sorted(glob.glob(os.path.join(instrumentation_path, '*.json'))))
+    print(statistics.summary())
+    return statistics
+
+
+def load_paper_info(columns: List[str] = None, paper_info_dataset_path: str = core_paper_info_dataset_path) -> pd.DataFrame:
+    '''
+    Load results for all providers as one dataframe, with tar_archive_name given by the partition.
+    :param columns: only read these columns
+    :param paper_info_dataset_path: dataset the results were saved in
+    :return:
+    '''
+    return pd.read_parquet(paper_info_dataset_path, columns=columns)
+
+
+def provider_in_shard(provider_index: int, shard_index: int, shard_count: int) -> bool:
+    return provider_index % shard_count == shard_index
+
+
+def get_relevant_papers_from_download(max_in_flight: int = MAX_PAPERS_IN_FLIGHT, processes: int = None, shard_index: int = 0,
+                                      shard_count: int = 1, instrument: bool = False, profile_every: int = 0,
+                                      core_tar_file: str = CORE_TAR_FILE, paper_info_dataset_path: str = core_paper_info_dataset_path,
+                                      instrumentation_path: str = core_instrumentation_path,
+                                      legacy_paper_info_path: str = core_paper_info_path, given_matcher_path: str = matcher_path,
+                                      expected_metadata: dict = None):
+    '''
+    Search every provider in the CORE archive for homonym uses, saving results for each provider.
+
+    Providers can be split between several jobs by giving each job a shard_index in range(shard_count), each job then only
+    processes the providers at positions in the archive congruent to shard_index. The saved provider results mark completion, so jobs
+    with the same shard_count can be rerun independently.
+    :param instrument: save stage timing statistics of each provider, see search_provider
+    :param profile_every: profile every nth provider in the archive with cProfile, 0 to not profile
+    :param core_tar_file: the archive to search, e.g. a synthetic corpus from synthetic_corpus.py
+    :param paper_info_dataset_path: dataset to save the results of each provider in
+    :param instrumentation_path: folder to save statistics and profiles in
+    :param legacy_paper_info_path: folder of providers saved as csv by earlier runs
+    :param given_matcher_path: saved matcher to search with
+    :param expected_metadata: metadata the matcher must have been saved with, see check_saved_matcher
+    :return: None
+    '''
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(f'Shard index {shard_index} is not in range for {shard_count} shards')
     print('unzipping main archive')
-    with tarfile.open(CORE_TAR_FILE, 'r') as main_archive:
+    # A single pool is used for the whole run, so workers only load the matcher once
+    with tarfile.open(core_tar_file, 'r') as main_archive, get_worker_pool(processes, given_matcher_path, expected_metadata) as pool:
         # This is slow but useful info. # Main archive length: 10251
         # print(f'Main archive length: {len(main_archive.getnames())}')
         # names = main_archive.getnames()
         # iterate over members then get all members out of these
         # Each member is a Data provider, see here: https://core.ac.uk/data-providers
         print('unzipped main archive')
-        for provider in main_archive:
+        for provider_index, provider in enumerate(main_archive):
+            if not provider_in_shard(provider_index, shard_index, shard_count):
+                continue
             provider_file_obj = main_archive.extractfile(provider)
             tar_archive_name = os.path.basename(provider.name)
-            provider_csv = os.path.join(core_paper_info_path, tar_archive_name + '.csv')
 
             # Check if already done. Useful for when e.g. cluster fails
-            if not os.path.isfile(provider_csv):
-                start_time = time.time()
-
+            if not provider_already_checked(tar_archive_name, paper_info_dataset_path, legacy_paper_info_path):
                 with tarfile.open(fileobj=provider_file_obj, mode='r') as sub_archive:
                     # members = sub_archive.getmembers()  # Get members will get all files recursively, though deeper archives will need extracting too.
-
-                    tasks = []
-                    provider_outputs = []
-                    with multiprocessing.Pool(128) as pool:
-                        for paper_member in sub_archive:
-                            if paper_member.name.endswith('.json'):
-                                # Cannot serialize these objects, so get lines out before adding to process
-                                f = sub_archive.extractfile(paper_member)
-                                lines = f.readlines()
-                                tasks.append(pool.apply_async(process_tar_paper_member_lines, args=(lines,)))
-                            elif '.tar' in paper_member.name:
-                                print('Need more recursion')
-                                raise ValueError
-
-                        for task in tasks:
-                            paper_df = task.get()
-                            if paper_df is not None:
-                                provider_outputs.append(paper_df)
-
-                if len(provider_outputs) > 0:
-                    provider_df = pd.concat(provider_outputs)
-                else:
-                    provider_df = pd.DataFrame()
-                    provider_df['corpusid'] = np.nan
-
-                provider_df['tar_archive_name'] = tar_archive_name
-                provider_df.set_index(['corpusid'], drop=True).to_csv(provider_csv)
-                end_time = time.time()
-                print(
-                    f'{len(provider_df)} papers collected from provider: {tar_archive_name}. Took {round((end_time - start_time) / 60, 2)} mins.')
+                    search_provider(pool, iter_provider_paper_lines(sub_archive), tar_archive_name, max_in_flight, instrument,
+                                    profile_every > 0 and provider_index % profile_every == 0, paper_info_dataset_path,
+                                    instrumentation_path, given_matcher_path=given_matcher_path,
+                                    expected_metadata=expected_metadata)
 
             else:
-                print(f'Already checked: {provider_csv}')
+                print(f'Already checked: {tar_archive_name}')
+
+
+def check_saved_matcher(given_matcher_path: str = matcher_path, expected_metadata: dict = None) -> dict:
+    '''
+    Refuse to search with a matcher built from a different homonym list, rather than silently using out of date homonyms.
+    :param given_matcher_path: saved matcher to check
+    :param expected_metadata: defaults to the metadata of a matcher built from the current homonyms, see get_matcher_metadata
+    :return: the expected matcher metadata, to be checked again in each worker
+    '''
+    if expected_metadata is None:
+        expected_metadata = get_matcher_metadata()
+    if not os.path.isfile(given_matcher_path):
+        raise FileNotFoundError(f'No saved matcher at {given_matcher_path}. Run helper_functions.py to build it.')
+    try:
+        load_matcher(given_matcher_path, expected_metadata)
+    except ValueError as e:
+        raise ValueError(f'{e}. Run helper_functions.py to rebuild it.')
+    return expected_metadata
+
+
+def init_worker(given_matcher_path: str, expected_metadata: dict, fuzzy_max_edit_distance: int = 0):
+    # Runs once in each worker, so this doesn't rely on globals inherited by forking. The matcher file is memory mapped, so is
+    # shared between workers
+    global homonym_matcher, fuzzy_index
+    homonym_matcher = load_matcher(given_matcher_path, expected_metadata)
+    if fuzzy_max_edit_distance > 0:
+        fuzzy_index = load_fuzzy_index(given_matcher_path, expected_metadata, fuzzy_max_edit_distance)
+
+
+def get_worker_pool(processes: int = None, given_matcher_path: str = matcher_path, expected_metadata: dict = None):
+    if processes is None:
+        processes = POOL_SIZE
+    expected_metadata = check_saved_matcher(given_matcher_path, expected_metadata)
+    if FUZZY_MAX_EDIT_DISTANCE > 0:
+        # Built here once rather than in every worker
+        save_fuzzy_index(given_matcher_path, expected_metadata, FUZZY_MAX_EDIT_DISTANCE)
+    return multiprocessing.Pool(processes, initializer=init_worker,
+                                initargs=(given_matcher_path, expected_metadata, FUZZY_MAX_EDIT_DISTANCE))
 
 
 if __name__ == '__main__':
-    with open(filter_dict_pkl, 'rb') as f:
-        loaded_filter_dict = pickle.load(f)
-        homonyms = set(loaded_filter_dict.keys())
-        for homonym in homonyms:
-            loaded_filter_dict[homonym] = set(loaded_filter_dict[homonym])
-        get_relevant_papers_from_download()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--shard-index', type=int, default=0)
+    parser.add_argument('--shard-count', type=int, default=1)
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--instrument', action='store_true', help='save stage timings of each provider')
+    parser.add_argument('--profile-every', type=int, default=0, help='profile every nth provider with cProfile')
+    parser.add_argument('--summarise-instrumentation', action='store_true', help='merge the saved stage timings of all providers')
+    parser.add_argument('--convert-legacy-csvs', action='store_true', help='convert providers saved as csv to the parquet dataset')
+    args = parser.parse_args()
+
+    if args.summarise_instrumentation:
+        summarise_instrumentation()
+    elif args.convert_legacy_csvs:
+        convert_legacy_provider_csvs()
+    else:
+        get_relevant_papers_from_download(processes=args.processes, shard_index=args.shard_index, shard_count=args.shard_count,
+                                          instrument=args.instrument, profile_every=args.profile_every)
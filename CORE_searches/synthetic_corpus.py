@@ -0,0 +1,123 @@
+import io
+import json
+import random
+import tarfile
+
+# Words between the homonyms and disambiguators of synthetic texts
+FILLER_WORDS = ['the', 'plant', 'leaves', 'were', 'collected', 'from', 'and', 'in', 'of', 'species', 'extract', 'showed']
+# Cleaned infraspecific ranks, hybrid characters and authors, as added to each homonym in the filter dictionary
+SYNTHETIC_NAME_SUFFIXES = ['var', 'subsp', 'f', 'forma', 'subvar', 'nothosubsp', '×', '+']
+SYNTHETIC_AUTHORS = ['l', 'mill', 'dc', 'lam', 'hook f', 'a gray', 'sm', 'willd', 'benth', 'kunth', 'f muell', 'roxb']
+_SYLLABLES = ['ac', 'an', 'bra', 'ca', 'den', 'dro', 'el', 'fo', 'gi', 'lia', 'lo', 'mi', 'nia', 'or', 'phy', 'ra', 'si', 'tum',
+              'us', 'xa']
+
+
+def _make_synthetic_word(rng: random.Random) -> str:
+    return ''.join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+
+def make_synthetic_filter_dict(number_of_homonyms: int = 2000, seed: int = 0) -> dict:
+    '''
+    Homonyms and disambiguators shaped like those of build_filter_dict: cleaned binomials, some hybrids, each with its
+    infraspecific and hybrid variants and names with authors. Lets the matcher be benchmarked without the saved homonyms.
+    :param number_of_homonyms:
+    :param seed:
+    :return: map of homonym to set of disambiguators
+    '''
+    rng = random.Random(seed)
+    # Several homonyms share each genus, as in the prefilter
+    genera = [_make_synthetic_word(rng) for _ in range(max(number_of_homonyms // 4, 1))]
+    filter_dict = {}
+    while len(filter_dict) < number_of_homonyms:
+        genus = rng.choice(genera)
+        epithet = _make_synthetic_word(rng)
+        homonym = f'{genus} {epithet}' if rng.random() > 0.05 else f'× {genus} {epithet}'
+        disambiguators = {f'{homonym} {suffix}' for suffix in SYNTHETIC_NAME_SUFFIXES}
+        for author in rng.sample(SYNTHETIC_AUTHORS, rng.randint(2, 4)):
+            disambiguators.update([f'{homonym} {author}', f'{genus[0]} {epithet} {author}'])
+        filter_dict[homonym] = disambiguators
+    return filter_dict
+
+
+def make_synthetic_text(filter_dict: dict, number_of_words: int, homonym_density: float, seed: int = 0) -> str:
+    '''
+    Random filler words with homonyms and disambiguators scattered through them.
+    :param filter_dict: homonyms and their disambiguators
+    :param number_of_words:
+    :param homonym_density: proportion of words which are a homonym or one of its disambiguators
+    :param seed:
+    :return:
+    '''
+    rng = random.Random(seed)
+    homonyms = sorted(filter_dict.keys())
+    words = []
+    while len(words) < number_of_words:
+        if rng.random() < homonym_density:
+            homonym = rng.choice(homonyms)
+            if rng.random() < 0.5:
+                words.append(homonym.capitalize())
+            else:
+                words.append(rng.choice(sorted(filter_dict[homonym])).capitalize() + ',')
+        else:
+            words.append(rng.choice(FILLER_WORDS))
+    return ' '.join(words)
+
+
+def make_sectioned_text(filter_dict: dict, number_of_words: int, homonym_density: float = 0.001, seed: int = 0) -> str:
+    # Text with section headings, so that body text is cut before the references
+    body = make_synthetic_text(filter_dict, number_of_words, homonym_density, seed)
+    return '\n'.join([body, 'Acknowledgments', body[:len(body) // 10], '1 References', body[:len(body) // 5]])
+
+
+def make_synthetic_paper(filter_dict: dict, core_id: int, number_of_words: int, homonym_density: float, rng: random.Random,
+                         missing_text_fraction: float = 0.1) -> dict:
+    # Has the fields read by get_info_from_core_paper, some papers have no text as in CORE
+    full_text = None
+    if rng.random() >= missing_text_fraction:
+        full_text = make_sectioned_text(filter_dict, number_of_words, homonym_density, seed=rng.randrange(2 ** 32))
+    return {'coreId': str(core_id), 'language': {'code': 'en', 'name': 'English'}, 'journals': [], 'subjects': ['article'],
+            'topics': [], 'year': rng.randint(1950, 2022), 'issn': None, 'doi': f'10.0000/synthetic.{core_id}',
+            'oai': f'oai:synthetic:{core_id}', 'title': f'Synthetic paper {core_id}', 'authors': ['Author, A.', 'Author, B.'],
+            'downloadUrl': f'https://example.org/{core_id}.pdf', 'fullText': full_text}
+
+
+def _add_bytes_to_tar(archive: tarfile.TarFile, name: str, data: bytes):
+    member = tarfile.TarInfo(name)
+    member.size = len(data)
+    # Fixed, so that the same configuration gives the same archive
+    member.mtime = 0
+    archive.addfile(member, io.BytesIO(data))
+
+
+def write_synthetic_corpus(path: str, filter_dict: dict, number_of_providers: int = 4, papers_per_provider: int = 100,
+                           words_per_paper: int = 5000, homonym_density: float = 0.001, compression: str = 'xz', seed: int = 0) -> dict:
+    '''
+    Write an archive in the layout of the CORE download read by get_relevant_papers_from_download: a tar of provider tars, each
+    containing one json file per paper.
+
+    :param path: archive to write
+    :param filter_dict: homonyms and disambiguators to put in the texts
+    :param number_of_providers:
+    :param papers_per_provider:
+    :param words_per_paper: words in the body of each paper, before the acknowledgments and references
+    :param homonym_density: proportion of words which are a homonym or one of its disambiguators
+    :param compression: compression of the archives as in tarfile modes, e.g. 'xz' as in CORE, or '' for none
+    :param seed:
+    :return: the configuration used and size of the corpus
+    '''
+    rng = random.Random(seed)
+    mode_suffix = f':{compression}' if compression else ''
+    file_suffix = f'.tar.{compression}' if compression else '.tar'
+    text_bytes = 0
+    with tarfile.open(path, 'w' + mode_suffix) as main_archive:
+        for provider_number in range(number_of_providers):
+            provider_buffer = io.BytesIO()
+            with tarfile.open(fileobj=provider_buffer, mode='w' + mode_suffix) as provider_archive:
+                for paper_number in range(papers_per_provider):
+                    core_id = provider_number * papers_per_provider + paper_number
+                    paper = make_synthetic_paper(filter_dict, core_id, words_per_paper, homonym_density, rng)
+                    text_bytes += len((paper['fullText'] or '').encode('utf-8'))
+                    _add_bytes_to_tar(provider_archive, f'{provider_number}/{core_id}.json', json.dumps(paper).encode('utf-8'))
+            _add_bytes_to_tar(main_archive, f'synthetic_dataset/{provider_number}{file_suffix}', provider_buffer.getvalue())
+    return {'number_of_providers': number_of_providers, 'papers_per_provider': papers_per_provider, 'words_per_paper': words_per_paper,
+            'homonym_density': homonym_density, 'compression': compression, 'seed': seed, 'text_bytes': text_bytes}
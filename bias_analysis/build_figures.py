@@ -0,0 +1,82 @@
+import argparse
+import os
+import sys
+
+sys.path.append('..')
+
+import region_counts
+from taxonomy_inputs import wcvp_data_parquet, get_homonyms_parquet, get_homonyms
+from taxonomy_inputs.figure_pipeline import FigureSpec, build_figures
+from taxonomy_inputs.plotting import plot_year_figures, plot_family_figures, plot_ambiguous_taxon_statuses
+from native_distributions import plot_distributions, analyse_region_count_data, build_region_caches, tdwg3_paths_pkl
+
+_bias_analysis_path = os.path.dirname(os.path.abspath(__file__))
+_taxonomy_inputs_path = os.path.join(os.path.dirname(_bias_analysis_path), 'taxonomy_inputs')
+_bias_outputs = os.path.join(_bias_analysis_path, 'outputs')
+_regressions_outputs = os.path.join(_bias_outputs, 'regressions')
+_taxonomy_plots = os.path.join(_taxonomy_inputs_path, 'outputs', 'plots')
+_tdwg3_shapefile = os.path.join(_bias_analysis_path, 'inputs', 'wgsrpd-master', 'level3', 'level3.shp')
+
+_plot_inputs = (wcvp_data_parquet, get_homonyms_parquet('all'), get_homonyms_parquet('ambiguous'))
+# Made once by the region_caches spec, for the figures using region counts and maps
+_region_caches = (os.path.join(_bias_analysis_path, region_counts.species_regions_pkl),
+                  os.path.join(_bias_analysis_path, tdwg3_paths_pkl))
+_region_count_inputs = (wcvp_data_parquet, get_homonyms_parquet('ambiguous')) + _region_caches
+# Modules whose code the figures use besides the module of their function
+_plot_dependencies = (get_homonyms,)
+_region_count_dependencies = (get_homonyms, region_counts)
+_year_titles = ['WCVP Species Publications and Homonym Occurrence', 'WCVP Species Publications', 'WCVP Homonymous Species Publications',
+                'WCVP Ambiguous Homonymous Species Publications']
+_family_title = 'WCVP Species Homonyms in Families'
+
+# The figures in the README, and the caches they share, in no particular order as build_figures orders them by their inputs
+README_FIGURES = [
+    FigureSpec('year_plots', plot_year_figures, _plot_inputs,
+               tuple(os.path.join(_taxonomy_plots, t + '.jpg') for t in _year_titles) +
+               (os.path.join(_taxonomy_plots, _year_titles[0] + '_normalized.jpg'),), _taxonomy_inputs_path,
+               dependencies=_plot_dependencies),
+    FigureSpec('family_plots', plot_family_figures, _plot_inputs,
+               (os.path.join(_taxonomy_plots, _family_title + '.jpg'), os.path.join(_taxonomy_plots, _family_title + '_normalized.jpg')),
+               _taxonomy_inputs_path, dependencies=_plot_dependencies),
+    FigureSpec('taxon_statuses', plot_ambiguous_taxon_statuses, (get_homonyms_parquet('ambiguous'),),
+               (os.path.join(_taxonomy_plots, 'ambiguous_homonyms_taxon_status_pie_chart.png'),
+                os.path.join(_taxonomy_plots, 'ambiguous_homonyms_taxon_status_bar_chart.png')), _taxonomy_inputs_path,
+               dependencies=_plot_dependencies),
+    FigureSpec('region_caches', build_region_caches, (wcvp_data_parquet, _tdwg3_shapefile), _region_caches, _bias_analysis_path,
+               dependencies=_region_count_dependencies),
+    FigureSpec('distributions', plot_distributions, _region_count_inputs,
+               (os.path.join(_bias_outputs, 'ambiguous_homonyms_dists.jpg'),
+                os.path.join(_bias_outputs, 'underlying_species_distributions.jpg'), os.path.join(_bias_outputs, 'region_counts.csv')),
+               _bias_analysis_path, dependencies=_region_count_dependencies),
+    FigureSpec('region_count_regressions', analyse_region_count_data, _region_count_inputs,
+               (os.path.join(_bias_outputs, 'region_count_scatter.jpg'), os.path.join(_regressions_outputs, 'linear_regression.jpg'),
+                os.path.join(_regressions_outputs, 'LOESS.jpg')) +
+               tuple(os.path.join(_regressions_outputs, f'poly_{deg}_regression.jpg') for deg in range(2, 8)) +
+               (os.path.join(_regressions_outputs, 'model_comparison.csv'), os.path.join(_regressions_outputs, 'analysis_df.csv'),
+                os.path.join(_regressions_outputs, 'outliers.jpg'), os.path.join(_regressions_outputs, 'residuals_distributions.jpg'),
+                os.path.join(_regressions_outputs, 'best_model_residuals_distributions.jpg')),
+               _bias_analysis_path, dependencies=_region_count_dependencies),
+]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Render the README figures whose inputs have changed')
+    parser.add_argument('figures', nargs='*', help='only build these figures')
+    parser.add_argument('--force', action='store_true', help='render figures even if their inputs are unchanged')
+    parser.add_argument('--processes', type=int, default=None)
+    args = parser.parse_args()
+
+    specs = README_FIGURES
+    if len(args.figures) > 0:
+        unknown_figures = set(args.figures) - set(spec.name for spec in README_FIGURES)
+        if len(unknown_figures) > 0:
+            parser.error(f'Unknown figures: {sorted(unknown_figures)}')
+        # Along with the specs making caches they use
+        names = set(args.figures)
+        while True:
+            inputs = {p for spec in README_FIGURES if spec.name in names for p in spec.inputs}
+            needed = names | {spec.name for spec in README_FIGURES if inputs.intersection(spec.outputs)}
+            if needed == names:
+                break
+            names = needed
+        specs = [spec for spec in README_FIGURES if spec.name in names]
+    build_figures(specs, args.processes, args.force)
@@ -1,41 +1,54 @@
 import os
+import pickle
 from pathlib import Path
+from typing import List, Tuple
 
 import matplotlib.pyplot as plt
+from matplotlib.colors import to_rgba
 import numpy as np
 import pandas as pd
 import seaborn as sns
 import statsmodels.api as sm
 from sklearn.linear_model import LinearRegression
 from sklearn.preprocessing import PolynomialFeatures
-from wcvpy.wcvp_download import plot_native_number_accepted_taxa_in_regions, wcvp_accepted_columns
+from wcvpy.wcvp_download import wcvp_accepted_columns
 
-from taxonomy_inputs import taxonomy_inputs_output_path, WCVP_VERSION
+from taxonomy_inputs import load_wcvp_data, load_homonyms, get_file_sha256
+from region_counts import get_species_subsets, count_species_in_regions, get_species_regions
 
-ambiguous_homonyms = pd.read_csv(os.path.join(taxonomy_inputs_output_path, 'ambiguous_homonyms', 'homonyms.csv'),
-                                 dtype={'publication_year': 'Int64'})
-wcvp_given_data = pd.read_csv(
-    os.path.join(taxonomy_inputs_output_path, 'wcvp_data.csv'))
+tdwg3_shapefile = os.path.join('inputs', 'wgsrpd-master', 'level3', 'level3.shp')
+# Level 3 regions projected for plotting, see get_tdwg3_regions
+tdwg3_paths_pkl = os.path.join('outputs', 'tdwg3_mollweide_paths.pkl')
+TDWG3_PATHS_FORMAT_VERSION = 1
 
 
-def plot_distributions():
-    # the global distributions of the accepted species that are resolved to by ambiguous binomial homonyms
-    plot_native_number_accepted_taxa_in_regions(ambiguous_homonyms, wcvp_accepted_columns['species'], os.path.join('outputs'),
-                                                'ambiguous_homonyms_dists.jpg', include_extinct=True, wcvp_version=WCVP_VERSION)
-    # global distribution of underlying population
-    plot_native_number_accepted_taxa_in_regions(wcvp_given_data, wcvp_accepted_columns['species'], os.path.join('outputs'),
-                                                'underlying_species_distributions.jpg', include_extinct=True, wcvp_version=WCVP_VERSION)
+def get_region_counts() -> pd.DataFrame:
+    # Numbers of all accepted species and of accepted species resolved to by ambiguous homonyms native to each region
+    species_columns = [wcvp_accepted_columns['species']]
+    subsets = get_species_subsets({'All Accepted Species': load_wcvp_data(columns=species_columns),
+                                   'Accepted Species with Ambiguity': load_homonyms('ambiguous', columns=species_columns)})
+    return count_species_in_regions(subsets)
+
+
+def plot_distributions(render_maps: bool = True) -> pd.DataFrame:
+    region_counts = get_region_counts().reset_index()
+    region_counts.to_csv(os.path.join('outputs', 'region_counts.csv'))
+    if render_maps:
+        # Regions without any of the species are left uncoloured, rather than coloured as the smallest count
+        plot_dists_of_metrics(region_counts.replace(0, np.nan), ['Accepted Species with Ambiguity', 'All Accepted Species'],
+                              # the global distributions of the accepted species that are resolved to by ambiguous binomial homonyms,
+                              # and the global distribution of underlying population
+                              out_paths=[os.path.join('outputs', 'ambiguous_homonyms_dists.jpg'),
+                                         os.path.join('outputs', 'underlying_species_distributions.jpg')])
+    return region_counts
 
 
 def get_analysis_data():
     x_var = 'All Accepted Species'
     y_var = 'Accepted Species with Ambiguity'
-    ambiguous_homonyms_region_counts = pd.read_csv(os.path.join('outputs', 'ambiguous_homonyms_dists.jpg_regions.csv'), index_col=0)
-    ambiguous_homonyms_region_counts = ambiguous_homonyms_region_counts.rename(columns={'Number of Taxa': 'Accepted Species with Ambiguity'})
-    underlying_species_region_counts = pd.read_csv(os.path.join('outputs', 'underlying_species_distributions.jpg_regions.csv'), index_col=0)
-    underlying_species_region_counts = underlying_species_region_counts.rename(columns={'Number of Taxa': 'All Accepted Species'})
-
-    analysis_df = pd.merge(ambiguous_homonyms_region_counts, underlying_species_region_counts, on='Region')
+    region_counts = get_region_counts()
+    # Only regions with ambiguity, and in order of region so the LOESS fit doesn't depend on how the counts were made
+    analysis_df = region_counts[region_counts[y_var] > 0].reset_index()
     # analysis_df = analysis_df.sort_values(by=x_var) # LOESS is affected by order..
     return analysis_df, x_var, y_var
 
@@ -125,6 +138,7 @@ def analyse_region_count_data():
 
     # Step 3: Calculate the residuals (observed - expected)
     analysis_df[f'{y_var}_residuals'] = analysis_df[y_var] - analysis_df['expected_diversity']
+    analysis_df[f'{y_var}_best_model_residuals'] = analysis_df[y_var] - best_model_prediction
 
     # Step 4: Highlight cases with large residuals
     # Let's consider residuals greater than 2 standard deviations as "large differences"
@@ -143,7 +157,10 @@ def analyse_region_count_data():
     plot_annotated_regression_data(analysis_df, outpath, x_var, y_var)
 
 
-    plot_dist_of_metric(analysis_df, f'{y_var}_residuals', out_path=os.path.join(outpath, f'residuals_distributions.jpg'))
+    # The map for each model is drawn on the same base map
+    plot_dists_of_metrics(analysis_df, [f'{y_var}_residuals', f'{y_var}_best_model_residuals'],
+                          out_paths=[os.path.join(outpath, 'residuals_distributions.jpg'),
+                                     os.path.join(outpath, 'best_model_residuals_distributions.jpg')])
 
 
 def plot_annotated_regression_data(data, outpath, x_var, y_var):
@@ -211,62 +228,186 @@ def plot_annotated_regression_data(data, outpath, x_var, y_var):
     sns.reset_orig()
 
 
-def plot_dist_of_metric(df_with_region_data, metric, colormap: str = 'inferno', out_path: str = None):
-    import matplotlib.pyplot as plt
-    import matplotlib as mpl
-    import cartopy.crs as ccrs
-    import cartopy.feature as cfeature
-    import cartopy.io.shapereader as shpreader
+def _get_shapely_to_path():
+    try:
+        from cartopy.mpl.path import shapely_to_path
+    except ImportError:
+        # Older cartopy versions give one path per polygon
+        from cartopy.mpl.patch import geos_to_path
+        from matplotlib.path import Path as MplPath
 
-    tdwg3_shp = shpreader.Reader(
-        os.path.join('inputs', 'wgsrpd-master', 'level3', 'level3.shp'))
-    tdwg3_region_codes = df_with_region_data['Region'].values
+        def shapely_to_path(geometry):
+            return MplPath.make_compound_path(*geos_to_path(geometry))
+    return shapely_to_path
 
-    ## Colour maps range is 0 - 1, so the values are standardised for this
-    max_val = df_with_region_data[metric].max()
-    min_val = df_with_region_data[metric].min()
-    norm = plt.Normalize(min_val, max_val)
-    print('plotting countries')
 
-    plt.figure(figsize=(15, 9.375))
-    ax = plt.axes(projection=ccrs.Mollweide())
-    ax.coastlines(resolution='10m')
-    ax.add_feature(cfeature.BORDERS, linewidth=2)
+def _project_tdwg3_regions() -> Tuple[List[str], list]:
+    # Codes and Mollweide paths of each level 3 region, in the order of the shapefile
+    import cartopy.crs as ccrs
+    import cartopy.io.shapereader as shpreader
+    shapely_to_path = _get_shapely_to_path()
+
+    mollweide = ccrs.Mollweide()
+    plate_carree = ccrs.PlateCarree()
+    codes = []
+    paths = []
+    for region in shpreader.Reader(tdwg3_shapefile).records():
+        codes.append(region.attributes['LEVEL3_COD'])
+        paths.append(shapely_to_path(mollweide.project_geometry(region.geometry, plate_carree)))
+    return codes, paths
+
+
+def _get_tdwg3_metadata() -> dict:
+    import cartopy
+    return {'format_version': TDWG3_PATHS_FORMAT_VERSION, 'cartopy_version': cartopy.__version__,
+            'shapefile_sha256': get_file_sha256(tdwg3_shapefile)}
+
+
+_tdwg3_regions = None
+
+
+def get_tdwg3_regions() -> Tuple[List[str], list]:
+    """
+    Codes of the TDWG level 3 regions and their outlines as matplotlib paths already projected to Mollweide, loaded from a saved
+    cache that is rebuilt when the shapefile changes. Projecting the regions takes much longer than drawing them.
+
+    :return: region codes and paths, in the order of the shapefile
+    """
+    global _tdwg3_regions
+    if _tdwg3_regions is None:
+        metadata = _get_tdwg3_metadata()
+        if os.path.isfile(tdwg3_paths_pkl):
+            with open(tdwg3_paths_pkl, 'rb') as f:
+                saved = pickle.load(f)
+            if saved['metadata'] == metadata:
+                _tdwg3_regions = saved['codes'], saved['paths']
+        if _tdwg3_regions is None:
+            _tdwg3_regions = _project_tdwg3_regions()
+            Path(os.path.dirname(tdwg3_paths_pkl)).mkdir(parents=True, exist_ok=True)
+            # Write then rename, so other processes never load a partly written cache
+            temp_path = f'{tdwg3_paths_pkl}.{os.getpid()}'
+            with open(temp_path, 'wb') as f:
+                pickle.dump({'metadata': metadata, 'codes': _tdwg3_regions[0], 'paths': _tdwg3_regions[1]}, f,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, tdwg3_paths_pkl)
+    return _tdwg3_regions
+
+
+def build_region_caches():
+    # Saves the native regions of the species and the projected regions, so that figures using them can be rendered in parallel
+    # without each building them
+    get_species_regions()
+    get_tdwg3_regions()
+
+
+def get_region_colors(df_with_region_data: pd.DataFrame, metric: str, region_codes: List[str], cmap, norm) -> np.ndarray:
+    # Colour of each region code by the metric of its first row in the data, white for regions without data and the colormap's bad
+    # colour for missing values
+    region_values = df_with_region_data.drop_duplicates(subset=['Region']).set_index('Region')[metric]
+    values = pd.Series(region_codes).map(region_values)
+    colors = cmap(norm(values.to_numpy(dtype=float)))
+    colors[~pd.Series(region_codes).isin(region_values.index).to_numpy()] = to_rgba('white')
+    return colors
+
+
+def _get_metric_norm(df_with_region_data: pd.DataFrame, metric: str):
+    ## Colour maps range is 0 - 1, so the values are standardised for this
+    return plt.Normalize(df_with_region_data[metric].min(), df_with_region_data[metric].max())
+
+
+_base_map_paths = {}
+
+
+def _get_base_map_paths(coastline_resolution: str) -> Tuple[list, list]:
+    # Coastline and border paths projected to Mollweide once per process, rather than by cartopy again for every axes
+    if coastline_resolution not in _base_map_paths:
+        import cartopy.crs as ccrs
+        import cartopy.feature as cfeature
+        shapely_to_path = _get_shapely_to_path()
+        mollweide = ccrs.Mollweide()
+        plate_carree = ccrs.PlateCarree()
+        _base_map_paths[coastline_resolution] = tuple(
+            [shapely_to_path(mollweide.project_geometry(geometry, plate_carree)) for geometry in feature.geometries()]
+            for feature in [cfeature.COASTLINE.with_scale(coastline_resolution), cfeature.BORDERS])
+    return _base_map_paths[coastline_resolution]
+
+
+def _add_base_map(ax, region_paths: list, coastline_resolution: str = '10m'):
+    # Coastlines, borders and uncoloured regions, each drawn as one collection in the projected coordinates with the regions below
+    from matplotlib.collections import PathCollection
+    coastline_paths, border_paths = _get_base_map_paths(coastline_resolution)
+    regions = PathCollection(region_paths, facecolors='white', transform=ax.transData, zorder=1)
+    ax.add_collection(regions, autolim=False)
+    ax.add_collection(PathCollection(coastline_paths, facecolors='none', edgecolors='black', linewidths=1, transform=ax.transData,
+                                     zorder=2), autolim=False)
+    ax.add_collection(PathCollection(border_paths, facecolors='none', edgecolors='black', linewidths=2, transform=ax.transData,
+                                     zorder=2), autolim=False)
+    return regions
+
+
+def plot_dists_of_metrics(df_with_region_data: pd.DataFrame, metrics: List[str], out_paths: List[str] = None, colormap: str = 'inferno',
+                          small_multiples_path: str = None, ncols: int = 2):
+    """
+    Plot maps of several metrics of the regions, setting up the base map once. Each map in out_paths is drawn on the same figure,
+    only changing the region colours and colour bar.
+
+    :param df_with_region_data: with a 'Region' column of TDWG level 3 codes
+    :param metrics: columns to plot
+    :param out_paths: a file for the map of each metric
+    :param colormap:
+    :param small_multiples_path: file for a grid of the maps of all the metrics, drawn with coarser coastlines as each map is small
+    :param ncols: maps in each row of the grid
+    :return: None
+    """
+    import matplotlib as mpl
+    import cartopy.crs as ccrs
 
+    region_codes, region_paths = get_tdwg3_regions()
     cmap = mpl.colormaps[colormap]
-    for country in tdwg3_shp.records():
-
-        tdwg_code = country.attributes['LEVEL3_COD']
-        if tdwg_code in tdwg3_region_codes:
-            ax.add_geometries([country.geometry], ccrs.PlateCarree(),
-                              facecolor=cmap(
-                                  norm(df_with_region_data.loc[df_with_region_data['Region'] == tdwg_code, metric].iloc[
-                                           0])),
-                              label=tdwg_code)
-
-        else:
-            ax.add_geometries([country.geometry], ccrs.PlateCarree(),
-                              facecolor='white',
-                              label=tdwg_code)
-
-    all_map_isos = [country.attributes['LEVEL3_COD'] for country in tdwg3_shp.records()]
-    missed_names = [x for x in tdwg3_region_codes if x not in all_map_isos]
+    # Regions with missing values are white like those without data, rather than the colormap's transparent default
+    cmap.set_bad('white')
+    missed_names = sorted(set(df_with_region_data['Region']) - set(region_codes))
     print(f'iso codes not plotted on map: {missed_names}')
-    sm = plt.cm.ScalarMappable(cmap=cmap, norm=norm)
-    sm._A = []
-    plt.tight_layout()
-    fig = plt.gcf()
-    fig.subplots_adjust(right=0.8)
-    cbar_ax = fig.add_axes([0.85, 0.175, 0.02, 0.65])
-    cbar1 = fig.colorbar(sm, cax=cbar_ax)
-    cbar1.ax.tick_params(labelsize=30)
-
-
-    Path(os.path.dirname(out_path)).mkdir(parents=True, exist_ok=True)
-    plt.savefig(out_path, dpi=400, bbox_inches='tight')
-    plt.close()
-    plt.cla()
-    plt.clf()
+
+    if out_paths is not None:
+        fig = plt.figure(figsize=(15, 9.375))
+        regions = _add_base_map(plt.axes(projection=ccrs.Mollweide()), region_paths)
+        plt.tight_layout()
+        fig.subplots_adjust(right=0.8)
+        cbar_ax = fig.add_axes([0.85, 0.175, 0.02, 0.65])
+        sm = plt.cm.ScalarMappable(cmap=cmap)
+        sm.set_array([])
+        cbar1 = fig.colorbar(sm, cax=cbar_ax)
+        for metric, out_path in zip(metrics, out_paths):
+            print(f'plotting countries for {metric}')
+            norm = _get_metric_norm(df_with_region_data, metric)
+            regions.set_facecolor(get_region_colors(df_with_region_data, metric, region_codes, cmap, norm))
+            # Updates the colour bar too
+            sm.set_norm(norm)
+            cbar1.ax.tick_params(labelsize=30)
+            Path(os.path.dirname(out_path)).mkdir(parents=True, exist_ok=True)
+            fig.savefig(out_path, dpi=400, bbox_inches='tight')
+        plt.close(fig)
+
+    if small_multiples_path is not None:
+        nrows = -(-len(metrics) // ncols)
+        fig, axes = plt.subplots(nrows, ncols, figsize=(7.5 * ncols, 3.75 * nrows), subplot_kw={'projection': ccrs.Mollweide()},
+                                 squeeze=False)
+        for ax, metric in zip(axes.flat, metrics):
+            norm = _get_metric_norm(df_with_region_data, metric)
+            _add_base_map(ax, region_paths, '110m').set_facecolor(get_region_colors(df_with_region_data, metric, region_codes, cmap, norm))
+            ax.set_title(metric)
+            fig.colorbar(plt.cm.ScalarMappable(norm=norm, cmap=cmap), ax=ax, shrink=0.7)
+        for ax in axes.flat[len(metrics):]:
+            ax.remove()
+        Path(os.path.dirname(small_multiples_path)).mkdir(parents=True, exist_ok=True)
+        fig.savefig(small_multiples_path, dpi=400, bbox_inches='tight')
+        plt.close(fig)
+
+
+def plot_dist_of_metric(df_with_region_data, metric, colormap: str = 'inferno', out_path: str = None):
+    plot_dists_of_metrics(df_with_region_data, [metric], [out_path], colormap)
+
 
 if __name__ == '__main__':
     # plot_distributions()
@@ -0,0 +1,104 @@
+import os
+import pickle
+from pathlib import Path
+from typing import Dict
+
+import pandas as pd
+from wcvpy.wcvp_download import get_distributions_for_accepted_taxa, native_code_column, wcvp_accepted_columns
+
+from taxonomy_inputs import WCVP_VERSION, load_wcvp_data, wcvp_data_parquet, get_file_sha256
+
+# Native TDWG level 3 regions of every accepted species in the WCVP data, see get_species_regions
+species_regions_pkl = os.path.join('outputs', 'native_species_regions.pkl')
+SPECIES_REGIONS_FORMAT_VERSION = 1
+SUBSET_COLUMN = 'Subset'
+REGION_COLUMN = 'Region'
+_species_column = wcvp_accepted_columns['species']
+
+
+def build_species_regions(include_extinct: bool = True) -> pd.DataFrame:
+    """
+    Get the native regions of each accepted species in the WCVP data, looking up the distribution of each species once.
+
+    :param include_extinct: include regions where species are extinct
+    :return: one row per pair of accepted species and region
+    """
+    species = load_wcvp_data(columns=[_species_column])[[_species_column]].dropna().drop_duplicates()
+    distributions = get_distributions_for_accepted_taxa(species, _species_column, include_extinct=include_extinct,
+                                                        wcvp_version=WCVP_VERSION)
+    species_regions = distributions[[_species_column, native_code_column]].explode(native_code_column)
+    species_regions = species_regions.rename(columns={native_code_column: REGION_COLUMN}).dropna(subset=[REGION_COLUMN])
+    return species_regions.drop_duplicates().reset_index(drop=True)
+
+
+def _get_species_regions_metadata(include_extinct: bool) -> dict:
+    return {'format_version': SPECIES_REGIONS_FORMAT_VERSION, 'wcvp_version': WCVP_VERSION, 'include_extinct': include_extinct,
+            'wcvp_data_sha256': get_file_sha256(wcvp_data_parquet)}
+
+
+_species_regions = {}
+
+
+def get_species_regions(include_extinct: bool = True) -> pd.DataFrame:
+    """
+    Load the saved native regions of the accepted species, building and saving them first when they are missing or were built
+    from different WCVP data.
+
+    :return: one row per pair of accepted species and region
+    """
+    if include_extinct not in _species_regions:
+        cache_path = species_regions_pkl if include_extinct else species_regions_pkl.replace('.pkl', '_extant.pkl')
+        metadata = _get_species_regions_metadata(include_extinct)
+        species_regions = None
+        if os.path.isfile(cache_path):
+            with open(cache_path, 'rb') as f:
+                saved = pickle.load(f)
+            if saved['metadata'] == metadata:
+                species_regions = saved['species_regions']
+        if species_regions is None:
+            species_regions = build_species_regions(include_extinct)
+            Path(os.path.dirname(cache_path)).mkdir(parents=True, exist_ok=True)
+            # Write then rename, so other processes never load a partly written table
+            temp_path = f'{cache_path}.{os.getpid()}'
+            with open(temp_path, 'wb') as f:
+                pickle.dump({'metadata': metadata, 'species_regions': species_regions}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, cache_path)
+        _species_regions[include_extinct] = species_regions
+    return _species_regions[include_extinct]
+
+
+def get_species_subsets(frames: Dict[str, pd.DataFrame], by: str = None) -> pd.DataFrame:
+    """
+    The accepted species of each frame, as subsets to count in count_species_in_regions.
+
+    :param frames: map of subset name to frame with an accepted species column, e.g. {'Ambiguous Homonyms': ambiguous_homonyms}
+    :param by: split each frame into a subset for each value of this column, e.g. the accepted family, named '<name>: <value>'.
+        Rows missing a value aren't in any subset
+    :return: one row per pair of subset and accepted species
+    """
+    subsets = []
+    for name, df in frames.items():
+        if by is None:
+            subset_names = name
+        else:
+            # Dropped rather than made into a subset named after the missing value, e.g. '<name>: nan'
+            df = df.dropna(subset=[by])
+            subset_names = name + ': ' + df[by].astype(str)
+        subsets.append(pd.DataFrame({SUBSET_COLUMN: subset_names, _species_column: df[_species_column]}))
+    return pd.concat(subsets).dropna().drop_duplicates()
+
+
+def count_species_in_regions(species_subsets: pd.DataFrame, include_extinct: bool = True) -> pd.DataFrame:
+    """
+    Count the distinct accepted species of every subset native to each region, in one join of the subsets with the native regions.
+    Species without known native regions aren't counted.
+
+    :param species_subsets: from get_species_subsets
+    :param include_extinct: count species in regions where they are extinct
+    :return: counts with a row for each region, sorted, and a column for each subset
+    """
+    joined = species_subsets.merge(get_species_regions(include_extinct), on=_species_column)
+    counts = joined[[REGION_COLUMN, SUBSET_COLUMN]].value_counts().unstack(SUBSET_COLUMN, fill_value=0)
+    counts = counts.reindex(columns=species_subsets[SUBSET_COLUMN].unique(), fill_value=0).sort_index()
+    counts.columns.name = None
+    return counts
@@ -0,0 +1,194 @@
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from typing import Iterator
+
+import pandas as pd
+from wcvpy.wcvp_download import hybrid_characters, infraspecific_chars
+
+sys.path.append('..')
+
+from taxonomy_inputs import clean_whitespaces
+from taxonomy_inputs.homonym_lookup import NOT_FOUND, BATCH_VALUE_SEPARATOR, get_lookup_index, load_lookup_index
+from CORE_searches.helper_functions import clean_string
+
+CHUNK_SIZE = 100000
+# Chunks submitted to workers but not yet written, per process
+CHUNKS_IN_FLIGHT_PER_PROCESS = 2
+
+UNAMBIGUOUS = 'unambiguous'
+AMBIGUOUS = 'ambiguous homonym'
+DISAMBIGUATED = 'disambiguated by author'
+# Columns added by resolve_names, all strings
+RESOLUTION_COLUMNS = ['homonym_resolution', 'homonym', 'candidate_accepted_species']
+# Words which show a binomial isn't used on its own when they follow it, cleaned as in build_filter_dict
+_binomial_continuations = sorted({clean_string(ch) for ch in infraspecific_chars + hybrid_characters} - {''})
+
+
+def _split_binomial_key(key: str) -> tuple:
+    # The cleaned binomial at the start of a cleaned name with authors, keeping hybrid characters separated by spaces, and the rest
+    words = key.split()
+    binomial_length = 3 if len(words) > 2 and (words[0] in hybrid_characters or words[1] in hybrid_characters) else 2
+    return ' '.join(words[:binomial_length]), ' '.join(words[binomial_length:])
+
+
+def _continues_binomial(rest: str) -> bool:
+    return any(rest == c or rest.startswith(c + ' ') for c in _binomial_continuations)
+
+
+def _resolve_key(key: str, index_get) -> tuple:
+    result = index_get(key, NOT_FOUND)
+    if result is NOT_FOUND:
+        binomial, rest = _split_binomial_key(key)
+        result = index_get(binomial, NOT_FOUND)
+        if result is NOT_FOUND:
+            return UNAMBIGUOUS, None, None
+        if _continues_binomial(rest):
+            # An infraspecific or hybrid name, e.g. 'Aus bus var. cus', which the search also counts as disambiguating the homonym.
+            # It isn't any of the homonym's accepted species, so there are no candidates
+            return DISAMBIGUATED, BATCH_VALUE_SEPARATOR.join(result.homonyms), None
+        # Names with authors that don't match those of any record are as ambiguous as the binomial
+        return AMBIGUOUS, BATCH_VALUE_SEPARATOR.join(result.homonyms), BATCH_VALUE_SEPARATOR.join(result.accepted_species)
+    resolution = AMBIGUOUS if result.ambiguous else DISAMBIGUATED
+    return resolution, BATCH_VALUE_SEPARATOR.join(result.homonyms), BATCH_VALUE_SEPARATOR.join(result.accepted_species)
+
+
+def resolve_names(names: pd.Series, authors: pd.Series = None) -> pd.DataFrame:
+    """
+    Classify names as unambiguous, ambiguous homonyms or disambiguated by their authors or by continuing as an infraspecific or
+    hybrid name. When authors are given separately they are added to the names in the same way as add_authors_to_names.
+
+    :param names: binomials, which may include authors
+    :param authors: authors of each name
+    :return: resolution, matching homonym and candidate accepted species for each name, with the index of names
+    """
+    if authors is not None:
+        names = clean_whitespaces(names.str.cat(authors.fillna(''), sep=' '))
+    index_get = get_lookup_index().get
+    # Occurrence tables repeat names a lot, so each distinct name is only resolved once
+    resolved = {}
+    rows = []
+    for name in names:
+        row = resolved.get(name)
+        if row is None:
+            key = clean_string(name) if isinstance(name, str) else None
+            row = _resolve_key(key, index_get) if key else (UNAMBIGUOUS, None, None)
+            resolved[name] = row
+        rows.append(row)
+    return pd.DataFrame(rows, columns=RESOLUTION_COLUMNS, index=names.index)
+
+
+def resolve_chunk(chunk: pd.DataFrame, name_col: str, authors_col: str = None) -> pd.DataFrame:
+    resolutions = resolve_names(chunk[name_col], chunk[authors_col] if authors_col is not None else None)
+    return pd.concat([chunk, resolutions], axis=1)
+
+
+def _is_parquet(path: str) -> bool:
+    return os.path.splitext(path)[1] == '.parquet'
+
+
+def iter_input_chunks(input_path: str, name_col: str, authors_col: str = None, chunk_size: int = CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    if _is_parquet(input_path):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(input_path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        # Names are read as strings in every chunk, rather than by the types inferred for each chunk
+        string_columns = {c: str for c in [name_col, authors_col] if c is not None}
+        yield from pd.read_csv(input_path, chunksize=chunk_size, dtype=string_columns)
+
+
+class _ChunkWriter:
+    # Appends chunks to a csv or parquet file, so only one chunk is held at a time
+    def __init__(self, output_path: str):
+        self.output_path = output_path
+        self._parquet_writer = None
+        self._started = False
+
+    def write(self, chunk: pd.DataFrame):
+        if _is_parquet(self.output_path):
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            if self._parquet_writer is None:
+                schema = pa.Schema.from_pandas(chunk, preserve_index=False)
+                # A first chunk without homonyms has no values to infer the types of these from, which later chunks couldn't be cast to
+                for c in RESOLUTION_COLUMNS:
+                    if c in schema.names:
+                        schema = schema.set(schema.get_field_index(c), pa.field(c, pa.string()))
+                self._parquet_writer = pq.ParquetWriter(self.output_path, schema)
+            self._parquet_writer.write_table(pa.Table.from_pandas(chunk, schema=self._parquet_writer.schema, preserve_index=False))
+        else:
+            chunk.to_csv(self.output_path, mode='a' if self._started else 'w', header=not self._started, index=False)
+        self._started = True
+
+    def close(self):
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+
+
+def init_worker():
+    # Load the index once in each worker rather than with each chunk
+    get_lookup_index()
+
+
+def _resolve_chunks(chunks: Iterator[pd.DataFrame], name_col: str, authors_col: str, processes: int) -> Iterator[pd.DataFrame]:
+    if processes == 1:
+        for chunk in chunks:
+            yield resolve_chunk(chunk, name_col, authors_col)
+        return
+    # Builds and saves the index if needed before the workers load it
+    load_lookup_index()
+    # As in process_papers_in_window, a window of submitted chunks keeps memory bounded, and results are in input order
+    with multiprocessing.Pool(processes, initializer=init_worker) as pool:
+        in_flight = deque()
+        for chunk in chunks:
+            in_flight.append(pool.apply_async(resolve_chunk, args=(chunk, name_col, authors_col)))
+            if len(in_flight) >= processes * CHUNKS_IN_FLIGHT_PER_PROCESS:
+                yield in_flight.popleft().get()
+        while in_flight:
+            yield in_flight.popleft().get()
+
+
+def resolve_name_table(input_path: str, output_path: str, name_col: str, authors_col: str = None, chunk_size: int = CHUNK_SIZE,
+                       processes: int = None):
+    """
+    Stream a csv or parquet table of names through resolve_names chunk by chunk, writing the table with the resolutions added.
+
+    :param input_path: csv or parquet table
+    :param output_path: csv or parquet file to write to, by its extension
+    :param name_col: column of names, which may include authors
+    :param authors_col: optional column of authors
+    :param chunk_size: rows read at a time
+    :param processes: number of worker processes, defaults to the number of cpus
+    :return: None
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    start_time = time.time()
+    number_of_rows = 0
+    writer = _ChunkWriter(output_path)
+    try:
+        for resolved_chunk in _resolve_chunks(iter_input_chunks(input_path, name_col, authors_col, chunk_size), name_col, authors_col,
+                                              processes):
+            writer.write(resolved_chunk)
+            number_of_rows += len(resolved_chunk)
+            rows_per_sec = round(number_of_rows / max(time.time() - start_time, 1e-9), 1)
+            print(f'{number_of_rows} rows resolved. {rows_per_sec} rows/sec.')
+    finally:
+        writer.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Resolve a table of names against the ambiguous homonyms')
+    parser.add_argument('input', help='csv or parquet table of names')
+    parser.add_argument('output', help='csv or parquet file to write')
+    parser.add_argument('--name-column', required=True)
+    parser.add_argument('--authors-column', default=None)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--processes', type=int, default=None)
+    args = parser.parse_args()
+
+    resolve_name_table(args.input, args.output, args.name_column, args.authors_column, args.chunk_size, args.processes)
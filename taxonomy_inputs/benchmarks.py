@@ -0,0 +1,135 @@
+import random
+import sys
+import time
+
+import pandas as pd
+
+sys.path.append('..')
+
+from taxonomy_inputs import get_wcvp_snapshot, load_homonyms, add_authors_to_names, RANKS_TO_CONSIDER, \
+    parse_publication_years, load_wcvp_data, get_legend_counts, LEGEND_LABELS
+from wcvpy.wcvp_download import wcvp_columns, wcvp_accepted_columns, clean_whitespaces_in_names
+
+
+def _get_species_data() -> pd.DataFrame:
+    wcvp_data = get_wcvp_snapshot()
+    return wcvp_data[wcvp_data[wcvp_columns['rank']].isin(RANKS_TO_CONSIDER)]
+
+
+def _add_authors_to_given_col_by_row(df: pd.DataFrame, col):
+    df[col + '_with_authors'] = df[col].str.cat(
+        df[wcvp_columns['authors']].fillna(''),
+        sep=' ').apply(clean_whitespaces_in_names)
+
+    column_series = [df[c].fillna('') for c in
+                     [wcvp_columns['paranthet_author'], wcvp_columns['primary_author']]]
+    df[col + '_with_paranthet_authors'] = df[col].str.cat(column_series,
+                                                          sep=' ').apply(
+        clean_whitespaces_in_names)
+
+    df[col + '_with_primary_author'] = df[col].str.cat(
+        df[wcvp_columns['primary_author']].fillna(''),
+        sep=' ').apply(clean_whitespaces_in_names)
+
+
+def add_authors_to_names_by_row(df: pd.DataFrame):
+    '''
+    Original row by row implementation of add_authors_to_names, which it should agree with. Kept as the baseline of
+    benchmark_add_authors_to_names and the reference of tests/test_names_with_authors.py.
+    '''
+    _add_authors_to_given_col_by_row(df, wcvp_columns['name'])
+
+    df['abbreviated_genus'] = df[wcvp_columns['genus']].apply(lambda x: x[0] + '.')
+    df['sp_binomial_with_abbreviated_genus'] = df['abbreviated_genus'].str.cat(
+        df['species'].fillna(''),
+        sep=' ').apply(clean_whitespaces_in_names)
+
+    _add_authors_to_given_col_by_row(df, 'sp_binomial_with_abbreviated_genus')
+
+
+def benchmark_add_authors_to_names():
+    '''
+    Compare adding names with authors as whole columns with the original row by row cleaning, checking the added columns are
+    identical.
+    '''
+    species_data = _get_species_data()
+    by_row_data = species_data.copy()
+    start = time.perf_counter()
+    add_authors_to_names_by_row(by_row_data)
+    by_row_time = time.perf_counter() - start
+
+    vectorised_data = species_data.copy()
+    start = time.perf_counter()
+    add_authors_to_names(vectorised_data)
+    vectorised_time = time.perf_counter() - start
+
+    added_columns = [c for c in vectorised_data.columns if c not in species_data.columns]
+    pd.testing.assert_frame_equal(vectorised_data[added_columns], by_row_data[added_columns])
+    print(f'Names with authors for {len(species_data)} records: row by row {round(by_row_time, 2)}s, '
+          f'whole columns {round(vectorised_time, 2)}s ({round(by_row_time / vectorised_time, 1)}x)')
+
+
+def benchmark_publication_years():
+    '''
+    Time parsing publication years from the WCVP first_published column. The years are checked against the original row by row
+    parsing in tests/test_publication_years.py.
+    '''
+    first_published = _get_species_data()['first_published']
+    start = time.perf_counter()
+    years = parse_publication_years(first_published)
+    print(f'Publication years for {len(first_published)} records ({years.notna().sum()} parsed) in '
+          f'{round(time.perf_counter() - start, 2)}s')
+
+
+def benchmark_homonym_lookup(number_of_names: int = 1000000):
+    '''
+    Time lookups of a mix of ambiguous homonyms, names with authors and names which aren't homonyms.
+    '''
+    from taxonomy_inputs.homonym_lookup import load_lookup_index, lookup_names
+
+    start = time.perf_counter()
+    index = load_lookup_index()
+    print(f'Loaded lookup index of {len(index)} names in {round(time.perf_counter() - start, 2)}s')
+
+    homonyms = load_homonyms('ambiguous', columns=[wcvp_columns['name'], 'taxon_name_with_authors'])
+    rng = random.Random(0)
+    name_pool = homonyms[wcvp_columns['name']].tolist() + homonyms['taxon_name_with_authors'].tolist() + \
+                [f'{name} sp. nov.' for name in homonyms[wcvp_columns['name']]]
+    names = [rng.choice(name_pool) for _ in range(number_of_names)]
+
+    start = time.perf_counter()
+    ambiguous = sum(result.ambiguous for result in lookup_names(names))
+    lookup_time = time.perf_counter() - start
+    print(f'Looked up {number_of_names} names ({ambiguous} ambiguous) in {round(lookup_time, 2)}s: '
+          f'{round(1e6 * lookup_time / number_of_names, 2)}us per name, {round(60 * number_of_names / lookup_time / 1e6, 1)}M names per minute')
+
+
+def benchmark_legend_counts():
+    '''
+    Compare counting legends for the category plots from coded ids with stacking the full frames, as the plots originally did,
+    checking the counts are identical.
+    '''
+    plotting_columns = ['plant_name_id', 'publication_year', wcvp_accepted_columns['family']]
+    frames = [load_wcvp_data(columns=plotting_columns), load_homonyms('all', columns=plotting_columns),
+              load_homonyms('ambiguous', columns=plotting_columns)]
+    for var in ['publication_year', wcvp_accepted_columns['family']]:
+        start = time.perf_counter()
+        all_data = pd.concat([df.dropna(subset=[var]).assign(Legend=legend) for df, legend in zip(frames, LEGEND_LABELS)])
+        all_data = all_data.drop_duplicates(subset=['plant_name_id'], keep='last')
+        full_frame_counts = pd.crosstab(all_data[var], all_data['Legend']).reindex(columns=LEGEND_LABELS, fill_value=0)
+        full_frame_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        counts = get_legend_counts(var, *frames)
+        coded_time = time.perf_counter() - start
+
+        pd.testing.assert_frame_equal(counts, full_frame_counts, check_names=False, check_dtype=False, check_index_type=False)
+        print(f'Legend counts of {var}: full frames {round(full_frame_time, 2)}s, coded {round(coded_time, 2)}s '
+              f'({round(full_frame_time / coded_time, 1)}x)')
+
+
+if __name__ == '__main__':
+    benchmark_add_authors_to_names()
+    benchmark_publication_years()
+    benchmark_homonym_lookup()
+    benchmark_legend_counts()
@@ -0,0 +1,124 @@
+import hashlib
+import inspect
+import json
+import multiprocessing
+import os
+import time
+from types import ModuleType
+from typing import Callable, Dict, List, NamedTuple, Tuple
+
+from taxonomy_inputs import taxonomy_inputs_output_path, get_file_sha256
+
+figure_manifest_json = os.path.join(taxonomy_inputs_output_path, 'figure_manifest.json')
+FIGURE_MANIFEST_FORMAT_VERSION = 2
+
+
+class FigureSpec(NamedTuple):
+    # A group of figures made by one call of function(**params), run from working_dir as the plotting scripts expect. Outputs
+    # can be caches that other specs take as inputs, and dependencies are modules other than the function's own whose code the
+    # figures depend on, e.g. loaders of the data
+    name: str
+    function: Callable
+    inputs: Tuple[str, ...]
+    outputs: Tuple[str, ...]
+    working_dir: str
+    params: dict = None
+    dependencies: Tuple[ModuleType, ...] = ()
+
+
+def get_figure_hash(spec: FigureSpec) -> str:
+    '''
+    Hash of everything a figure is made from: its input files, parameters, the source of the module defining its function and the
+    sources of its dependencies.
+    '''
+    missing_inputs = [p for p in spec.inputs if not os.path.isfile(p)]
+    if len(missing_inputs) > 0:
+        raise FileNotFoundError(f'Inputs of figure {spec.name} are missing: {missing_inputs}')
+    fingerprint = {'format_version': FIGURE_MANIFEST_FORMAT_VERSION,
+                   'function': f'{spec.function.__module__}.{spec.function.__qualname__}',
+                   'source_sha256': get_file_sha256(inspect.getsourcefile(spec.function)),
+                   'dependencies_sha256': {m.__name__: get_file_sha256(inspect.getsourcefile(m)) for m in spec.dependencies},
+                   'inputs_sha256': {p: get_file_sha256(p) for p in spec.inputs},
+                   'params': repr(sorted((spec.params or {}).items()))}
+    return hashlib.sha256(json.dumps(fingerprint, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def load_figure_manifest(manifest_path: str = figure_manifest_json) -> Dict[str, str]:
+    if not os.path.isfile(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def _save_figure_manifest(manifest: Dict[str, str], manifest_path: str):
+    # Write then rename, so an interrupted build never leaves a partly written manifest
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    temp_path = f'{manifest_path}.{os.getpid()}'
+    with open(temp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(temp_path, manifest_path)
+
+
+def _get_stages(specs: List[FigureSpec]) -> List[List[FigureSpec]]:
+    # Figures whose inputs are outputs of other figures are built in a later stage than those figures
+    producers = {output: spec.name for spec in specs for output in spec.outputs}
+    built = set()
+    remaining = list(specs)
+    stages = []
+    while remaining:
+        stage = [spec for spec in remaining if all(producers.get(p, spec.name) in built | {spec.name} for p in spec.inputs)]
+        if len(stage) == 0:
+            raise ValueError(f'Figures depend on each other: {[spec.name for spec in remaining]}')
+        stages.append(stage)
+        built.update(spec.name for spec in stage)
+        remaining = [spec for spec in remaining if spec.name not in built]
+    return stages
+
+
+def init_worker():
+    # Figures are only saved, so workers never need an interactive backend
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def render_figure(spec: FigureSpec) -> Tuple[str, float]:
+    from matplotlib import pyplot as plt
+    start = time.perf_counter()
+    os.chdir(spec.working_dir)
+    spec.function(**(spec.params or {}))
+    plt.close('all')
+    return spec.name, time.perf_counter() - start
+
+
+def build_figures(specs: List[FigureSpec], processes: int = None, force: bool = False, manifest_path: str = figure_manifest_json) -> List[str]:
+    """
+    Render the figures whose inputs, parameters or code have changed since they were last built, or whose outputs are missing.
+    Figures in each stage are rendered in parallel, each in a fresh process so styles set by one plot can't leak into another.
+
+    :param specs: figures to build
+    :param processes: number of worker processes, defaults to the number of cpus
+    :param force: render every figure
+    :param manifest_path: json of the hash each figure was last built from
+    :return: names of the figures rendered
+    """
+    if len(set(spec.name for spec in specs)) != len(specs):
+        raise ValueError('Figure names must be unique')
+    manifest = load_figure_manifest(manifest_path)
+    rendered = []
+    for stage in _get_stages(specs):
+        hashes = {spec.name: get_figure_hash(spec) for spec in stage}
+        stale = [spec for spec in stage if force or manifest.get(spec.name) != hashes[spec.name] or
+                 not all(os.path.isfile(p) for p in spec.outputs)]
+        for name in sorted(set(hashes) - set(spec.name for spec in stale)):
+            print(f'Up to date: {name}')
+        if len(stale) == 0:
+            continue
+        with multiprocessing.Pool(min(processes or multiprocessing.cpu_count(), len(stale)), initializer=init_worker,
+                                  maxtasksperchild=1) as pool:
+            for name, seconds in pool.imap_unordered(render_figure, stale):
+                print(f'Rendered {name} in {round(seconds, 1)}s')
+                # Saved after each figure, so an interrupted build only redoes the figures that hadn't finished
+                manifest[name] = hashes[name]
+                _save_figure_manifest(manifest, manifest_path)
+                rendered.append(name)
+    return rendered
@@ -1,9 +1,9 @@
+import hashlib
 import os
 
 import numpy as np
 import pandas as pd
-from wcvpy.wcvp_download import get_all_taxa, wcvp_columns, wcvp_accepted_columns, clean_whitespaces_in_names
-from datetime import datetime
+from wcvpy.wcvp_download import get_all_taxa, wcvp_columns, wcvp_accepted_columns
 
 scratch_path = os.environ.get('KEWSCRATCHPATH')
 project_path = os.path.join(scratch_path, 'WCVPHomonyms')
@@ -12,6 +12,100 @@ taxonomy_inputs_output_path = os.path.join(project_path, 'taxonomy_inputs', 'out
 RANKS_TO_CONSIDER = ['Species']
 WCVP_VERSION = None
 
+snapshot_path = os.path.join(taxonomy_inputs_output_path, 'snapshots')
+wcvp_data_parquet = os.path.join(taxonomy_inputs_output_path, 'wcvp_data.parquet')
+# Low cardinality columns stored as categories in the typed parquet outputs
+_categorical_columns = [wcvp_columns['status'], wcvp_columns['rank'], wcvp_accepted_columns['family'], 'family']
+
+
+def _to_typed(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.copy()
+    for c in _categorical_columns:
+        if c in df.columns:
+            df[c] = df[c].astype('category')
+    if 'publication_year' in df.columns:
+        df['publication_year'] = pd.to_numeric(df['publication_year']).astype('Int64')
+    for c in df.columns:
+        # Columns read from csv in chunks can mix strings and numbers, which parquet can't store
+        if df[c].dtype == object and pd.api.types.infer_dtype(df[c], skipna=True).startswith('mixed'):
+            df[c] = df[c].where(df[c].isna(), df[c].astype(str))
+    return df
+
+
+def _from_typed(df: pd.DataFrame) -> pd.DataFrame:
+    # Subsets keep the categories of the full data, which would appear as empty groups and counts
+    for c in df.columns:
+        if isinstance(df[c].dtype, pd.CategoricalDtype):
+            df[c] = df[c].cat.remove_unused_categories()
+    return df
+
+
+def save_csv_and_parquet(df: pd.DataFrame, csv_path: str):
+    # The csv is kept for reading by people and other tools, the parquet is what this project loads
+    df.to_csv(csv_path)
+    _to_typed(df).to_parquet(os.path.splitext(csv_path)[0] + '.parquet')
+
+
+def _snapshot_file(prefix: str, version) -> str:
+    if version is None:
+        # The latest release changes over time, so is never saved or loaded as a snapshot
+        raise ValueError('Snapshots are only kept for an explicit WCVP version')
+    return os.path.join(snapshot_path, f'{prefix}_{version}_{"_".join(RANKS_TO_CONSIDER)}.parquet')
+
+
+def get_wcvp_snapshot() -> pd.DataFrame:
+    """
+    Returns taxa of RANKS_TO_CONSIDER in WCVP_VERSION, downloading them with get_all_taxa only the first time and caching them
+    as typed parquet. When WCVP_VERSION is None the latest release is downloaded every time, as a cached copy would not be
+    refreshed when a new version is released.
+
+    :return: WCVP taxa
+    """
+    if WCVP_VERSION is None:
+        return _to_typed(get_all_taxa(ranks=RANKS_TO_CONSIDER, version=WCVP_VERSION))
+    snapshot_file = _snapshot_file('wcvp', WCVP_VERSION)
+    if os.path.isfile(snapshot_file):
+        return _from_typed(pd.read_parquet(snapshot_file))
+    wcvp_data = _to_typed(get_all_taxa(ranks=RANKS_TO_CONSIDER, version=WCVP_VERSION))
+    os.makedirs(snapshot_path, exist_ok=True)
+    wcvp_data.to_parquet(snapshot_file)
+    return wcvp_data
+
+
+def get_file_sha256(path: str) -> str:
+    file_hash = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(2 ** 20), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def load_wcvp_data(columns: list = None) -> pd.DataFrame:
+    """
+    Load the filtered WCVP species saved by this module.
+
+    :param columns: only read these columns
+    :return:
+    """
+    return _from_typed(pd.read_parquet(wcvp_data_parquet, columns=columns))
+
+
+def load_homonyms(homonym_type: str = 'all', columns: list = None) -> pd.DataFrame:
+    """
+    Load homonyms saved by this module.
+
+    :param homonym_type: 'all' or 'ambiguous'
+    :param columns: only read these columns
+    :return:
+    """
+    return _from_typed(pd.read_parquet(get_homonyms_parquet(homonym_type), columns=columns))
+
+
+def get_homonyms_parquet(homonym_type: str = 'all') -> str:
+    if homonym_type not in ['all', 'ambiguous']:
+        raise ValueError(f'Unknown homonym type: {homonym_type}')
+    return os.path.join(taxonomy_inputs_output_path, f'{homonym_type}_homonyms', 'homonyms.parquet')
+
 
 def summarise_homonym_df(df: pd.DataFrame, outpath: str):
     duplicates = df.drop(
@@ -19,10 +113,10 @@ def summarise_homonym_df(df: pd.DataFrame, outpath: str):
                  'accepted_parent',
                  'accepted_parent_w_author', 'accepted_parent_id', 'accepted_parent_ipni_id',
                  'accepted_parent_rank'
-                 ])
+                 ], errors='ignore')
     duplicates = duplicates.sort_values(by=wcvp_columns['name'])
 
-    duplicates.to_csv(os.path.join(outpath, 'homonyms.csv'))
+    save_csv_and_parquet(duplicates, os.path.join(outpath, 'homonyms.csv'))
     duplicates.describe(include='all').to_csv(os.path.join(outpath, 'homonyms_summary.csv'))
 
     non_accepted_homonyms = duplicates[duplicates[wcvp_columns['status']] != 'Accepted']
@@ -36,7 +130,67 @@ def summarise_homonym_df(df: pd.DataFrame, outpath: str):
         os.path.join(outpath, 'accepted_with_homonyms_summary.csv'))
 
 
-def get_homonym_files():
+def _get_genus_from_names(names: pd.Series) -> pd.Series:
+    # First word of each name, keeping a separate leading hybrid character with the genus
+    return names.astype('string').str.extract(r'^((?:[×+]\s)?\S+)', expand=False)
+
+
+def _count_distinct_per_code(codes: np.ndarray, value_codes: np.ndarray, number_of_codes: int) -> np.ndarray:
+    # Number of distinct non-null values for each code, from the unique (code, value) pairs
+    valid = (codes >= 0) & (value_codes >= 0)
+    number_of_values = max(int(value_codes.max()) + 1, 1) if len(value_codes) > 0 else 1
+    pairs = np.unique(codes[valid].astype(np.int64) * number_of_values + value_codes[valid])
+    return np.bincount(pairs // number_of_values, minlength=number_of_codes)
+
+
+def get_name_index(df: pd.DataFrame, name_col: str = wcvp_columns['name'], accepted_col: str = wcvp_accepted_columns['species'],
+                   count_genera: bool = False):
+    """
+    Factorizes the names once and counts, for each name: records, distinct accepted names and whether any record is itself
+    accepted. Homonym outputs and summaries are then selections from this table rather than further groupbys of the full data.
+
+    :param df:
+    :param name_col: the names to index
+    :param accepted_col: the accepted names to count for each name
+    :param count_genera: also count distinct accepted genera, which needs the genus of every accepted name
+    :return: the code of each row in df, and the table of counts indexed by name in order of the codes
+    """
+    # Missing names are kept as their own code, as in duplicated
+    codes, names = pd.factorize(df[name_col], use_na_sentinel=False)
+    number_of_names = len(names)
+    accepted_codes, _ = pd.factorize(df[accepted_col])
+    accepted_records = (df[wcvp_columns['status']] == 'Accepted').to_numpy()
+
+    name_index = pd.DataFrame({'records': np.bincount(codes, minlength=number_of_names),
+                               'distinct_accepted': _count_distinct_per_code(codes, accepted_codes, number_of_names),
+                               'has_accepted_record': np.bincount(codes[accepted_records], minlength=number_of_names) > 0},
+                              index=pd.Index(names, name=name_col))
+    if count_genera:
+        genus_codes, _ = pd.factorize(_get_genus_from_names(df[accepted_col]))
+        name_index['distinct_accepted_genera'] = _count_distinct_per_code(codes, genus_codes, number_of_names)
+    return codes, name_index
+
+
+def find_all_homonyms(df: pd.DataFrame, codes: np.ndarray = None, name_index: pd.DataFrame = None) -> pd.DataFrame:
+    """
+    :param df:
+    :param codes: from get_name_index(df), which is called if these aren't given
+    :param name_index: from get_name_index(df)
+    :return: records whose name is shared with another record
+    """
+    if codes is None:
+        codes, name_index = get_name_index(df)
+    return df[(name_index['records'].to_numpy() > 1)[codes]]
+
+
+def find_ambiguous_homonyms(df: pd.DataFrame, codes: np.ndarray = None, name_index: pd.DataFrame = None) -> pd.DataFrame:
+    # Homonyms with more than 1 unique accepted species, missing names aren't grouped so are never ambiguous
+    if codes is None:
+        codes, name_index = get_name_index(df)
+    return df[(name_index['distinct_accepted'].to_numpy() > 1)[codes] & df[wcvp_columns['name']].notna().to_numpy()]
+
+
+def get_homonym_files(codes: np.ndarray, name_index: pd.DataFrame):
     """
     Identifies and processes homonyms from the provided dataset, then stores the
     results in a specified output file.
@@ -45,86 +199,175 @@ def get_homonym_files():
     fields. This function filters the dataset for such records, processes them,
     and writes a summary to an output file.
 
+    :param codes: from get_name_index(wcvp_given_data)
+    :param name_index: from get_name_index(wcvp_given_data)
     :return: None
     """
     outpath = os.path.join(taxonomy_inputs_output_path, 'all_homonyms')
-    homonyms = wcvp_given_data[wcvp_given_data[wcvp_columns['name']].duplicated(keep=False)]
+    homonyms = find_all_homonyms(wcvp_given_data, codes, name_index)
 
     summarise_homonym_df(homonyms, outpath)
 
 
-def get_ambiguous_homonym_files():
+def get_ambiguous_homonym_files(codes: np.ndarray, name_index: pd.DataFrame):
     # Gets homonymns that can resolve to different *species*
     outpath = os.path.join(taxonomy_inputs_output_path, 'ambiguous_homonyms')
-    # groupby name and return a boolean of whether each has more than 1 unique accepted name
-    multinames = wcvp_given_data.groupby([wcvp_columns['name']])[wcvp_accepted_columns['species']].nunique(dropna=True).gt(
-        1)
-    # use loc to only see those values that have `True` in `accepted_name`:
-    duplicates = wcvp_given_data.loc[wcvp_given_data[wcvp_columns['name']].isin(multinames[multinames].index)]
+    duplicates = find_ambiguous_homonyms(wcvp_given_data, codes, name_index)
     summarise_homonym_df(duplicates, outpath)
 
 
+def get_changed_names(previous_data: pd.DataFrame, new_data: pd.DataFrame) -> set:
+    """
+    Finds names with any record that was added, removed or changed between two versions of the processed data, matching
+    records by plant_name_id. Whether a name is a homonym only depends on records with that name, so only these need
+    recomputing.
+
+    :return: taxon names
+    """
+    compare_columns = sorted(set(previous_data.columns) & set(new_data.columns))
+    previous_hashes = pd.Series(pd.util.hash_pandas_object(previous_data[compare_columns], index=False).values,
+                                index=previous_data['plant_name_id'])
+    new_hashes = pd.Series(pd.util.hash_pandas_object(new_data[compare_columns], index=False).values,
+                           index=new_data['plant_name_id'])
+    common_ids = previous_hashes.index.intersection(new_hashes.index)
+    changed_ids = previous_hashes.index.symmetric_difference(new_hashes.index).union(
+        common_ids[previous_hashes[common_ids].values != new_hashes[common_ids].values])
+
+    changed_names = set(previous_data.loc[previous_data['plant_name_id'].isin(changed_ids), wcvp_columns['name']])
+    changed_names.update(new_data.loc[new_data['plant_name_id'].isin(changed_ids), wcvp_columns['name']])
+    return changed_names
+
+
+def check_previous_version(previous_version):
+    """
+    Incremental updates compare saved processed data of two releases, so are refused unless WCVP_VERSION names a release and the
+    previous version is a different one. Otherwise the 'previous' data could be the same release, or the outputs could silently
+    be made from whatever release is latest.
+
+    :param previous_version: WCVP version the existing outputs were made from
+    :return: None
+    """
+    if WCVP_VERSION is None:
+        raise ValueError('Set WCVP_VERSION to the new release to update outputs from a previous version')
+    if previous_version is None or str(previous_version) == str(WCVP_VERSION):
+        raise ValueError(f'The previous version ({previous_version}) must differ from WCVP_VERSION ({WCVP_VERSION})')
+
+
+def update_homonym_files(previous_version, new_data: pd.DataFrame):
+    """
+    Updates the homonym outputs for a new WCVP release, only recomputing names with changed records, and writes a changelog
+    of names which became or stopped being ambiguous homonyms.
+
+    Assumes the existing homonym outputs were made from the processed data saved for previous_version.
+
+    :param previous_version: WCVP version the existing outputs were made from, which must differ from WCVP_VERSION
+    :param new_data: processed data for the WCVP_VERSION release
+    :return: None
+    """
+    check_previous_version(previous_version)
+    previous_data = _to_typed(load_processed_wcvp_data(previous_version))
+    new_data = _to_typed(new_data)
+    changed_names = get_changed_names(previous_data, new_data)
+    print(f'{len(changed_names)} names have changed records')
+    changed_data = new_data[new_data[wcvp_columns['name']].isin(changed_names)]
+    codes, name_index = get_name_index(changed_data)
+
+    changelog = None
+    for homonym_type, find_homonyms in [('all', find_all_homonyms), ('ambiguous', find_ambiguous_homonyms)]:
+        previous_homonyms = load_homonyms(homonym_type)
+        unchanged_homonyms = previous_homonyms[~previous_homonyms[wcvp_columns['name']].isin(changed_names)]
+        recomputed_homonyms = find_homonyms(changed_data, codes, name_index)
+        summarise_homonym_df(pd.concat([unchanged_homonyms, recomputed_homonyms]),
+                             os.path.join(taxonomy_inputs_output_path, f'{homonym_type}_homonyms'))
+
+        if homonym_type == 'ambiguous':
+            previous_names = set(previous_homonyms.loc[previous_homonyms[wcvp_columns['name']].isin(changed_names), wcvp_columns['name']])
+            new_names = set(recomputed_homonyms[wcvp_columns['name']])
+            changelog = pd.DataFrame([[n, 'became ambiguous'] for n in sorted(new_names - previous_names)] +
+                                     [[n, 'no longer ambiguous'] for n in sorted(previous_names - new_names)],
+                                     columns=[wcvp_columns['name'], 'change'])
+    changelog.to_csv(os.path.join(taxonomy_inputs_output_path, 'ambiguous_homonyms', 'changelog.csv'))
+    print(f'{len(changelog)} names changed ambiguity')
+
+
+# The characters str.split splits on. Listed explicitly as \s differs between python re and the regex engine of arrow backed strings
+_whitespace_regex = '[\t\n\x0b\x0c\r\x1c-\x1f \x85\xa0\u1680\u2000-\u200a\u2028\u2029\u202f\u205f\u3000]+'
+
+
+def clean_whitespaces(names: pd.Series) -> pd.Series:
+    # Vectorised wcvpy clean_whitespaces_in_names
+    return names.str.replace(_whitespace_regex, ' ', regex=True).str.strip(' ')
+
+
 def add_authors_to_given_col(df: pd.DataFrame, col):
-    df[col + '_with_authors'] = df[col].str.cat(
+    df[col + '_with_authors'] = clean_whitespaces(df[col].str.cat(
         df[wcvp_columns['authors']].fillna(''),
-        sep=' ').apply(clean_whitespaces_in_names)
+        sep=' '))
 
     column_series = [df[c].fillna('') for c in
                      [wcvp_columns['paranthet_author'], wcvp_columns['primary_author']]]
-    df[col + '_with_paranthet_authors'] = df[col].str.cat(column_series,
-                                                          sep=' ').apply(
-        clean_whitespaces_in_names)
+    df[col + '_with_paranthet_authors'] = clean_whitespaces(df[col].str.cat(column_series,
+                                                                            sep=' '))
 
-    df[col + '_with_primary_author'] = df[col].str.cat(
+    df[col + '_with_primary_author'] = clean_whitespaces(df[col].str.cat(
         df[wcvp_columns['primary_author']].fillna(''),
-        sep=' ').apply(clean_whitespaces_in_names)
+        sep=' '))
 
 
 def add_authors_to_names(df: pd.DataFrame):
     add_authors_to_given_col(df, wcvp_columns['name'])
 
-    df['abbreviated_genus'] = df[wcvp_columns['genus']].apply(lambda x: x[0] + '.')
-    df['sp_binomial_with_abbreviated_genus'] = df['abbreviated_genus'].str.cat(
+    df['abbreviated_genus'] = df[wcvp_columns['genus']].str[0] + '.'
+    df['sp_binomial_with_abbreviated_genus'] = clean_whitespaces(df['abbreviated_genus'].str.cat(
         df['species'].fillna(''),
-        sep=' ').apply(clean_whitespaces_in_names)
+        sep=' '))
 
     add_authors_to_given_col(df, 'sp_binomial_with_abbreviated_genus')
 
 
-def parse_publication_year(given_string: str):
-    if given_string == '(1981 publ. 1082)':  # An exception that returns a valid date
-        return '1982'
-    elif given_string in ['(19166)',
-                          '(19543)',
-                          '(19553)',
-                          '(19667)',
-                          '(19983)',
-                          ]:  # Some obivous errors that return valid dates
-        return np.nan
-
-    try:
-        out = given_string[-5:-1]
-    except TypeError:
-        out = given_string
-    finally:
-        return test_year_parsing(out)
-
-
-def test_year_parsing(given_str):
-    format = "%Y"
-    if given_str == '' or given_str is None or given_str != given_str:
-        return np.nan
-    else:
-        try:
-            datetime.strptime(given_str, format)
-            return given_str
-        except ValueError:
-            return np.nan
+# Known errors in first_published and the year they should give, checked before parsing
+PUBLICATION_YEAR_CORRECTIONS = {'(1981 publ. 1082)': 1982,  # An exception that returns a valid date
+                                # Some obvious errors that return valid dates
+                                '(19166)': pd.NA,
+                                '(19543)': pd.NA,
+                                '(19553)': pd.NA,
+                                '(19667)': pd.NA,
+                                '(19983)': pd.NA,
+                                }
+# Four digits followed by the closing character, e.g. '(1753)'. \d also matches digits outside ASCII, which strptime accepts in years
+_publication_year_regex = r'(?s)(\d{4}).\Z'
+
+
+def parse_publication_years(first_published: pd.Series) -> pd.Series:
+    """
+    Parse the year from the end of each first_published string, e.g. 1753 from 'Sp. Pl.: 123 (1753)'.
+
+    :param first_published: first_published column of WCVP
+    :return: Int64 series of publication years, missing where they couldn't be parsed
+    """
+    # Object dtype so the python regex engine is used for any string dtype
+    given = first_published.astype(object)
+    year_strings = given.str.extract(_publication_year_regex, expand=False)
+    years = pd.to_numeric(year_strings, errors='coerce')
+    non_ascii_digits = year_strings.notna() & years.isna()
+    if non_ascii_digits.any():
+        years[non_ascii_digits] = year_strings[non_ascii_digits].map(int)
+    # Year 0 is not a valid date
+    years = years.where(years >= 1).astype('Int64')
+
+    corrected = given.isin(PUBLICATION_YEAR_CORRECTIONS.keys())
+    years[corrected] = given[corrected].map(PUBLICATION_YEAR_CORRECTIONS)
+    return years
 
 
 def assess_duplicates(df):
     ## There shouldn't be any duplicated names inc. authors so just check here
-    duplicate_issues = df[df['taxon_name_with_authors'].duplicated(keep=False)]
+    codes, name_index = get_name_index(df, 'taxon_name_with_authors', wcvp_accepted_columns['name'])
+    # Missing names aren't grouped so are never duplicates, as in find_ambiguous_homonyms
+    has_name = df['taxon_name_with_authors'].notna().to_numpy()
+    duplicate_issues = df[(name_index['records'].to_numpy() > 1)[codes] & has_name]
+    # All records of each duplicated name are in duplicate_issues, so its accepted names are counted by the same index
+    different_accepted_names = (name_index['distinct_accepted'].to_numpy() > 1)[codes] & has_name
     if len(duplicate_issues) > 0:
         if len(duplicate_issues) > 1524:
             raise ValueError
@@ -132,11 +375,7 @@ def assess_duplicates(df):
             print(f'There are {len(duplicate_issues)} duplicate names with authors. These will be saved to file and removed.')
             duplicate_issues.sort_values(by='taxon_name_with_authors').to_csv(
                 os.path.join(taxonomy_inputs_output_path, 'duplicate_names_with_authors.csv'))
-            multinames = duplicate_issues.groupby(['taxon_name_with_authors'])[wcvp_accepted_columns['name']].nunique(dropna=True).gt(
-                1)
-            # use loc to only see those values that have `True` in `accepted_name`:
-            duplicates_with_different_accepted_names = duplicate_issues.loc[
-                duplicate_issues['taxon_name_with_authors'].isin(multinames[multinames].index)]
+            duplicates_with_different_accepted_names = df[different_accepted_names]
             if len(duplicates_with_different_accepted_names) > 0:
                 print(f'There are {len(duplicates_with_different_accepted_names)} duplicate names with authors which resolve to different names.')
 
@@ -145,23 +384,65 @@ def assess_duplicates(df):
 
 
 def main():
-    get_homonym_files()
-    get_ambiguous_homonym_files()
+    # The names are indexed once for both outputs
+    codes, name_index = get_name_index(wcvp_given_data)
+    get_homonym_files(codes, name_index)
+    get_ambiguous_homonym_files(codes, name_index)
+
+
+def get_processed_wcvp_data() -> pd.DataFrame:
+    """
+    Filters the WCVP snapshot to the records considered here, adds names with authors and publication years and, when
+    WCVP_VERSION is set, saves the result so it can be compared with the next release.
+
+    :return: processed data
+    """
+    wcvp_data = get_wcvp_snapshot()
+    wcvp_data = wcvp_data[
+        ~wcvp_data[wcvp_columns['status']].isin(['Artificial Hybrid', 'Unplaced', 'Invalid', 'Misapplied', 'Orthographic'])]
+    wcvp_data = wcvp_data[(wcvp_data[wcvp_columns['rank']].isin(RANKS_TO_CONSIDER))]  # restrict to just homonyms being species
+    wcvp_data = wcvp_data.dropna(subset=[wcvp_accepted_columns['species']])
+    add_authors_to_names(wcvp_data)
+    assess_duplicates(wcvp_data)
+    wcvp_data = wcvp_data.drop_duplicates(subset=['taxon_name_with_authors'], keep='first')
+
+    wcvp_data['publication_year'] = parse_publication_years(wcvp_data['first_published'])
+    if WCVP_VERSION is not None:
+        os.makedirs(snapshot_path, exist_ok=True)
+        _to_typed(wcvp_data).to_parquet(_snapshot_file('processed_wcvp', WCVP_VERSION))
+    return wcvp_data
+
+
+def load_processed_wcvp_data(version) -> pd.DataFrame:
+    processed_file = _snapshot_file('processed_wcvp', version)
+    if not os.path.isfile(processed_file):
+        raise FileNotFoundError(f'No processed data saved for WCVP version {version}: {processed_file}')
+    return _from_typed(pd.read_parquet(processed_file))
 
 
 if __name__ == '__main__':
-    wcvp_given_data = get_all_taxa(ranks=RANKS_TO_CONSIDER, version=WCVP_VERSION)
-    wcvp_given_data = wcvp_given_data[
-        ~wcvp_given_data[wcvp_columns['status']].isin(['Artificial Hybrid', 'Unplaced', 'Invalid', 'Misapplied', 'Orthographic'])]
-    wcvp_given_data = wcvp_given_data[(wcvp_given_data[wcvp_columns['rank']].isin(RANKS_TO_CONSIDER))]  # restrict to just homonyms being species
-    wcvp_given_data = wcvp_given_data.dropna(subset=[wcvp_accepted_columns['species']])
-    add_authors_to_names(wcvp_given_data)
-    assess_duplicates(wcvp_given_data)
-    wcvp_given_data = wcvp_given_data.drop_duplicates(subset=['taxon_name_with_authors'], keep='first')
-
-    wcvp_given_data['publication_year'] = wcvp_given_data['first_published'].apply(parse_publication_year)
-    wcvp_given_data[['plant_name_id', 'taxon_name', 'parenthetical_author', 'primary_author', 'taxon_rank',
-                     'publication_author', 'first_published', 'publication_year',wcvp_accepted_columns['species'], wcvp_accepted_columns['family'], wcvp_columns['status']]].to_csv(
-        os.path.join(taxonomy_inputs_output_path, 'wcvp_data.csv'))
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--previous-version', default=None,
+                        help='Update existing outputs made from this WCVP version, rather than recomputing all homonyms')
+    args = parser.parse_args()
+
+    if args.previous_version is not None:
+        # Checked before the new release is downloaded and processed
+        try:
+            check_previous_version(args.previous_version)
+        except ValueError as e:
+            parser.error(str(e))
+        if not os.path.isfile(_snapshot_file('processed_wcvp', args.previous_version)):
+            parser.error(f'No processed data saved for WCVP version {args.previous_version}')
+    wcvp_given_data = get_processed_wcvp_data()
+    save_csv_and_parquet(wcvp_given_data[['plant_name_id', 'taxon_name', 'parenthetical_author', 'primary_author', 'taxon_rank',
+                                          'publication_author', 'first_published', 'publication_year', wcvp_accepted_columns['species'],
+                                          wcvp_accepted_columns['family'], wcvp_columns['status']]],
+                         os.path.join(taxonomy_inputs_output_path, 'wcvp_data.csv'))
     wcvp_given_data.describe(include='all').to_csv(os.path.join(taxonomy_inputs_output_path, 'summaries', 'wcvp_data_summary.csv'))
-    main()
+    if args.previous_version is not None:
+        update_homonym_files(args.previous_version, wcvp_given_data)
+    else:
+        main()
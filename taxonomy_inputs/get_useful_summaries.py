@@ -3,17 +3,22 @@ import os
 import pandas as pd
 from wcvpy.wcvp_download import wcvp_columns, wcvp_accepted_columns
 
-from taxonomy_inputs import taxonomy_inputs_output_path
+from taxonomy_inputs import taxonomy_inputs_output_path, load_wcvp_data, load_homonyms, get_name_index
 
 summary_path = os.path.join(taxonomy_inputs_output_path, 'summaries')
 
 
+def _ambiguous_names() -> pd.Series:
+    return name_index['distinct_accepted'] > 1
+
+
 def proportion_of_homonyms_in_wcvp():
-    num_ambiguous_records = len(ambiguous_homonyms['plant_name_id'].unique().tolist())
-    num_ambiguous_homonymous_names = len(ambiguous_homonyms['taxon_name'].unique().tolist())
+    ambiguous_names = _ambiguous_names()
+    num_ambiguous_records = len(given_wcvp_data.loc[ambiguous_names.to_numpy()[name_codes], 'plant_name_id'].unique())
+    num_ambiguous_homonymous_names = int(ambiguous_names.sum())
 
     num_records = len(given_wcvp_data['plant_name_id'].unique().tolist())
-    num_names = len(given_wcvp_data['taxon_name'].unique().tolist())
+    num_names = len(name_index)
 
     pd.DataFrame([[num_records, num_names], [num_ambiguous_records, num_ambiguous_homonymous_names]], columns=['records', 'names'],
                  index=['all species', 'ambiguous_homonyms']).to_csv(
@@ -21,20 +26,23 @@ def proportion_of_homonyms_in_wcvp():
 
 
 def proportion_of_homonyms_which_are_also_accepted():
-    ambiguous_homonymous_names = ambiguous_homonyms['taxon_name'].unique().tolist()
-
-    ambiguous_homonyms_that_are_also_accepted = given_wcvp_data[given_wcvp_data[wcvp_columns['status']] == 'Accepted']
-    ambiguous_homonyms_that_are_also_accepted = ambiguous_homonyms_that_are_also_accepted[
-        ambiguous_homonyms_that_are_also_accepted['taxon_name'].isin(ambiguous_homonymous_names)]['taxon_name'].unique().tolist()
+    ambiguous_names = _ambiguous_names()
+    ambiguous_homonyms_that_are_also_accepted = ambiguous_names & name_index['has_accepted_record']
 
-    pd.DataFrame([[len(ambiguous_homonyms_that_are_also_accepted), len(ambiguous_homonymous_names)]],
+    pd.DataFrame([[int(ambiguous_homonyms_that_are_also_accepted.sum()), int(ambiguous_names.sum())]],
                  columns=['ambiguous_homonyms_that_are_also_accepted', 'ambiguous_homonymous_names'],
                  index=['counts']).to_csv(
         os.path.join(summary_path, 'proportion_of_homonyms_which_are_also_accepted.csv'))
 
 
 def number_of_homonyms_resolving_to_different_genus():
-    pass
+    ambiguous_names = _ambiguous_names()
+    different_genus = ambiguous_names & (name_index['distinct_accepted_genera'] > 1)
+
+    pd.DataFrame([[int(different_genus.sum()), int(ambiguous_names.sum())]],
+                 columns=['ambiguous_homonyms_resolving_to_different_genus', 'ambiguous_homonymous_names'],
+                 index=['counts']).to_csv(
+        os.path.join(summary_path, 'number_of_homonyms_resolving_to_different_genus.csv'))
 
 
 def get_most_common_names():
@@ -42,21 +50,23 @@ def get_most_common_names():
     # common_acc_df = all_homonyms[all_homonyms[wcvp_accepted_columns['name_w_author']].isin(most_common_accepted_name.values)]
     # common_acc_df.to_csv(os.path.join(summary_path, 'most_common_accepted_name_with_homonyms.csv'))
 
-    most_common_homonym = all_homonyms['taxon_name'].mode()
-    common_homonym_df = all_homonyms[all_homonyms['taxon_name'].isin(most_common_homonym.values)]
+    homonym_records = name_index.loc[name_index['records'] > 1, 'records']
+    most_common_homonym = homonym_records.index[homonym_records == homonym_records.max()]
+    common_homonym_df = all_homonyms[all_homonyms['taxon_name'].isin(most_common_homonym)]
     common_homonym_df.to_csv(os.path.join(summary_path, 'most_common_homonym.csv'))
 
-    homonym_that_refers_to_most_different_species = ambiguous_homonyms.groupby([wcvp_columns['name']])[wcvp_accepted_columns['species']].nunique(
-        dropna=True).sort_values(ascending=False).index[0]
+    # Sorted by name first, to break ties in the same way as a groupby
+    ambiguous_species_counts = name_index.loc[_ambiguous_names(), 'distinct_accepted'].sort_index()
+    homonym_that_refers_to_most_different_species = ambiguous_species_counts.sort_values(ascending=False).index[0]
     worst_homonym_df = all_homonyms[all_homonyms['taxon_name'] == homonym_that_refers_to_most_different_species]
     worst_homonym_df.sort_values(by='accepted_name').to_csv(os.path.join(summary_path, 'homonym_that_refers_to_most_different_species.csv'))
 
 
 if __name__ == '__main__':
-    given_wcvp_data = pd.read_csv(os.path.join(taxonomy_inputs_output_path, 'wcvp_data.csv'), index_col=0, dtype={'publication_year': 'Int64'})
-    all_homonyms = pd.read_csv(os.path.join(taxonomy_inputs_output_path, 'all_homonyms', 'homonyms.csv'), dtype={'publication_year': 'Int64'})
-    ambiguous_homonyms = pd.read_csv(os.path.join(taxonomy_inputs_output_path, 'ambiguous_homonyms', 'homonyms.csv'),
-                                     dtype={'publication_year': 'Int64'})
+    given_wcvp_data = load_wcvp_data(columns=['plant_name_id', 'taxon_name', wcvp_columns['status'], wcvp_accepted_columns['species']])
+    name_codes, name_index = get_name_index(given_wcvp_data, count_genera=True)
+    all_homonyms = load_homonyms('all')
     proportion_of_homonyms_in_wcvp()
     proportion_of_homonyms_which_are_also_accepted()
+    number_of_homonyms_resolving_to_different_genus()
     get_most_common_names()
@@ -0,0 +1,214 @@
+import argparse
+import csv
+import json
+import os
+import pickle
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, Iterator, NamedTuple, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+from wcvpy.wcvp_download import wcvp_columns, wcvp_accepted_columns
+
+sys.path.append('..')
+
+from taxonomy_inputs import taxonomy_inputs_output_path, load_homonyms, get_file_sha256
+from CORE_searches.helper_functions import clean_string, disambiguating_name_columns
+
+ambiguous_homonyms_parquet = os.path.join(taxonomy_inputs_output_path, 'ambiguous_homonyms', 'homonyms.parquet')
+lookup_index_pkl = os.path.join(taxonomy_inputs_output_path, 'ambiguous_homonyms', 'lookup_index.pkl')
+LOOKUP_INDEX_FORMAT_VERSION = 1
+# Separates multiple values in one cell of batch outputs
+BATCH_VALUE_SEPARATOR = '|'
+# Homonym, accepted species and authors of each record, in the order of HomonymLookup
+_record_columns = [wcvp_columns['name'], wcvp_accepted_columns['species'], wcvp_columns['authors']]
+_abbreviated_binomial_column = 'sp_binomial_with_abbreviated_genus'
+
+
+class HomonymLookup(NamedTuple):
+    ambiguous: bool
+    homonyms: Tuple[str, ...]
+    accepted_species: Tuple[str, ...]
+    authors: Tuple[str, ...]
+
+
+# Result for names which aren't ambiguous homonyms or names with authors of them
+NOT_FOUND = HomonymLookup(False, (), (), ())
+
+
+def _group_records_by_key(keys: pd.Series, records: pd.DataFrame) -> Dict[str, tuple]:
+    # Map each key to the sets of names, accepted species and authors of its records
+    grouped = {}
+    for key, *values in zip(keys, *(records[c] for c in _record_columns)):
+        if key:
+            key_sets = grouped.setdefault(key, tuple(set() for _ in _record_columns))
+            for value_set, value in zip(key_sets, values):
+                if value == value:
+                    value_set.add(value)
+    return grouped
+
+
+def build_lookup_index(df: pd.DataFrame = None) -> Dict[str, tuple]:
+    """
+    Index the ambiguous homonyms by clean_string of each name, both the bare binomials and each of the names with authors. A bare
+    binomial gives all records with that name, while a name with authors only gives the records it was made from, so is not
+    ambiguous when these have one accepted species.
+
+    :param df: ambiguous homonyms, loaded if not given
+    :return: map of cleaned name to (ambiguous, homonyms, accepted species, authors)
+    """
+    if df is None:
+        df = load_homonyms('ambiguous', columns=_record_columns + [_abbreviated_binomial_column] + disambiguating_name_columns)
+    variants = df.melt(id_vars=_record_columns + [_abbreviated_binomial_column], value_vars=disambiguating_name_columns,
+                       value_name='variant').dropna(subset=['variant'])
+    variant_keys = variants['variant'].map(clean_string)
+    # Names with authors of records without those authors are just the binomial, and an abbreviated binomial could be any genus
+    binomials = variants[wcvp_columns['name']].where(~variants['variable'].str.startswith(_abbreviated_binomial_column),
+                                                     variants[_abbreviated_binomial_column])
+    has_authors = (variant_keys != binomials.map(clean_string)).to_numpy()
+    grouped = _group_records_by_key(variant_keys[has_authors], variants[has_authors])
+    # Bare binomials replace any name with authors that cleans to the same key, e.g. from records without authors
+    grouped.update(_group_records_by_key(df[wcvp_columns['name']].map(clean_string), df))
+
+    index = {}
+    for key, (names, accepted_species, authors) in grouped.items():
+        index[key] = (len(accepted_species) > 1, tuple(sorted(names)), tuple(sorted(accepted_species)), tuple(sorted(authors)))
+    return index
+
+
+def _get_lookup_metadata() -> dict:
+    return {'format_version': LOOKUP_INDEX_FORMAT_VERSION, 'homonyms_parquet_sha256': get_file_sha256(ambiguous_homonyms_parquet)}
+
+
+def load_lookup_index() -> Dict[str, HomonymLookup]:
+    """
+    Load the saved lookup index, building and saving it first when it is missing or was built from different homonyms.
+
+    :return: map of cleaned name to lookup result
+    """
+    metadata = _get_lookup_metadata()
+    index = None
+    if os.path.isfile(lookup_index_pkl):
+        with open(lookup_index_pkl, 'rb') as f:
+            saved = pickle.load(f)
+        if saved['metadata'] == metadata:
+            index = saved['index']
+    if index is None:
+        index = build_lookup_index()
+        # Write then rename, so other processes never load a partly written index
+        temp_path = f'{lookup_index_pkl}.{os.getpid()}'
+        with open(temp_path, 'wb') as f:
+            pickle.dump({'metadata': metadata, 'index': index}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, lookup_index_pkl)
+    return {key: HomonymLookup(*value) for key, value in index.items()}
+
+
+_lookup_index = None
+
+
+def get_lookup_index() -> Dict[str, HomonymLookup]:
+    global _lookup_index
+    if _lookup_index is None:
+        _lookup_index = load_lookup_index()
+    return _lookup_index
+
+
+def lookup_name(name: str) -> HomonymLookup:
+    """
+    Look up a binomial, with or without authors, in the ambiguous homonyms.
+
+    :param name: e.g. 'Abies grandis' or 'Abies grandis Hook.'
+    :return: whether the name is ambiguous, the homonyms it matches and their candidate accepted species and authors
+    """
+    return get_lookup_index().get(clean_string(name), NOT_FOUND)
+
+
+def lookup_names(names: Iterable[str]) -> Iterator[HomonymLookup]:
+    index_get = get_lookup_index().get
+    for name in names:
+        yield index_get(clean_string(name), NOT_FOUND)
+
+
+def _lookup_to_dict(name: str, result: HomonymLookup) -> dict:
+    return {'name': name, **result._asdict()}
+
+
+def lookup_names_in_file(names_file: str, output_csv: str):
+    """
+    Look up each line of names_file, streaming the results to output_csv.
+
+    :return: None
+    """
+    index_get = get_lookup_index().get
+    with open(names_file, encoding='utf-8') as in_file, open(output_csv, 'w', newline='', encoding='utf-8') as out_file:
+        writer = csv.writer(out_file)
+        writer.writerow(['name'] + list(HomonymLookup._fields))
+        for line in in_file:
+            name = line.rstrip('\r\n')
+            result = index_get(clean_string(name), NOT_FOUND)
+            writer.writerow([name, result.ambiguous] + [BATCH_VALUE_SEPARATOR.join(values) for values in result[1:]])
+
+
+class _LookupRequestHandler(BaseHTTPRequestHandler):
+    # GET /lookup?name=... for one name, or POST /lookup with a json list of names
+
+    def _send_json(self, status: int, body):
+        encoded = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        names = parse_qs(url.query).get('name')
+        if url.path != '/lookup' or names is None:
+            self._send_json(404, {'error': 'Use /lookup?name=<name>'})
+        else:
+            self._send_json(200, _lookup_to_dict(names[0], lookup_name(names[0])))
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/lookup':
+            self._send_json(404, {'error': 'Use /lookup'})
+            return
+        try:
+            names = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        except ValueError:
+            names = None
+        if not isinstance(names, list) or not all(isinstance(n, str) for n in names):
+            self._send_json(400, {'error': 'Expected a json list of names'})
+        else:
+            self._send_json(200, [_lookup_to_dict(name, result) for name, result in zip(names, lookup_names(names))])
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_lookups(host: str = '127.0.0.1', port: int = 8000):
+    get_lookup_index()
+    with ThreadingHTTPServer((host, port), _LookupRequestHandler) as server:
+        print(f'Serving homonym lookups on http://{host}:{port}/lookup')
+        server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Look up names in the ambiguous homonyms')
+    parser.add_argument('names', nargs='*', help='names to look up')
+    parser.add_argument('--names-file', help='file with one name per line')
+    parser.add_argument('--output', help='csv to write the results for --names-file to')
+    parser.add_argument('--serve', action='store_true', help='serve lookups over http')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve_lookups(args.host, args.port)
+    elif args.names_file is not None:
+        if args.output is None:
+            parser.error('--output is needed with --names-file')
+        lookup_names_in_file(args.names_file, args.output)
+    else:
+        for given_name, lookup in zip(args.names, lookup_names(args.names)):
+            print(json.dumps(_lookup_to_dict(given_name, lookup)))
@@ -1,97 +1,153 @@
+import colorsys
 import os
+from typing import Tuple
 
+import numpy as np
 import pandas as pd
 from matplotlib import pyplot as plt
+from matplotlib.collections import PolyCollection
+from matplotlib.colors import to_rgb, to_rgba
+from matplotlib.patches import Patch
 from wcvpy.wcvp_download import wcvp_columns, plot_native_number_accepted_taxa_in_regions, wcvp_accepted_columns
 
-from taxonomy_inputs import taxonomy_inputs_output_path, WCVP_VERSION
+from taxonomy_inputs import load_wcvp_data, load_homonyms
 
 
-def generic_category_plot(var: str, title: str, figsize=(40, 10), sort_var=False):
-    import seaborn as sns
+# Legends of the category plots, from least to most specific, in the order they are drawn
+LEGEND_LABELS = ['Non Homonymous Species Names', 'Non-ambiguous Homonymous Species Names', 'Ambiguous Homonymous Species Names']
+AMBIGUOUS_LEGEND = LEGEND_LABELS[2]
+# As seaborn draws count and stacked histogram bars
+COUNT_BAR_WIDTH = 0.8
+COUNT_BAR_SATURATION = 0.75
+PROPORTION_BAR_WIDTH = 0.9
+PROPORTION_BAR_ALPHA = 0.75
 
-    _given_wcvp_data = given_wcvp_data.dropna(subset=[var])
-    _all_homonyms = all_homonyms.dropna(subset=[var])
-    _ambiguous_homonyms = ambiguous_homonyms.dropna(subset=[var])
 
-    _given_wcvp_data['Legend'] = 'Non Homonymous Species Names'
-    _all_homonyms['Legend'] = 'Non-ambiguous Homonymous Species Names'
-    _ambiguous_homonyms['Legend'] = 'Ambiguous Homonymous Species Names'
+def get_legend_counts(var: str, wcvp_data: pd.DataFrame, all_homonym_data: pd.DataFrame,
+                      ambiguous_homonym_data: pd.DataFrame) -> pd.DataFrame:
+    """
+    Count records in each value of var by legend, where each record is given the most specific legend of the frames it is in.
 
-    all_data = pd.concat([_given_wcvp_data, _all_homonyms, _ambiguous_homonyms])
-    all_data = all_data.drop_duplicates(subset=['plant_name_id'], keep='last')  # Remove duplicates and keep most specific
+    :param var: column to count values of
+    :param wcvp_data:
+    :param all_homonym_data:
+    :param ambiguous_homonym_data:
+    :return: counts with a row for each value of var, sorted, and a column for each of LEGEND_LABELS
+    """
+    # Only the ids and values are stacked, with integer legend codes, rather than the whole frames
+    coded = pd.concat([pd.DataFrame({'plant_name_id': df['plant_name_id'], var: df[var], 'legend_code': np.int8(code)}).dropna(subset=[var])
+                       for code, df in enumerate([wcvp_data, all_homonym_data, ambiguous_homonym_data])])
+    coded = coded.drop_duplicates(subset=['plant_name_id'], keep='last')
+    counts = coded[[var, 'legend_code']].value_counts().unstack(fill_value=0)
+    counts = counts.reindex(columns=range(len(LEGEND_LABELS)), fill_value=0).sort_index()
+    counts.columns = LEGEND_LABELS
+    return counts
 
-    if sort_var:
-        # Calculate proportions of each value in the 'Legend' column
-        var_legend_proportions = all_data.groupby(var)['Legend'].apply(lambda x: (x == 'Ambiguous Homonymous Species Names').mean()).reset_index()
-        var_legend_proportions.columns = [var, 'Proportion_Ambiguous']
 
-        # Sort the var column based on the proportions in descending order
-        proportion_sorted_vars = var_legend_proportions.sort_values('Proportion_Ambiguous', ascending=False)[var].tolist()
+def _sort_by_ambiguity(counts: pd.DataFrame) -> Tuple[list, list]:
+    # Values sorted by the proportion of ambiguous records, and by the number of them
+    proportions = counts[AMBIGUOUS_LEGEND] / counts.sum(axis=1)
+    proportion_sorted_vars = proportions.sort_values(ascending=False, kind='stable').index.tolist()
+    count_sorted_vars = counts[AMBIGUOUS_LEGEND].reindex(proportion_sorted_vars).sort_values(ascending=False,
+                                                                                              kind='stable').index.tolist()
+    return proportion_sorted_vars, count_sorted_vars
 
-        # Reorder the DataFrame based on the sorted var column
-        all_data[var] = pd.Categorical(all_data[var], categories=proportion_sorted_vars, ordered=True)
-        all_data = all_data.sort_values(var)
 
-        # Calculate proportions of each value in the 'Legend' column
-        var_legend_counts = all_data[all_data['Legend'] == 'Ambiguous Homonymous Species Names'].groupby(var).size().reset_index(
-            name='Count_Ambiguous')
+def _desaturate(color, proportion: float) -> tuple:
+    h, l, s = colorsys.rgb_to_hls(*to_rgb(color))
+    return colorsys.hls_to_rgb(h, l, s * proportion)
 
-        # Sort the var column based on the proportions in descending order
-        count_sorted_vars = var_legend_counts.sort_values('Count_Ambiguous', ascending=False)[var].tolist()
 
-    else:
-        count_sorted_vars = None
+def _legend_colors() -> list:
+    return [c['color'] for c, _ in zip(plt.rcParams['axes.prop_cycle'], LEGEND_LABELS)]
 
-    plt.figure(figsize=figsize)
-    sns.countplot(x=var, data=all_data, hue='Legend', order=count_sorted_vars)
+
+def _save_bar_plot(title: str, file_name: str, xlabel: str, ylabel: str, legend_handles: list = None, legend_location: str = None):
+    if legend_handles is not None:
+        # Placed where the 'best' location puts it, as finding that checks the legend against every bar
+        plt.legend(handles=legend_handles, title='Legend', loc=legend_location)
+    plt.xlabel(xlabel)
+    plt.ylabel(ylabel)
     plt.xticks(rotation=90)
     plt.title(title)
     plt.tight_layout()
-    plt.savefig(os.path.join('outputs', 'plots', title + '.jpg'), dpi=300)
+    plt.savefig(os.path.join('outputs', 'plots', file_name + '.jpg'), dpi=300)
+    plt.close()
 
-    plt.figure(figsize=figsize)
-    sns.histplot(data=all_data, x=var, hue='Legend', multiple="fill",
-                 stat='proportion', shrink=0.9, discrete=True)
 
-    plt.xticks(rotation=90)
-    plt.title(title)
-    plt.tight_layout()
-    plt.savefig(os.path.join('outputs', 'plots', title + '_normalized.jpg'), dpi=300)
+def _add_bars(ax, positions: np.ndarray, heights: np.ndarray, bottoms: np.ndarray, width: float, label: str, **kwargs):
+    # All bars of one legend as a single collection, which draws much faster than a patch per bar as from plt.bar
+    lefts = positions - width / 2
+    tops = bottoms + heights
+    vertices = np.stack([np.stack([lefts, bottoms], axis=1), np.stack([lefts, tops], axis=1),
+                         np.stack([lefts + width, tops], axis=1), np.stack([lefts + width, bottoms], axis=1)], axis=1)
+    ax.add_collection(PolyCollection(vertices, **kwargs), autolim=True)
+    return Patch(label=label, **kwargs)
 
 
-def year_plots():
-    generic_category_plot('publication_year', 'WCVP Species Publications and Homonym Occurrence')
-    import seaborn as sns
+def _plot_counts(counts: pd.DataFrame, title: str, file_name: str, xlabel: str, figsize=(40, 10), legend_location: str = 'upper left'):
+    # Bars of each column side by side for each row, as sns.countplot with hue
+    plt.figure(figsize=figsize)
+    ax = plt.gca()
+    positions = np.arange(len(counts))
+    width = COUNT_BAR_WIDTH / len(counts.columns)
+    handles = []
+    for i, (label, color) in enumerate(zip(counts.columns, _legend_colors())):
+        offset = (i - (len(counts.columns) - 1) / 2) * width
+        handles.append(_add_bars(ax, positions + offset, counts[label].to_numpy(dtype=float), np.zeros(len(counts)), width, label,
+                                 facecolor=_desaturate(color, COUNT_BAR_SATURATION), linewidth=0))
+    ax.autoscale_view()
+    ax.set_ylim(bottom=0)
+    plt.xticks(positions, [str(v) for v in counts.index])
+    plt.xlim(-0.5, len(counts) - 0.5)
+    _save_bar_plot(title, file_name, xlabel, 'count', handles if len(counts.columns) > 1 else None, legend_location)
+
+
+def _plot_proportions(counts: pd.DataFrame, title: str, file_name: str, xlabel: str, figsize=(40, 10), categorical: bool = False):
+    # Stacked proportions of each row, as sns.histplot with multiple='fill', with the first column on top
+    plt.figure(figsize=figsize)
+    ax = plt.gca()
+    positions = np.arange(len(counts)) if categorical else counts.index.to_numpy(dtype=float)
+    proportions = counts.div(counts.sum(axis=1), axis=0).to_numpy()
+    bottoms = np.cumsum(proportions[:, ::-1], axis=1)[:, ::-1] - proportions
+    # Thin edges for narrow bars, as seaborn does, so they don't cover the bars
+    ax.update_datalim([(positions.min() - PROPORTION_BAR_WIDTH / 2, 0), (positions.max() + PROPORTION_BAR_WIDTH / 2, 1)])
+    ax.autoscale_view()
+    bar_width_points = np.diff(ax.transData.transform([(0, 0), (PROPORTION_BAR_WIDTH, 0)])[:, 0])[0] * 72 / ax.figure.dpi
+    linewidth = min(0.1 * bar_width_points, plt.rcParams['patch.linewidth'])
+    handles = []
+    for i, (label, color) in enumerate(zip(counts.columns, _legend_colors())):
+        handles.append(_add_bars(ax, positions, proportions[:, i], bottoms[:, i], PROPORTION_BAR_WIDTH, label,
+                                 facecolor=to_rgba(color, PROPORTION_BAR_ALPHA), edgecolor=plt.rcParams['patch.edgecolor'],
+                                 linewidth=linewidth))
+    ax.set_ylim(0, 1)
+    if categorical:
+        plt.xticks(positions, [str(v) for v in counts.index])
+    # Stacked proportions fill the axes, so the first location tried is the best
+    _save_bar_plot(title, file_name, xlabel, 'Proportion', handles, 'upper right')
 
-    _given_wcvp_data = given_wcvp_data.dropna(subset=['publication_year'])
-    _all_homonyms = all_homonyms.dropna(subset=['publication_year'])
-    _ambiguous_homonyms = ambiguous_homonyms.dropna(subset=['publication_year'])
 
-    _given_wcvp_data['Legend'] = 'Non Homonymous Species Names'
-    _all_homonyms['Legend'] = 'Non-ambiguous Homonymous Species Names'
-    _ambiguous_homonyms['Legend'] = 'Ambiguous Homonymous Species Names'
+def generic_category_plot(var: str, title: str, figsize=(40, 10), sort_var=False):
+    counts = get_legend_counts(var, given_wcvp_data, all_homonyms, ambiguous_homonyms)
 
-    plt.figure(figsize=(40, 10))
-    sns.countplot(x='publication_year', data=_given_wcvp_data, )
-    plt.xticks(rotation=90)
-    plt.title('WCVP Species Publications')
-    plt.tight_layout()
-    plt.savefig(os.path.join('outputs', 'plots', 'WCVP Species Publications.jpg'), dpi=300)
+    if sort_var:
+        proportion_sorted_vars, count_sorted_vars = _sort_by_ambiguity(counts)
+        # Counts decrease along the axis
+        _plot_counts(counts.reindex(count_sorted_vars), title, title, var, figsize, legend_location='upper right')
+        _plot_proportions(counts.reindex(proportion_sorted_vars), title, title + '_normalized', var, figsize, categorical=True)
+    else:
+        _plot_counts(counts, title, title, var, figsize)
+        # Values are numeric when not sorted, e.g. years, so are placed on a numeric axis
+        _plot_proportions(counts, title, title + '_normalized', var, figsize)
 
-    plt.figure(figsize=(40, 10))
-    sns.countplot(x='publication_year', data=_all_homonyms, )
-    plt.xticks(rotation=90)
-    plt.title('WCVP Homonymous Species Publications')
-    plt.tight_layout()
-    plt.savefig(os.path.join('outputs', 'plots', 'WCVP Homonymous Species Publications.jpg'), dpi=300)
 
-    plt.figure(figsize=(40, 10))
-    sns.countplot(x='publication_year', data=_ambiguous_homonyms, )
-    plt.xticks(rotation=90)
-    plt.title('WCVP Ambiguous Homonymous Species Publications')
-    plt.tight_layout()
-    plt.savefig(os.path.join('outputs', 'plots', 'WCVP Ambiguous Homonymous Species Publications.jpg'), dpi=300)
+def year_plots():
+    generic_category_plot('publication_year', 'WCVP Species Publications and Homonym Occurrence')
+
+    for df, title in [(given_wcvp_data, 'WCVP Species Publications'), (all_homonyms, 'WCVP Homonymous Species Publications'),
+                      (ambiguous_homonyms, 'WCVP Ambiguous Homonymous Species Publications')]:
+        year_counts = df['publication_year'].value_counts().sort_index().to_frame()
+        _plot_counts(year_counts, title, title, 'publication_year')
 
 
 def family_plots():
@@ -131,12 +187,32 @@ def plot_taxon_statuses(df: pd.DataFrame, outpath: str, file_tag: str, class_col
     plt.close()
 
 
+def load_plotting_data():
+    # The plots read these globals
+    global given_wcvp_data, all_homonyms, ambiguous_homonyms
+    plotting_columns = ['plant_name_id', 'publication_year', wcvp_accepted_columns['family'], wcvp_columns['status']]
+    given_wcvp_data = load_wcvp_data(columns=plotting_columns)
+    all_homonyms = load_homonyms('all', columns=plotting_columns)
+    ambiguous_homonyms = load_homonyms('ambiguous', columns=plotting_columns)
+
+
+def plot_year_figures():
+    load_plotting_data()
+    year_plots()
+
+
+def plot_family_figures():
+    load_plotting_data()
+    family_plots()
+
+
+def plot_ambiguous_taxon_statuses():
+    plot_taxon_statuses(load_homonyms('ambiguous', columns=[wcvp_columns['status']]), os.path.join('outputs', 'plots'),
+                        'ambiguous_homonyms_taxon_status')
+
 
 if __name__ == '__main__':
-    given_wcvp_data = pd.read_csv(os.path.join(taxonomy_inputs_output_path, 'wcvp_data.csv'), index_col=0, dtype={'publication_year': 'Int64'})
-    all_homonyms = pd.read_csv(os.path.join(taxonomy_inputs_output_path, 'all_homonyms', 'homonyms.csv'), dtype={'publication_year': 'Int64'})
-    ambiguous_homonyms = pd.read_csv(os.path.join(taxonomy_inputs_output_path, 'ambiguous_homonyms', 'homonyms.csv'),
-                                     dtype={'publication_year': 'Int64'})
+    load_plotting_data()
     year_plots()
     family_plots()
-    plot_taxon_statuses(ambiguous_homonyms, os.path.join('outputs', 'plots'), 'ambiguous_homonyms_taxon_status')
+    plot_ambiguous_taxon_statuses()
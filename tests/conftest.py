@@ -0,0 +1,15 @@
+import os
+import sys
+import tempfile
+
+# Output locations are read from these when the modules are imported, so point them at a scratch directory rather than the project
+_scratch_dir = tempfile.mkdtemp(prefix='wcvp_homonyms_tests_')
+os.environ['KEWSCRATCHPATH'] = _scratch_dir
+os.environ['SCRATCH'] = _scratch_dir
+
+repo_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Scripts in each folder import each other by name, as when run from that folder
+for p in [repo_path, os.path.join(repo_path, 'CORE_searches'), os.path.join(repo_path, 'taxonomy_inputs'),
+          os.path.join(repo_path, 'bias_analysis')]:
+    if p not in sys.path:
+        sys.path.append(p)
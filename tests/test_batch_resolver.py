@@ -0,0 +1,60 @@
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+from taxonomy_inputs import homonym_lookup
+from taxonomy_inputs.batch_resolver import resolve_name_table, resolve_names, UNAMBIGUOUS, AMBIGUOUS, DISAMBIGUATED
+from taxonomy_inputs.homonym_lookup import HomonymLookup
+
+LOOKUP_INDEX = {'aus bus': HomonymLookup(True, ('Aus bus',), ('Aus bus', 'Cus dus'), ('L.', 'Mill.')),
+                'aus bus l': HomonymLookup(False, ('Aus bus',), ('Aus bus',), ('L.',))}
+
+
+@pytest.fixture(autouse=True)
+def lookup_index(monkeypatch):
+    monkeypatch.setattr(homonym_lookup, '_lookup_index', LOOKUP_INDEX)
+
+
+def _write_names(path, names):
+    pd.DataFrame({'name': names, 'count': range(len(names))}).to_csv(path, index=False)
+
+
+@pytest.mark.parametrize('output_name', ['resolved.parquet', 'resolved.csv'])
+def test_first_chunk_without_homonyms(tmp_path, output_name):
+    # The resolution columns of the first chunk are all missing, so their types can't be inferred from it
+    names = ['Eus fus', 'Gus hus', 'Eus fus', 'Aus bus', 'Aus bus L.', 'Aus bus Sm.', 'Gus hus']
+    input_path = tmp_path / 'names.csv'
+    _write_names(input_path, names)
+    output_path = tmp_path / output_name
+    resolve_name_table(str(input_path), str(output_path), 'name', chunk_size=3, processes=1)
+
+    resolved = pd.read_parquet(output_path) if output_name.endswith('.parquet') else pd.read_csv(output_path)
+    assert resolved['name'].tolist() == names
+    assert resolved['count'].tolist() == list(range(len(names)))
+    assert resolved['homonym_resolution'].tolist() == [UNAMBIGUOUS, UNAMBIGUOUS, UNAMBIGUOUS, AMBIGUOUS, DISAMBIGUATED, AMBIGUOUS,
+                                                       UNAMBIGUOUS]
+    assert resolved['homonym'].isna().tolist() == [True, True, True, False, False, False, True]
+    assert resolved['candidate_accepted_species'].tolist()[3:6] == ['Aus bus|Cus dus', 'Aus bus', 'Aus bus|Cus dus']
+
+
+def test_every_chunk_without_homonyms(tmp_path):
+    input_path = tmp_path / 'names.csv'
+    _write_names(input_path, ['Eus fus', 'Gus hus', 'Ius jus'])
+    output_path = tmp_path / 'resolved.parquet'
+    resolve_name_table(str(input_path), str(output_path), 'name', chunk_size=2, processes=1)
+
+    schema = pq.read_schema(output_path)
+    assert str(schema.field('homonym').type) == 'string'
+    assert pd.read_parquet(output_path)['homonym_resolution'].tolist() == [UNAMBIGUOUS] * 3
+
+
+@pytest.mark.parametrize('name', ['Aus bus var. cus', 'Aus bus subsp. x', 'Aus bus × cus', 'Aus bus f. dus Mill.', 'Aus bus + Cus dus'])
+def test_infraspecific_and_hybrid_names_disambiguated(name):
+    resolved = resolve_names(pd.Series([name]))
+    assert resolved['homonym_resolution'].tolist() == [DISAMBIGUATED]
+    assert resolved['homonym'].tolist() == ['Aus bus']
+
+
+@pytest.mark.parametrize('name', ['Aus bus Sm.', 'Aus bus varia', 'Aus bus fx'])
+def test_other_words_after_binomial_ambiguous(name):
+    assert resolve_names(pd.Series([name]))['homonym_resolution'].tolist() == [AMBIGUOUS]
@@ -0,0 +1,36 @@
+import importlib.util
+
+from taxonomy_inputs.figure_pipeline import FigureSpec, get_figure_hash, _get_stages
+
+
+def _make_figure():
+    pass
+
+
+def _load_module(path):
+    spec = importlib.util.spec_from_file_location(path.stem, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_hash_includes_dependency_sources(tmp_path):
+    dependency_path = tmp_path / 'loaders.py'
+    dependency_path.write_text('def load():\n    return 1\n')
+    input_path = tmp_path / 'data.csv'
+    input_path.write_text('a\n1\n')
+    spec = FigureSpec('figure', _make_figure, (str(input_path),), (), str(tmp_path), dependencies=(_load_module(dependency_path),))
+    first_hash = get_figure_hash(spec)
+    assert get_figure_hash(spec) == first_hash
+    assert get_figure_hash(spec._replace(dependencies=())) != first_hash
+
+    dependency_path.write_text('def load():\n    return 2\n')
+    assert get_figure_hash(spec) != first_hash
+
+
+def test_shared_cache_built_in_an_earlier_stage():
+    cache = FigureSpec('cache', _make_figure, ('data.csv',), ('cache.pkl',), '.')
+    maps = FigureSpec('maps', _make_figure, ('data.csv', 'cache.pkl'), ('maps.jpg',), '.')
+    regressions = FigureSpec('regressions', _make_figure, ('cache.pkl',), ('regressions.jpg',), '.')
+    stages = _get_stages([maps, regressions, cache])
+    assert [[spec.name for spec in stage] for stage in stages] == [['cache'], ['maps', 'regressions']]
@@ -0,0 +1,63 @@
+import pandas as pd
+from wcvpy.wcvp_download import infraspecific_chars, hybrid_characters, wcvp_columns
+
+from CORE_searches import build_filter_dict, clean_string, disambiguating_name_columns
+
+
+def build_filter_dict_by_name(df: pd.DataFrame) -> dict:
+    '''
+    Original per-name construction of the filter dictionary, which build_filter_dict should agree with.
+    '''
+    name_terms_dict = {}
+    for taxon_name in sorted(df[wcvp_columns['name']].unique().tolist()):
+        out_list = []
+        for ch in infraspecific_chars + hybrid_characters:
+            out_list.append(taxon_name + ' ' + ch)
+
+        relevant_taxa = df[df[wcvp_columns['name']] == taxon_name]
+        for c in disambiguating_name_columns:
+            out_list += relevant_taxa[c].unique().tolist()
+
+        unique_out_list = list(set(out_list))
+        cleaned = [clean_string(v) for v in unique_out_list]
+
+        name_terms_dict[clean_string(taxon_name)] = cleaned
+    return name_terms_dict
+
+
+def filter_dicts_match(filter_dict: dict, other_filter_dict: dict) -> bool:
+    if filter_dict.keys() != other_filter_dict.keys():
+        return False
+    return all(set(filter_dict[k]) == set(other_filter_dict[k]) for k in filter_dict)
+
+
+def _make_homonym_df() -> pd.DataFrame:
+    # Homonyms with several rows each, names differing only by case or punctuation, hybrids, and names with authors that clean to
+    # the same string
+    rows = [('Aus bus', 'L.', 'Mill.'), ('Aus bus', 'Mill.', 'L.'), ('Aus bus', 'L.', 'L.'), ('Aus Bus', 'Sm.', 'Sm.'),
+            ('Cus dus', 'DC.', '(Lam.) DC.'), ('Cus dus.', 'Lam.', 'Lam.'), ('× Eus fus', 'Hook.f.', 'Hook.f.'),
+            ('Eus × fus', 'Hook.', 'Hook.'), ('Gus hus', 'A.Gray', 'A.Gray'), ('Gus hus', 'A. Gray', 'A. Gray')]
+    records = []
+    for name, author, paranthet_author in rows:
+        genus, epithet = name.rsplit(' ', 1)
+        abbreviated = genus.strip('× ')[0] + '. ' + epithet
+        records.append({wcvp_columns['name']: name, 'taxon_name_with_authors': f'{name} {author}',
+                        'taxon_name_with_paranthet_authors': f'{name} {paranthet_author}',
+                        'taxon_name_with_primary_author': f'{name} {author.split(" ")[-1]}',
+                        'sp_binomial_with_abbreviated_genus_with_authors': f'{abbreviated} {author}',
+                        'sp_binomial_with_abbreviated_genus_with_paranthet_authors': f'{abbreviated} {paranthet_author}',
+                        'sp_binomial_with_abbreviated_genus_with_primary_author': f'{abbreviated} {author.split(" ")[-1]}'})
+    return pd.DataFrame(records, columns=[wcvp_columns['name']] + disambiguating_name_columns)
+
+
+def test_build_filter_dict_matches_by_name():
+    homonym_df = _make_homonym_df()
+    filter_dict = build_filter_dict(homonym_df)
+    assert filter_dicts_match(filter_dict, build_filter_dict_by_name(homonym_df))
+    assert 'aus bus' in filter_dict and 'aus bus mill' in filter_dict['aus bus']
+
+
+def test_build_filter_dict_ignores_row_order():
+    homonym_df = _make_homonym_df()
+    shuffled = homonym_df.sample(frac=1, random_state=0).reset_index(drop=True)
+    assert filter_dicts_match(build_filter_dict(homonym_df), build_filter_dict(shuffled))
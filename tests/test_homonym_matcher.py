@@ -0,0 +1,76 @@
+from typing import List
+
+import pytest
+
+import search_for_ambiguity
+from CORE_searches import HomonymMatcher, load_matcher, clean_string, longest_ambiguous_homonym, \
+    longest_potential_disambiguator, FuzzyDisambiguatorIndex, save_fuzzy_index, load_fuzzy_index, helper_functions
+from benchmarks import find_ambiguous_uses_with_ngrams
+from synthetic_corpus import make_synthetic_text, make_sectioned_text
+
+# Homonyms of one to three words, some sharing a genus or contained in another, and a disambiguator which is also a homonym
+FILTER_DICT = {'aus bus': {'aus bus l', 'a bus l', 'aus bus var', 'aus bus subsp', 'aus bus × cus'},
+               'aus bus cus': {'aus bus cus mill', 'a bus cus mill'},
+               'aus dus': {'aus dus sm', 'a dus sm', 'aus dus hook f'},
+               'eus fus': {'eus fus dc', 'e fus lam dc', 'aus bus'},
+               'gus': {'gus a gray'},
+               '× hus ius': {'× hus ius l', 'h ius l'}}
+
+
+def _as_sets(result):
+    homonym_uses, ambiguous_uses, disambiguators = result
+    return set(homonym_uses), set(ambiguous_uses), {k: set(v) for k, v in disambiguators.items()}
+
+
+def _get_texts() -> List[str]:
+    texts = [make_synthetic_text(FILTER_DICT, 300, density, seed=seed) for seed in range(20) for density in [0, 0.02, 0.1]]
+    texts += [make_sectioned_text(FILTER_DICT, 300, 0.05, seed=seed) for seed in range(20)]
+    texts += ['', 'Aus', 'Aus bus', 'Aus Bus Cus, Mill.', 'Eus fus was found with aus bus but not A. bus L.',
+              'Gus\nReferences\nGus A. Gray', 'x Hus ius and × Hus ius, H. ius L.']
+    return texts
+
+
+@pytest.fixture(params=['built', 'saved'])
+def matcher(request, tmp_path, monkeypatch):
+    built_matcher = HomonymMatcher(FILTER_DICT, longest_ambiguous_homonym, longest_potential_disambiguator)
+    if request.param == 'saved':
+        built_matcher.save(str(tmp_path / 'matcher.bin'), {'test': True})
+        built_matcher = load_matcher(str(tmp_path / 'matcher.bin'), {'test': True})
+    monkeypatch.setattr(search_for_ambiguity, 'homonym_matcher', built_matcher)
+    monkeypatch.setattr(search_for_ambiguity, 'fuzzy_index', None)
+    return built_matcher
+
+
+@pytest.mark.parametrize('prefilter', [True, False])
+def test_find_ambiguous_uses_matches_ngrams(matcher, prefilter):
+    homonyms = set(FILTER_DICT.keys())
+    found_any = False
+    for text in _get_texts():
+        expected = _as_sets(find_ambiguous_uses_with_ngrams(text, FILTER_DICT, homonyms))
+        assert _as_sets(search_for_ambiguity.find_ambiguous_uses(text, prefilter=prefilter)) == expected, text
+        found_any = found_any or len(expected[0]) > 0
+    assert found_any
+
+
+def test_saved_fuzzy_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(helper_functions, 'load_filter_dict', lambda: FILTER_DICT)
+    saved_matcher_path = str(tmp_path / 'matcher.bin')
+    save_fuzzy_index(saved_matcher_path, {'test': True}, 1)
+    saved_index = load_fuzzy_index(saved_matcher_path, {'test': True}, 1)
+    built_index = FuzzyDisambiguatorIndex(FILTER_DICT, longest_potential_disambiguator, 1)
+    tokens = clean_string('Aus dus Hok f. and Aus bus Lx. and Eus fus Lamm DC.').split()
+    for homonym in FILTER_DICT:
+        assert saved_index.find_disambiguators(homonym, tokens) == built_index.find_disambiguators(homonym, tokens)
+    assert saved_index.find_disambiguators('aus dus', tokens) == ['aus dus hook f']
+
+    with pytest.raises(ValueError):
+        load_fuzzy_index(saved_matcher_path, {'test': False}, 1)
+
+
+def test_matcher_metadata_follows_homonyms_parquet(tmp_path, monkeypatch):
+    homonyms_parquet = tmp_path / 'homonyms.parquet'
+    monkeypatch.setattr(helper_functions, 'ambiguous_homonyms_parquet', str(homonyms_parquet))
+    homonyms_parquet.write_bytes(b'first')
+    first_metadata = helper_functions.get_matcher_metadata()
+    homonyms_parquet.write_bytes(b'second')
+    assert helper_functions.get_matcher_metadata() != first_metadata
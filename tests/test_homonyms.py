@@ -0,0 +1,83 @@
+import pandas as pd
+import pytest
+from wcvpy.wcvp_download import wcvp_columns, wcvp_accepted_columns
+
+from taxonomy_inputs import get_homonyms, get_name_index, find_all_homonyms, find_ambiguous_homonyms
+
+NAME = wcvp_columns['name']
+ACCEPTED = wcvp_accepted_columns['species']
+STATUS = wcvp_columns['status']
+
+
+def _make_wcvp_data() -> pd.DataFrame:
+    return pd.DataFrame({NAME: ['Aus bus', 'Aus bus', 'Aus bus', 'Cus dus', 'Cus dus', 'Eus fus', None, None, 'Gus hus', 'Gus hus'],
+                         ACCEPTED: ['Aus bus', 'Aus cus', 'Dus bus', 'Cus dus', 'Cus dus', 'Eus fus', 'Aus bus', 'Cus dus',
+                                    '× Ius hus', '× Ius jus'],
+                         STATUS: ['Accepted', 'Synonym', 'Synonym', 'Accepted', 'Synonym', 'Accepted', 'Synonym', 'Synonym',
+                                  'Synonym', 'Synonym']})
+
+
+def test_name_index_counts():
+    codes, name_index = get_name_index(_make_wcvp_data(), count_genera=True)
+    aus_bus = name_index.loc['Aus bus']
+    assert (aus_bus['records'], aus_bus['distinct_accepted'], aus_bus['distinct_accepted_genera']) == (3, 3, 2)
+    assert aus_bus['has_accepted_record'] and not name_index.loc['Gus hus', 'has_accepted_record']
+    assert name_index.loc['Gus hus', 'distinct_accepted_genera'] == 1
+    assert 'distinct_accepted_genera' not in get_name_index(_make_wcvp_data())[1].columns
+
+
+def test_homonyms_from_shared_index():
+    wcvp_data = _make_wcvp_data()
+    codes, name_index = get_name_index(wcvp_data)
+    all_homonyms = find_all_homonyms(wcvp_data, codes, name_index)
+    ambiguous_homonyms = find_ambiguous_homonyms(wcvp_data, codes, name_index)
+    pd.testing.assert_frame_equal(all_homonyms, find_all_homonyms(wcvp_data))
+    pd.testing.assert_frame_equal(ambiguous_homonyms, find_ambiguous_homonyms(wcvp_data))
+
+    assert all_homonyms.index.tolist() == [0, 1, 2, 3, 4, 6, 7, 8, 9]
+    # Missing names are never ambiguous
+    assert ambiguous_homonyms.index.tolist() == [0, 1, 2, 8, 9]
+
+
+def test_latest_snapshot_not_cached(tmp_path, monkeypatch):
+    downloads = []
+
+    def get_all_taxa(ranks, version):
+        downloads.append(version)
+        return _make_wcvp_data()
+
+    monkeypatch.setattr(get_homonyms, 'get_all_taxa', get_all_taxa)
+    monkeypatch.setattr(get_homonyms, 'snapshot_path', str(tmp_path))
+    monkeypatch.setattr(get_homonyms, 'WCVP_VERSION', None)
+    get_homonyms.get_wcvp_snapshot()
+    get_homonyms.get_wcvp_snapshot()
+    assert downloads == [None, None] and list(tmp_path.iterdir()) == []
+
+    monkeypatch.setattr(get_homonyms, 'WCVP_VERSION', '12')
+    first = get_homonyms.get_wcvp_snapshot()
+    pd.testing.assert_frame_equal(get_homonyms.get_wcvp_snapshot(), first)
+    assert downloads == [None, None, '12'] and len(list(tmp_path.iterdir())) == 1
+
+
+def test_incremental_update_needs_a_different_explicit_version(monkeypatch):
+    monkeypatch.setattr(get_homonyms, 'WCVP_VERSION', None)
+    with pytest.raises(ValueError):
+        get_homonyms.check_previous_version('11')
+    with pytest.raises(ValueError):
+        get_homonyms.update_homonym_files('11', _make_wcvp_data())
+
+    monkeypatch.setattr(get_homonyms, 'WCVP_VERSION', 12)
+    with pytest.raises(ValueError):
+        get_homonyms.check_previous_version('12')
+    get_homonyms.check_previous_version('11')
+
+
+def test_duplicates_exclude_missing_names(tmp_path, monkeypatch):
+    monkeypatch.setattr(get_homonyms, 'taxonomy_inputs_output_path', str(tmp_path))
+    df = pd.DataFrame({'taxon_name_with_authors': ['Aus bus L.', 'Aus bus L.', None, None, 'Cus dus Mill.'],
+                       wcvp_accepted_columns['name']: ['Aus bus', 'Aus cus', 'Eus fus', 'Gus hus', 'Cus dus'],
+                       STATUS: ['Accepted', 'Synonym', 'Synonym', 'Synonym', 'Accepted']})
+    get_homonyms.assess_duplicates(df)
+    for file_name in ['duplicate_names_with_authors.csv', 'duplicates_with_different_accepted_names.csv']:
+        saved = pd.read_csv(tmp_path / file_name)
+        assert saved['taxon_name_with_authors'].tolist() == ['Aus bus L.', 'Aus bus L.']
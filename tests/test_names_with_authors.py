@@ -0,0 +1,39 @@
+import random
+
+import pandas as pd
+from wcvpy.wcvp_download import wcvp_columns
+
+from taxonomy_inputs import add_authors_to_names
+from taxonomy_inputs.benchmarks import add_authors_to_names_by_row
+
+
+def _make_species_data(number_of_records: int, seed: int = 0) -> pd.DataFrame:
+    # Names and authors with missing values and runs of the whitespace characters found in WCVP
+    rng = random.Random(seed)
+    whitespace = [' ', '  ', '\t', '\n', '\xa0', '\u2009', ' \u3000 ']
+
+    def _words(options, number_of_words):
+        return rng.choice(['', ' ', '\t']) + rng.choice(whitespace).join(rng.choice(options) for _ in range(number_of_words))
+
+    records = []
+    for _ in range(number_of_records):
+        genus = rng.choice(['Aus', 'Bus', '× Cus', 'Dus'])
+        species = _words(['bus', 'cus', 'dus-eus', '× fus'], 1)
+        authors = [None if rng.random() < 0.2 else _words(['L.', 'Mill.', '(Lam.)', 'DC.', 'ex', 'Hook.f.'], rng.randint(1, 4))
+                   for _ in range(3)]
+        records.append({wcvp_columns['name']: genus + rng.choice(whitespace) + species, wcvp_columns['genus']: genus,
+                        'species': None if rng.random() < 0.05 else species, wcvp_columns['authors']: authors[0],
+                        wcvp_columns['paranthet_author']: authors[1], wcvp_columns['primary_author']: authors[2]})
+    return pd.DataFrame(records)
+
+
+def test_add_authors_to_names_matches_by_row():
+    species_data = _make_species_data(5000)
+    vectorised_data = species_data.copy()
+    add_authors_to_names(vectorised_data)
+    by_row_data = species_data.copy()
+    add_authors_to_names_by_row(by_row_data)
+
+    added_columns = [c for c in vectorised_data.columns if c not in species_data.columns]
+    assert len(added_columns) == 8
+    pd.testing.assert_frame_equal(vectorised_data[added_columns], by_row_data[added_columns])
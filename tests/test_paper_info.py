@@ -0,0 +1,100 @@
+import json
+import zlib
+
+import pandas as pd
+import pyarrow as pa
+
+import search_for_ambiguity
+from CORE_searches import HomonymMatcher, longest_ambiguous_homonym, longest_potential_disambiguator
+from synthetic_corpus import make_synthetic_filter_dict, write_synthetic_corpus
+
+FILTER_DICT = {'aus bus': {'aus bus l'}, 'cus dus': {'cus dus mill'}}
+JOURNALS = [{'title': 'Journal of Botany', 'identifiers': ['issn:1234-5678', '1234-5678']}, {'title': None, 'identifiers': []}]
+
+
+def _make_paper(core_id: int, text: str) -> dict:
+    return {'coreId': str(core_id), 'language': {'code': 'en', 'name': 'English'}, 'journals': JOURNALS, 'subjects': [],
+            'topics': [], 'year': 2001, 'issn': None, 'doi': f'10.0000/{core_id}', 'oai': None, 'title': f' Paper\n{core_id}',
+            'authors': ['Author, A.'], 'downloadUrl': None, 'fullText': text}
+
+
+def test_records_have_native_types(monkeypatch):
+    monkeypatch.setattr(search_for_ambiguity, 'homonym_matcher',
+                        HomonymMatcher(FILTER_DICT, longest_ambiguous_homonym, longest_potential_disambiguator))
+    record = search_for_ambiguity.process_tar_paper_member_lines([json.dumps(_make_paper(1, 'Aus bus L. and Cus dus')).encode()])
+    assert record['year'] == 2001
+    assert record['journals'] == JOURNALS
+    assert record['disambiguators'] == [{'homonym': 'aus bus', 'terms': ['aus bus l']}]
+    table = pa.Table.from_pylist([record], schema=search_for_ambiguity.get_paper_info_schema())
+    assert table.column('year').to_pylist() == [2001]
+
+    # As read from the extracted corpus
+    compressed_lines = [zlib.compress(json.dumps(_make_paper(1, 'Aus bus L. and Cus dus')).encode())]
+    assert search_for_ambiguity.process_tar_paper_member_lines(compressed_lines, compressed=True) == record
+
+
+def test_legacy_csv_converted_to_partition(tmp_path):
+    # As saved by earlier runs, with lists and dicts as their repr and the year missing from one paper
+    legacy_rows = [{'corpusid': '1', 'DOI': '10.0000/1', 'year': 2001.0, 'language': 'en', 'journals': str(JOURNALS), 'issn': None,
+                    'title': 'Paper 1', 'authors': str(['Author, A.']), 'oaurl': None, 'homonym_uses': str(['aus bus', 'cus dus']),
+                    'ambiguous_uses': str(['cus dus']), 'disambiguators': str({'aus bus': ['aus bus l']})},
+                   {'corpusid': '2', 'DOI': None, 'year': None, 'language': None, 'journals': None, 'issn': '1234-5678',
+                    'title': 'Paper, "2"', 'authors': str([]), 'oaurl': 'https://example.org/2.pdf', 'homonym_uses': str(['aus bus']),
+                    'ambiguous_uses': str(['aus bus']), 'disambiguators': str({})}]
+    legacy_path, dataset_path = tmp_path / 'paper_info', str(tmp_path / 'paper_info_dataset')
+    legacy_path.mkdir()
+    pd.DataFrame(legacy_rows).set_index(['corpusid'], drop=True).to_csv(legacy_path / 'provider.csv')
+
+    assert not search_for_ambiguity.provider_already_checked('other_provider', dataset_path, str(legacy_path))
+    assert search_for_ambiguity.provider_already_checked('provider', dataset_path, str(legacy_path))
+    paper_info = search_for_ambiguity.load_paper_info(paper_info_dataset_path=dataset_path).sort_values('corpusid')
+    assert paper_info['corpusid'].tolist() == ['1', '2']
+    assert paper_info['tar_archive_name'].astype(str).tolist() == ['provider', 'provider']
+    assert paper_info['year'].iloc[0] == 2001 and pd.isna(paper_info['year'].iloc[1])
+    assert [j['title'] for j in paper_info['journals'].iloc[0]] == ['Journal of Botany', None]
+    assert paper_info['journals'].iloc[1] is None
+    assert list(paper_info['homonym_uses'].iloc[0]) == ['aus bus', 'cus dus']
+    assert paper_info['title'].tolist() == ['Paper 1', 'Paper, "2"']
+    assert [d['homonym'] for d in paper_info['disambiguators'].iloc[0]] == ['aus bus']
+    assert len(paper_info['disambiguators'].iloc[1]) == 0
+
+
+def test_search_synthetic_corpus(tmp_path):
+    filter_dict = make_synthetic_filter_dict(50)
+    corpus_path = str(tmp_path / 'synthetic_dataset.tar')
+    write_synthetic_corpus(corpus_path, filter_dict, number_of_providers=3, papers_per_provider=10, words_per_paper=500,
+                           homonym_density=0.01, compression='')
+    synthetic_matcher_path = str(tmp_path / 'homonym_matcher.bin')
+    HomonymMatcher(filter_dict, longest_ambiguous_homonym, longest_potential_disambiguator).save(synthetic_matcher_path, {'test': True})
+    output_paths = {'paper_info_dataset_path': str(tmp_path / 'paper_info_dataset'),
+                    'instrumentation_path': str(tmp_path / 'instrumentation'), 'legacy_paper_info_path': str(tmp_path / 'paper_info')}
+
+    for _ in range(2):
+        # The second run finds every provider already checked
+        search_for_ambiguity.get_relevant_papers_from_download(processes=2, core_tar_file=corpus_path,
+                                                               given_matcher_path=synthetic_matcher_path,
+                                                               expected_metadata={'test': True}, **output_paths)
+        paper_info = search_for_ambiguity.load_paper_info(paper_info_dataset_path=output_paths['paper_info_dataset_path'])
+        assert sorted(paper_info['tar_archive_name'].astype(str).unique()) == ['0.tar', '1.tar', '2.tar']
+        assert 0 < len(paper_info) <= 30
+        assert all(len(uses) > 0 for uses in paper_info['homonym_uses'])
+
+
+def test_profile_with_given_matcher(tmp_path):
+    filter_dict = make_synthetic_filter_dict(50)
+    corpus_path = str(tmp_path / 'synthetic_dataset.tar')
+    write_synthetic_corpus(corpus_path, filter_dict, number_of_providers=2, papers_per_provider=10, words_per_paper=500,
+                           homonym_density=0.01, compression='')
+    synthetic_matcher_path = str(tmp_path / 'homonym_matcher.bin')
+    HomonymMatcher(filter_dict, longest_ambiguous_homonym, longest_potential_disambiguator).save(synthetic_matcher_path, {'test': True})
+    output_paths = {'paper_info_dataset_path': str(tmp_path / 'paper_info_dataset'),
+                    'instrumentation_path': str(tmp_path / 'instrumentation'), 'legacy_paper_info_path': str(tmp_path / 'paper_info')}
+
+    search_for_ambiguity.get_relevant_papers_from_download(processes=1, core_tar_file=corpus_path, instrument=True, profile_every=1,
+                                                           given_matcher_path=synthetic_matcher_path,
+                                                           expected_metadata={'test': True}, **output_paths)
+    assert sorted(p.name for p in (tmp_path / 'instrumentation').glob('*.prof')) == ['0.tar.prof', '1.tar.prof']
+    paper_info = search_for_ambiguity.load_paper_info(paper_info_dataset_path=output_paths['paper_info_dataset_path'])
+    assert 0 < len(paper_info) <= 20
+    # The matcher is only loaded in this process while profiling
+    assert search_for_ambiguity.homonym_matcher is None
@@ -0,0 +1,78 @@
+import random
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from taxonomy_inputs import parse_publication_years, PUBLICATION_YEAR_CORRECTIONS
+
+
+def parse_publication_year(given_string: str):
+    '''
+    Original row by row parsing of a first_published string, which parse_publication_years should agree with.
+    '''
+    if given_string == '(1981 publ. 1082)':  # An exception that returns a valid date
+        return '1982'
+    elif given_string in ['(19166)',
+                          '(19543)',
+                          '(19553)',
+                          '(19667)',
+                          '(19983)',
+                          ]:  # Some obivous errors that return valid dates
+        return np.nan
+
+    try:
+        out = given_string[-5:-1]
+    except TypeError:
+        out = given_string
+    finally:
+        return _parse_year_string(out)
+
+
+def _parse_year_string(given_str):
+    format = "%Y"
+    if given_str == '' or given_str is None or given_str != given_str:
+        return np.nan
+    else:
+        try:
+            datetime.strptime(given_str, format)
+            return given_str
+        except ValueError:
+            return np.nan
+
+
+def _make_first_published_strings(number_of_strings: int, seed: int = 0) -> list:
+    # Mostly well formed years, with corrections, missing values and random strings of digits and punctuation
+    rng = random.Random(seed)
+    characters = list('0123456789') * 4 + list('() .,-publ\n') + ['\u0661', '\u0669', '\uff10']
+    strings = [None, float('nan'), '', '(0000)', '1981)', '(1981']
+    while len(strings) < number_of_strings:
+        r = rng.random()
+        if r < 0.3:
+            strings.append(f'({rng.randint(0, 2100):04d})')
+        elif r < 0.35:
+            strings.append(rng.choice(list(PUBLICATION_YEAR_CORRECTIONS)))
+        else:
+            strings.append(''.join(rng.choice(characters) for _ in range(rng.randint(0, 9))))
+    return strings
+
+
+def _parse_by_row(first_published: pd.Series) -> pd.Series:
+    # int rather than to_numeric, as strptime also accepts digits outside ASCII
+    return first_published.apply(parse_publication_year).map(int, na_action='ignore').astype('Int64')
+
+
+def test_parse_publication_years_matches_by_row():
+    first_published = pd.Series(_make_first_published_strings(20000), dtype=object)
+    pd.testing.assert_series_equal(parse_publication_years(first_published), _parse_by_row(first_published), check_names=False)
+
+
+def test_parse_publication_years_of_string_dtype():
+    first_published = pd.Series([s for s in _make_first_published_strings(2000, seed=1) if isinstance(s, str)], dtype='string')
+    pd.testing.assert_series_equal(parse_publication_years(first_published), _parse_by_row(first_published.astype(object)),
+                                   check_names=False)
+
+
+def test_parse_publication_years_examples():
+    years = parse_publication_years(pd.Series(['Sp. Pl.: 123 (1753)', '(1981 publ. 1082)', '(19166)', '(0000)', None, 'n.d.']))
+    assert years.tolist() == [1753, 1982, pd.NA, pd.NA, pd.NA, pd.NA]
@@ -0,0 +1,16 @@
+import numpy as np
+import pandas as pd
+from wcvpy.wcvp_download import wcvp_accepted_columns
+
+from region_counts import SUBSET_COLUMN, get_species_subsets
+
+SPECIES = wcvp_accepted_columns['species']
+FAMILY = wcvp_accepted_columns['family']
+
+
+def test_species_subsets_without_missing_groups():
+    df = pd.DataFrame({SPECIES: ['Aus bus', 'Aus cus', 'Dus eus', 'Fus gus'], FAMILY: ['Ausaceae', 'Ausaceae', np.nan, 'Fusaceae']})
+    subsets = get_species_subsets({'Homonyms': df}, by=FAMILY)
+    assert set(subsets[SUBSET_COLUMN]) == {'Homonyms: Ausaceae', 'Homonyms: Fusaceae'}
+    assert set(subsets[SPECIES]) == {'Aus bus', 'Aus cus', 'Fus gus'}
+    assert len(get_species_subsets({'Homonyms': df})) == 4
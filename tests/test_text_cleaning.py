@@ -0,0 +1,119 @@
+import random
+import re
+
+import pytest
+
+from CORE_searches import clean_paper_text, clean_string, get_body_text_end, tokenise_paper_text
+
+_reference_regex = re.compile(r"^\s*\d*\s*References\s*\n", flags=re.IGNORECASE | re.MULTILINE)
+_supp_regex = re.compile(r"^\s*\d*\s*Supplementary material\s*\n", flags=re.IGNORECASE | re.MULTILINE)
+_conf_regex = re.compile(r"^\s*\d*\s*Conflict of interest\s*\n", flags=re.IGNORECASE | re.MULTILINE)
+_ackno_regex = re.compile(r"^\s*\d*\s*Acknowledgments\s*\n", flags=re.IGNORECASE | re.MULTILINE)
+
+
+def retrieve_text_before_phrase(given_text: str, my_regex, simple_string: str, simple_string_lower: str) -> str:
+    if simple_string in given_text or simple_string_lower in given_text:
+
+        text_split = my_regex.split(given_text, maxsplit=1)
+
+        pre_split = text_split[0]
+        if len(text_split) > 1:
+            post_split = text_split[1]
+            # if text after split point is longer than before, then revert.
+            if len(post_split) > len(pre_split):
+                pre_split = given_text
+
+        return pre_split
+    else:
+
+        return given_text
+
+
+def clean_paper_text_by_splitting(text: str) -> str:
+    '''
+    Original implementation of clean_paper_text, splitting the text at each heading in turn, which get_body_text_end should agree
+    with.
+    '''
+    pre_reference = retrieve_text_before_phrase(text, _reference_regex, 'References', 'references')
+    pre_supplementary = retrieve_text_before_phrase(pre_reference, _supp_regex, 'Supplementary material', 'supplementary material')
+    pre_conflict = retrieve_text_before_phrase(pre_supplementary, _conf_regex, 'Conflict of interest', 'conflict of interest')
+    pre_acknowledgement = retrieve_text_before_phrase(pre_conflict, _ackno_regex, 'Acknowledgments', 'acknowledgments')
+
+    return clean_string(pre_acknowledgement)
+
+
+BODY = 'Aus bus L. was collected from the field, and the leaves of Cus dus (Mill.) were dried.\nExtracts showed activity.\n'
+TAIL = 'Smith, J. (2001) Aus bus in the wild. Journal of Botany.\n'
+
+# Headings as they appear in papers, in the case, numbering and spacing variants the regexes allow
+HEADING_VARIANTS = ['References\n', 'references\n', 'REFERENCES\n', 'ReFeReNcEs\n', '7 References\n', '  12  References  \n',
+                    'References\r\n', '\n\nReferences\n', 'Supplementary material\n', 'Supplementary Material\n',
+                    'SUPPLEMENTARY MATERIAL\n', '3. Supplementary material\n', 'Conflict of interest\n', 'Conflict Of Interest\n',
+                    '4 conflict of interest\n', 'Acknowledgments\n', 'ACKNOWLEDGMENTS\n', '10 Acknowledgments\n',
+                    'Acknowledgements\n']
+
+# Texts exercising each branch of the heading search
+FIXTURE_TEXTS = [
+    '',
+    BODY,
+    # Heading words that aren't headings on their own line
+    BODY + 'See the References for details.\n' + TAIL,
+    BODY + 'References cited here\n' + TAIL,
+    BODY + 'References',
+    # Only the upper case heading, which isn't looked for
+    BODY + 'REFERENCES\n' + TAIL,
+    # The lower case word elsewhere lets the upper case heading be found
+    BODY + 'as in the references\nREFERENCES\n' + TAIL,
+    # Numbered headings
+    BODY + '12 References\n' + TAIL,
+    BODY + '1 Acknowledgments\nWe thank\n2 References\n' + TAIL,
+    BODY + ' 3 Conflict of interest \nNone\n',
+    # Repeated headings, the first is used
+    BODY * 3 + 'References\n' + TAIL + 'References\n' + TAIL,
+    BODY * 3 + 'Acknowledgments\nWe thank\n' + BODY + 'Acknowledgments\n' + TAIL,
+    # The tail after a heading is longer than the text before it, so the heading is ignored
+    'Intro\nReferences\n' + BODY * 3,
+    'Intro\nAcknowledgments\n' + BODY + 'References\n' + TAIL,
+    BODY + 'Supplementary material\n' + BODY * 2 + 'References\n' + TAIL,
+    # Later headings found in the body left after an earlier heading is removed
+    BODY * 4 + 'Conflict of interest\nNone\nSupplementary material\nTable S1\nReferences\n' + TAIL,
+    BODY * 4 + 'Acknowledgments\n' + BODY + 'Conflict of interest\n' + BODY + 'References\n' + BODY * 5,
+    # Blank lines and whitespace between headings
+    BODY * 2 + '\n\n  \nReferences\n\n' + TAIL,
+    BODY * 2 + '\t5\tSupplementary material\t\n' + TAIL,
+    # Headings at the start and end of the text
+    'References\n' + TAIL,
+    BODY + 'References\n',
+    'Acknowledgments\n',
+]
+
+
+def _make_random_texts(number_of_texts: int, seed: int = 0):
+    # Random sequences of body and tail paragraphs and headings, so that headings repeat and interleave in many orders
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(number_of_texts):
+        parts = []
+        for _ in range(rng.randint(1, 12)):
+            parts.append(rng.choice([BODY, BODY, TAIL, rng.choice(HEADING_VARIANTS)]) * rng.randint(1, 3))
+        texts.append(''.join(parts))
+    return texts
+
+
+CORPUS = FIXTURE_TEXTS + [BODY + heading + TAIL for heading in HEADING_VARIANTS] + _make_random_texts(500)
+
+
+@pytest.mark.parametrize('text', CORPUS)
+def test_tokenise_paper_text_matches_splitting(text):
+    expected_body = clean_paper_text_by_splitting(text)
+    assert clean_string(text[:get_body_text_end(text)]) == expected_body
+    assert clean_paper_text(text) == expected_body
+    assert tokenise_paper_text(text) == (expected_body.split(), clean_string(text).split())
+
+
+def test_body_ends_at_headings():
+    assert clean_paper_text(BODY + '12 References\n' + TAIL) == clean_string(BODY)
+    assert clean_paper_text(BODY + 'REFERENCES\n' + TAIL) == clean_string(BODY + 'REFERENCES\n' + TAIL)
+    # The text after the heading is longer, so the whole text is kept
+    assert clean_paper_text('Intro\nReferences\n' + BODY * 3) == clean_string('Intro\nReferences\n' + BODY * 3)
+    assert clean_paper_text(BODY * 3 + 'References\n' + TAIL + 'References\n' + TAIL) == clean_string(BODY * 3)